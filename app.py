@@ -1,14 +1,52 @@
-from app.nlp_processor import process_command, nlp
-from app.gmail import GmailOperations
+import os
+
+# Green-thread servers need the standard library patched before anything else is
+# imported, so that Gmail, Redis and message-queue sockets yield to the event loop.
+# The mode is always explicit: left to itself Flask-SocketIO picks eventlet or
+# gevent whenever one is installed, without the patching and offloading below.
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or 'threading'
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from app.nlp_processor import process_command, process_commands, process_partial, command_cache, partial_cache, load_models
+from app.gmail import GmailOperations, EmailCursor
+from app.cache import MessageCache
+from app.search_index import SearchIndex
+from app.workers import CommandExecutor, offload
+from app.service_pool import DEFAULT_ACCOUNT, AccountNotAuthorizedError, GmailServicePool
+from app.access import AccountAccess, AccountAccessError
+from app.quota import GmailThrottledError, QuotaScheduler
+from app.singleflight import SingleFlight
+from app.prefetch import Prefetcher
+from app.speculation import Speculator
+from app.category_plans import category_query
+from app.state import make_store
+from app.outbox import Outbox, SENT, FAILED
+from app import metrics
+from app.tts import RESPONSE, SNIPPET, Pyttsx3Synthesizer, SpeechRenderer
+from app.records import PAYLOAD_FORMATS, TEXT, format_email, snippet_payload, snippets_payload
+from app.batch import MAX_BATCH_COMMANDS, MODES, NLP_CHUNK_SIZE, REPLAY, SCRIPT, BatchSession, CoalescingGmailOps, chunks
+import math
 import re
+import threading
+import time
+import uuid
 
 
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, request, jsonify
+from flask_socketio import ConnectionRefusedError, SocketIO, emit
 from flask_cors import CORS
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Several server processes can share clients through a message queue (e.g.
+# SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0), behind a load balancer with
+# sticky sessions; emits to a sid then reach it whichever process handles it.
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE,
+                    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None)
 
 @app.errorhandler(500)
 def handle_internal_server_error(e):
@@ -22,29 +60,351 @@ def handle_not_found_error(e):
     response_text = "The page or resource you requested was not found."
     return response_text, 404
 
-try:
-    gmail_ops = GmailOperations()
-except Exception as e:
-    print(f"Error initializing GmailOperations: {e}")
-    gmail_ops = None
+gmail_ops = None
+service_pool = None
+# One scheduler for the process, so every client on an account shares its quota.
+quota_scheduler = QuotaScheduler(units_per_second=float(os.environ.get('VOICE_AGENT_QUOTA_UNITS_PER_SECOND', 250)))
+# Likewise one single-flight layer, so identical listings from many clients of an
+# account run once; results are reused for VOICE_AGENT_RESULT_TTL seconds.
+single_flight = SingleFlight(ttl=float(os.environ.get('VOICE_AGENT_RESULT_TTL', 5)))
+backend_ready = threading.Event()
+STARTUP_WAIT_SECONDS = 60
+
+def init_backend():
+    global gmail_ops, service_pool
+    try:
+        try:
+            offload(SOCKETIO_ASYNC_MODE, load_models)
+        except Exception as e:
+            print(f"Error loading NLP models: {e}")
+        try:
+            service_pool = GmailServicePool(os.environ.get('VOICE_AGENT_TOKEN_DIR', 'tokens'))
+            gmail_ops = build_gmail_ops(DEFAULT_ACCOUNT)
+        except Exception as e:
+            print(f"Error initializing GmailOperations: {e}")
+            gmail_ops = None
+    finally:
+        backend_ready.set()
+        socketio.emit('backend_ready', {'ready': gmail_ops is not None})
+
+def build_gmail_ops(account):
+    if account != DEFAULT_ACCOUNT:
+        # Validates the account name before it is used in a file name.
+        service_pool.credentials(account)
+    cache_path = os.environ.get('VOICE_AGENT_CACHE_PATH', 'mail_cache.sqlite3')
+    if account != DEFAULT_ACCOUNT:
+        root, ext = os.path.splitext(cache_path)
+        cache_path = f"{root}.{account}{ext}"
+    message_cache = MessageCache(cache_path)
+    search_index = SearchIndex(message_cache) if os.environ.get('VOICE_AGENT_LOCAL_SEARCH') == '1' else None
+    return GmailOperations(cache=message_cache, search_index=search_index, pool=service_pool, account=account,
+                           scheduler=quota_scheduler, single_flight=single_flight)
+
+# With VOICE_AGENT_LAZY_START=1 the server starts accepting connections straight away
+# and loads the NLP models and Gmail client in the background; commands that arrive
+# before that finishes wait for it. Otherwise everything is loaded at import time.
+if os.environ.get('VOICE_AGENT_LAZY_START') == '1':
+    socketio.start_background_task(init_backend)
+else:
+    init_backend()
+
+# Conversation state lives in a store so abandoned flows expire and, with
+# VOICE_AGENT_STATE_URL=redis://..., state is shared by every server process.
+STATE_URL = os.environ.get('VOICE_AGENT_STATE_URL')
+STATE_TTL = float(os.environ.get('VOICE_AGENT_STATE_TTL', 900))
+active_conversations = make_store(STATE_URL, 'conversation', STATE_TTL)
+
+# The cursor of each client's last listing, so "next 20" resumes after it.
+list_cursors = make_store(STATE_URL, 'cursor', STATE_TTL)
+
+# Clients pick a mailbox with ?account=<name> on connect; each account has its own
+# GmailOperations (and message cache), all sharing the one service pool. Which
+# accounts a client may pick is decided by the access token it presents (Socket.IO
+# auth {token} or an Authorization: Bearer header); without VOICE_AGENT_ACCESS_TOKENS
+# only the default account is served.
+account_access = AccountAccess.from_spec(os.environ.get('VOICE_AGENT_ACCESS_TOKENS'))
+client_accounts = {}
+# Clients that can rebuild the spoken text themselves connect with ?payload=columnar
+# (or msgpack) to get email_snippets as one list per field, and each streamed
+# email_snippet as its fields; see app/records.py.
+client_payloads = {}
+account_ops = {}
+account_ops_lock = threading.Lock()
+
+# Batch requests run commands under made-up sids, each mapped to a session that
+# collects the events run_command sends and supplies the batch's GmailOperations.
+batch_sessions = {}
+
+def request_token(auth=None):
+    if isinstance(auth, dict) and auth.get('token'):
+        return auth['token']
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+def ops_for_sid(sid):
+    session = batch_sessions.get(sid)
+    if session is not None:
+        return session.ops
+    return ops_for_account(client_accounts.get(sid, DEFAULT_ACCOUNT), sid)
+
+def ops_for_account(account, sid=None):
+    if account == DEFAULT_ACCOUNT or service_pool is None:
+        return gmail_ops
+    with account_ops_lock:
+        ops = account_ops.get(account)
+        if ops is None:
+            try:
+                ops = account_ops[account] = build_gmail_ops(account)
+            except AccountNotAuthorizedError as e:
+                print(f"[{sid or account}] {e}")
+                return None
+        return ops
+
+# With VOICE_AGENT_ASYNC=1 commands run on a bounded worker pool and results are
+# emitted back to the client's sid when ready, instead of inside the event handler.
+# Green-thread servers always do this, so a handler never holds up the event loop.
+if os.environ.get('VOICE_AGENT_ASYNC') == '1' or SOCKETIO_ASYNC_MODE in ('eventlet', 'gevent'):
+    command_executor = CommandExecutor(
+        max_workers=int(os.environ.get('VOICE_AGENT_WORKERS', 8)),
+        max_pending=int(os.environ.get('VOICE_AGENT_MAX_PENDING', 256)),
+        max_queued_per_client=int(os.environ.get('VOICE_AGENT_MAX_QUEUED_PER_CLIENT', 4)),
+    )
+else:
+    command_executor = None
 
-active_conversations = {}
+# With VOICE_AGENT_PREFETCH=1 the next page of a listing and the most-asked-for
+# categories are fetched into the message cache while the user listens.
+prefetcher = Prefetcher(units_per_second=float(os.environ.get('VOICE_AGENT_PREFETCH_UNITS_PER_SECOND', 25))) \
+    if os.environ.get('VOICE_AGENT_PREFETCH') == '1' else None
+
+# Clients send partial_command_event with interim transcripts while the user is
+# still speaking; each is classified and the listing it asks for fetched into the
+# message cache, so the final command finds it there. Guesses cost Gmail quota,
+# so this is only on with VOICE_AGENT_SPECULATE=1;
+# VOICE_AGENT_SPECULATION_UNITS_PER_SECOND caps what it spends.
+def speculation_plan(sid, text):
+    # Returns (ops, query, max_results) of the listing text asks for, as run_command
+    # would make it, or None when it asks for none.
+    if not backend_ready.is_set() or sid in batch_sessions or active_conversations.get(sid) is not None:
+        return None
+    if "cancel" in text or "never mind" in text:
+        return None
+    ops = ops_for_sid(sid)
+    if ops is None or ops.cache is None:
+        return None
+    nlp_result = offload(SOCKETIO_ASYNC_MODE, process_partial, text)
+    count, _ = requested_count(text, nlp_result["type"])
+    if nlp_result["type"] == "UNDERSTAND":
+        if ops.search_index is not None:
+            # Categories are answered from the local index.
+            return None
+        query = category_query(nlp_result["parameters"]["category"])
+        return (ops, query, count or CATEGORY_PAGE_SIZE) if query is not None else None
+    if nlp_result["type"] in ("READ_EMAIL", "SEARCH_EMAIL"):
+        query = nlp_result["parameters"]["query"]
+        # A free-text search for the words heard so far ("search emails from") is
+        # unlikely to be the final query, so it is not worth the quota.
+        if not query or query == text:
+            return None
+        return ops, query, count or LIST_PAGE_SIZE
+    return None
+
+speculator = Speculator(speculation_plan, units_per_second=float(os.environ.get('VOICE_AGENT_SPECULATION_UNITS_PER_SECOND', 50))) \
+    if os.environ.get('VOICE_AGENT_SPECULATE') == '1' else None
+
+# Outgoing mail is written to a local SQLite outbox and sent by background threads,
+# so "send" answers as soon as the email is safely queued and nothing is lost on a
+# restart. Clients get an email_status event as each email is sent or fails.
+def send_email_status(job):
+    send_to(job['sid'], 'email_status', {
+        'id': job['id'], 'status': job['status'], 'to': job['recipient'], 'subject': job['subject'],
+        'attempts': job['attempts'], 'error': job['last_error'] if job['status'] == FAILED else None,
+    })
+
+outbox = Outbox(os.environ.get('VOICE_AGENT_OUTBOX_PATH', 'outbox.sqlite3'), resolve_ops=ops_for_account,
+                on_status=send_email_status, senders=int(os.environ.get('VOICE_AGENT_OUTBOX_SENDERS', 2)))
+
+# Streaming clients get the first few results in a small batch, then one event per
+# email as each batch arrives, instead of a single email_snippets event at the end.
+STREAM_FIRST_CHUNK = 3
+
+NO_COMMAND_TEXT = "No command received. Please try speaking or typing a command."
+BUSY_TEXT = "I'm still working on your earlier requests. Please wait a moment and try again."
+STARTING_UP_TEXT = "Give me a moment, I'm still starting up."
+CANCELLED_TEXT = "Okay, I've cancelled the current operation. What else can I help with?"
+ASK_RECIPIENT_TEXT = "Okay, I can help send an email. Who is the recipient?"
+NO_EMAILS_TEXT = "No emails found matching your query."
+EMAILS_FOUND_TEXT = "Okay, here are the emails I found:"
+
+# With VOICE_AGENT_TTS=1 (and pyttsx3 installed) clients that connect with ?tts=1
+# also get agent_audio events: each response and each email snippet rendered to
+# audio by one background thread, for browsers without usable speech synthesis.
+# The fixed prompts are rendered at startup and responses are cached by text. The
+# speech engine blocks its thread while rendering, which under eventlet or gevent
+# would stall every client, so server-side speech is only used with real threads.
+SPOKEN_PROMPTS = (NO_COMMAND_TEXT, BUSY_TEXT, STARTING_UP_TEXT, CANCELLED_TEXT, ASK_RECIPIENT_TEXT,
+                  NO_EMAILS_TEXT, EMAILS_FOUND_TEXT)
+tts_clients = set()
+
+def send_audio(sid, payload):
+    if sid in tts_clients:
+        send_to(sid, 'agent_audio', payload)
+
+if os.environ.get('VOICE_AGENT_TTS') == '1' and SOCKETIO_ASYNC_MODE in ('eventlet', 'gevent'):
+    print(f"VOICE_AGENT_TTS is not supported with SOCKETIO_ASYNC_MODE={SOCKETIO_ASYNC_MODE}; server-side speech is off.")
+    speech_renderer = None
+elif os.environ.get('VOICE_AGENT_TTS') == '1':
+    speech_renderer = SpeechRenderer(
+        lambda: Pyttsx3Synthesizer(rate=int(os.environ.get('VOICE_AGENT_TTS_RATE', 0)) or None,
+                                   voice=os.environ.get('VOICE_AGENT_TTS_VOICE') or None),
+        on_audio=send_audio, max_entries=int(os.environ.get('VOICE_AGENT_TTS_CACHE_ENTRIES', 256)))
+    speech_renderer.prewarm(SPOKEN_PROMPTS)
+else:
+    speech_renderer = None
+
+def speak(sid, text, kind=RESPONSE):
+    if speech_renderer is not None and sid in tts_clients:
+        speech_renderer.submit(sid, text, kind)
+
+def send_to(sid, event, payload):
+    metrics.record_response()
+    session = batch_sessions.get(sid)
+    if session is not None:
+        session.collect(event, payload)
+        return
+    metrics.SOCKET_EMITS.inc(event=event)
+    with metrics.span('socket.emit'):
+        socketio.emit(event, payload, room=sid)
+    if event == 'agent_response':
+        speak(sid, payload.get('text'))
+
+def send_snippets(sid, emails, first_index):
+    send_to(sid, 'email_snippets', snippets_payload(emails, first_index, client_payloads.get(sid, TEXT)))
+    if speech_renderer is not None and sid in tts_clients:
+        for idx, email in enumerate(emails, first_index):
+            speak(sid, format_email(idx, email), SNIPPET)
+
+def send_throttled(sid, error):
+    response_text = f"Gmail is limiting how fast I can fetch right now. Please try again in {math.ceil(error.retry_after)} seconds."
+    send_to(sid, 'agent_response', {'text': response_text, 'type': 'throttled', 'retry_after': error.retry_after})
+
+def stream_emails(sid, chunks, intro_message, empty_message, first_index=1):
+    payload_format = client_payloads.get(sid, TEXT)
+    count = 0
+    try:
+        for chunk in chunks:
+            for email in chunk:
+                if count == 0:
+                    send_to(sid, 'agent_response', {'text': intro_message, 'type': 'speaking_intro'})
+                count += 1
+                send_to(sid, 'email_snippet', snippet_payload(count, first_index + count - 1, email, payload_format))
+                if speech_renderer is not None and sid in tts_clients:
+                    speak(sid, format_email(first_index + count - 1, email), SNIPPET)
+    finally:
+        send_to(sid, 'email_snippets_done', {'count': count})
+    if count == 0:
+        send_to(sid, 'agent_response', {'text': empty_message, 'type': 'info'})
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/ready')
+def ready():
+    if not backend_ready.is_set():
+        return jsonify({'ready': False}), 503
+    return jsonify({'ready': gmail_ops is not None})
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        'message_cache': gmail_ops.cache_stats() if gmail_ops is not None else None,
+        'command_cache': command_cache.stats(),
+        'partial_cache': partial_cache.stats(),
+        'prefetch': prefetcher.stats() if prefetcher is not None else None,
+        'speculation': speculator.stats() if speculator is not None else None,
+        'outbox': outbox.stats(),
+        'tts': speech_renderer.stats() if speech_renderer is not None else None,
+    })
+
+# Prometheus text format: per-stage and per-intent latency histograms, Gmail call
+# and byte counters, and the stats of every cache and queue as gauges.
+metrics.REGISTRY.register_stats('message_cache', lambda: gmail_ops.cache_stats() if gmail_ops is not None else None)
+metrics.REGISTRY.register_stats('command_cache', command_cache.stats)
+metrics.REGISTRY.register_stats('partial_cache', partial_cache.stats)
+metrics.REGISTRY.register_stats('quota', quota_scheduler.stats)
+metrics.REGISTRY.register_stats('single_flight', single_flight.stats)
+metrics.REGISTRY.register_stats('conversations', active_conversations.stats)
+metrics.REGISTRY.register_stats('outbox', outbox.stats)
+if prefetcher is not None:
+    metrics.REGISTRY.register_stats('prefetch', prefetcher.stats)
+if speculator is not None:
+    metrics.REGISTRY.register_stats('speculation', speculator.stats)
+if command_executor is not None:
+    metrics.REGISTRY.register_stats('executor', command_executor.stats)
+if speech_renderer is not None:
+    metrics.REGISTRY.register_stats('tts', speech_renderer.stats)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+# With VOICE_AGENT_LOG_TIMINGS=1 every command logs how long each stage took.
+LOG_TIMINGS = os.environ.get('VOICE_AGENT_LOG_TIMINGS') == '1'
+
+@app.route('/api/commands', methods=['POST'])
+def batch_commands():
+    data = request.get_json(silent=True) or {}
+    commands, mode, send_mail, error = parse_batch(data)
+    if error is not None:
+        return jsonify({'error': error}), 400
+    try:
+        account = account_access.resolve(request_token(), data.get('account'))
+    except AccountAccessError as e:
+        return jsonify({'error': str(e)}), 403
+    result = run_batch(commands, mode, account, send_mail)
+    if result is None:
+        return jsonify({'error': "Backend is not configured correctly for Gmail operations."}), 503
+    return jsonify(result)
+
 @socketio.on('connect')
-def test_connect():
+def test_connect(auth=None):
+    try:
+        account = account_access.resolve(request_token(auth), request.args.get('account'))
+    except AccountAccessError as e:
+        print('Refused WebSocket client:', request.sid, e)
+        raise ConnectionRefusedError(str(e))
     print('Client connected to WebSocket!', request.sid)
-    emit('status', {'message': 'Connected to Gmail Voice Agent backend.'})
+    if account != DEFAULT_ACCOUNT:
+        client_accounts[request.sid] = account
+    payload_format = request.args.get('payload')
+    if payload_format in PAYLOAD_FORMATS:
+        client_payloads[request.sid] = payload_format
+    if request.args.get('tts') == '1':
+        tts_clients.add(request.sid)
+    emit('status', {'message': 'Connected to Gmail Voice Agent backend.', 'ready': backend_ready.is_set()})
 
 @socketio.on('disconnect')
 def test_disconnect():
     print('Client disconnected from WebSocket.', request.sid)
 
-    if request.sid in active_conversations:
-        del active_conversations[request.sid] 
+    active_conversations.delete(request.sid)
+    client_accounts.pop(request.sid, None)
+    client_payloads.pop(request.sid, None)
+    tts_clients.discard(request.sid)
+    if speech_renderer is not None:
+        speech_renderer.forget(request.sid)
+    list_cursors.delete(request.sid)
+    if prefetcher is not None:
+        prefetcher.cancel(request.sid)
+    if speculator is not None:
+        speculator.forget(request.sid)
+
+@socketio.on('partial_command_event')
+def handle_partial_command(data):
+    command = (data or {}).get('command', '').strip().lower()
+    if speculator is not None and command:
+        speculator.partial(request.sid, command)
 
 @socketio.on('process_command_event')
 def handle_command(data):
@@ -52,27 +412,183 @@ def handle_command(data):
     sid = request.sid
 
     if not command:
-        response_text = "No command received. Please try speaking or typing a command."
+        response_text = NO_COMMAND_TEXT
         emit('agent_response', {'text': response_text, 'type': 'error'}, room=sid)
+        speak(sid, response_text)
         return
 
     print(f"[{sid}] Received command: {command}")
+    stream = bool(data.get('stream', False))
+    received = time.perf_counter()
+    if speech_renderer is not None:
+        # Whatever is still queued from the last answer would only talk over this one.
+        speech_renderer.cancel(sid)
+
+    if command_executor is None:
+        dispatch_command(sid, command, stream, received)
+    elif not command_executor.submit(sid, dispatch_command, sid, command, stream, received):
+        response_text = BUSY_TEXT
+        emit('agent_response', {'text': response_text, 'type': 'busy'}, room=sid)
+        speak(sid, response_text)
+
+@socketio.on('process_commands_batch')
+def handle_batch(data):
+    sid = request.sid
+    commands, mode, send_mail, error = parse_batch(data or {})
+    if error is not None:
+        emit('batch_results', {'error': error}, room=sid)
+        return
+    account = client_accounts.get(sid, DEFAULT_ACCOUNT)
+
+    if command_executor is None:
+        dispatch_batch(sid, commands, mode, account, send_mail)
+    elif not command_executor.submit(sid, dispatch_batch, sid, commands, mode, account, send_mail):
+        response_text = BUSY_TEXT
+        emit('agent_response', {'text': response_text, 'type': 'busy'}, room=sid)
+        speak(sid, response_text)
+
+def dispatch_batch(sid, commands, mode, account, send_mail=False):
+    result = run_batch(commands, mode, account, send_mail)
+    if result is None:
+        result = {'error': "Backend is not configured correctly for Gmail operations."}
+    send_to(sid, 'batch_results', result)
+
+def dispatch_command(sid, command, stream=False, received=None):
+    # Time spent queued for a worker counts towards the command's latency.
+    with metrics.trace(received) as command_trace:
+        if speculator is not None:
+            with metrics.span('speculation.settle'):
+                speculator.settle(sid, command)
+        if prefetcher is None:
+            run_command(sid, command, stream)
+        else:
+            with prefetcher.foreground(sid):
+                run_command(sid, command, stream)
+    if LOG_TIMINGS:
+        print(f"[{sid}] Timings: {command_trace.summary()}")
+
+def finish_listing(sid, ops, cursor, category=None):
+    # Saves the advanced cursor for "next", then queues likely follow-ups.
+    list_cursors.set(sid, cursor.to_dict())
+    if prefetcher is not None and sid not in batch_sessions:
+        prefetcher.after_command(sid, ops, cursor, category)
+
+def parse_batch(data):
+    # Returns (commands, mode, send_mail, error) for a batch request body. Emails
+    # are only really sent when the body says "send": true, and never in replay
+    # mode, where re-running a command log would re-send every email in it.
+    commands = data.get('commands')
+    mode = data.get('mode', SCRIPT)
+    send_mail = data.get('send', False)
+    if not isinstance(commands, list) or not all(isinstance(command, str) for command in commands):
+        return None, None, False, "'commands' must be a list of strings."
+    if len(commands) > MAX_BATCH_COMMANDS:
+        return None, None, False, f"At most {MAX_BATCH_COMMANDS} commands per batch."
+    if mode not in MODES:
+        return None, None, False, f"'mode' must be one of: {', '.join(MODES)}."
+    if not isinstance(send_mail, bool):
+        return None, None, False, "'send' must be true or false."
+    if send_mail and mode == REPLAY:
+        return None, None, False, "Emails cannot be sent in replay mode."
+    return [command.strip().lower() for command in commands], mode, send_mail, None
+
+def end_batch_session(sid):
+    batch_sessions.pop(sid, None)
+    active_conversations.delete(sid)
+    list_cursors.delete(sid)
+
+def run_batch(commands, mode, account, send_mail=False):
+    # Runs commands as one scripted conversation (mode 'script': each command sees
+    # the conversation and paging state the previous ones left) or as independent
+    # commands from a log replay (mode 'replay'). NLP runs in batches, and identical
+    # Gmail listings within the batch are fetched once. Returns each command's
+    # intent and the events it would have sent to a client. Unless send_mail is
+    # set, send flows end in a planned_send event instead of queueing the email.
+    if not backend_ready.is_set():
+        backend_ready.wait(STARTUP_WAIT_SECONDS)
+    ops = ops_for_account(account)
+    if ops is None:
+        return None
+    shared_ops = CoalescingGmailOps(ops)
+    script_sid = f"batch-{uuid.uuid4().hex}"
+    results = []
+    try:
+        for chunk in chunks(commands, NLP_CHUNK_SIZE):
+            with metrics.span('nlp.batch'):
+                offload(SOCKETIO_ASYNC_MODE, process_commands, [command for command in chunk if command])
+            for command in chunk:
+                sid = script_sid if mode == SCRIPT else f"batch-{uuid.uuid4().hex}"
+                session = batch_sessions.get(sid)
+                if session is None:
+                    session = batch_sessions[sid] = BatchSession(sid, shared_ops, send_mail)
+                with metrics.trace() as command_trace:
+                    if command:
+                        run_command(sid, command)
+                    else:
+                        send_to(sid, 'agent_response', {'text': "No command received.", 'type': 'error'})
+                results.append({'command': command, 'intent': command_trace.intent, 'events': session.take_events()})
+                if sid != script_sid:
+                    end_batch_session(sid)
+    finally:
+        end_batch_session(script_sid)
+    return {'results': results, 'gmail': shared_ops.stats()}
+
+def queue_email(sid, ops, conversation):
+    # The conversation's send_id is the idempotency key, so a repeated final step
+    # cannot send the same email twice.
+    session = batch_sessions.get(sid)
+    if session is not None and not session.send_mail:
+        session.collect('planned_send', {'to': conversation['to'], 'subject': conversation['subject'], 'body': conversation['body']})
+        return f"Dry run: I would send your email to {conversation['to']}."
+    send_id = conversation.get('send_id') or uuid.uuid4().hex
+    job = outbox.enqueue(send_id, ops.account, sid, conversation['to'], conversation['subject'], conversation['body'])
+    if job['status'] == SENT:
+        return f"That email to {conversation['to']} has already been sent."
+    return f"Okay, sending your email to {conversation['to']}. I'll let you know once it's delivered."
 
-    if gmail_ops is None:
+MAX_FETCH_LIMIT = 100
+LIST_PAGE_SIZE = 50
+CATEGORY_PAGE_SIZE = 20
+
+def requested_count(command, intent):
+    # Returns how many emails the command asks for (None when it names no number)
+    # and, when that had to be adjusted, what to tell the user.
+    match_num = re.search(r'(\d+)\s*.*?\s*(?:emails?|mails?)', command)
+    if intent == "MORE_EMAILS" and not match_num:
+        match_num = re.search(r'(\d+)', command)
+    if not match_num:
+        return None, None
+    specified_num = int(match_num.group(1))
+    if specified_num == 0:
+        return 5, "Please specify a number greater than zero. Fetching default 5 emails for now."
+    if specified_num > MAX_FETCH_LIMIT:
+        return MAX_FETCH_LIMIT, f"I can only fetch up to {MAX_FETCH_LIMIT} emails at a time. Fetching {MAX_FETCH_LIMIT} emails; say 'next' for more."
+    return specified_num, None
+
+def run_command(sid, command, stream=False):
+    if not backend_ready.is_set():
+        send_to(sid, 'agent_response', {'text': STARTING_UP_TEXT, 'type': 'info'})
+        backend_ready.wait(STARTUP_WAIT_SECONDS)
+
+    ops = ops_for_sid(sid)
+    if ops is None:
         response_text = "Backend is not configured correctly for Gmail operations. Please check server logs."
-        emit('agent_response', {'text': response_text, 'type': 'error'}, room=sid)
+        send_to(sid, 'agent_response', {'text': response_text, 'type': 'error'})
         return
     
+    current_conversation = active_conversations.get(sid)
+
     if "cancel" in command or "never mind" in command:
-        if sid in active_conversations:
-            del active_conversations[sid]
-            response_text = "Okay, I've cancelled the current operation. What else can I help with?"
-            emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid)
+        if current_conversation is not None:
+            metrics.set_intent('CANCEL')
+            active_conversations.delete(sid)
+            response_text = CANCELLED_TEXT
+            send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'})
             return
         
-    if sid in active_conversations:
-        current_conversation = active_conversations[sid]
+    if current_conversation is not None:
         intent_type = current_conversation['intent']
+        metrics.set_intent(intent_type)
 
         if intent_type == "SEND_EMAIL":
             if current_conversation['step'] == 'waiting_for_to':
@@ -85,7 +601,8 @@ def handle_command(data):
                     response_text = f"Okay, sending to {recipient}. What should be the subject?"
                 else:
                     response_text = "I couldn't understand the recipient. Please tell me who this email is for?"
-                emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid) 
+                active_conversations.set(sid, current_conversation)
+                send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'}) 
 
             elif current_conversation['step'] == 'waiting_for_subject':
                 subject = command.strip()
@@ -95,7 +612,8 @@ def handle_command(data):
                     response_text = f"Subject is '{subject}'. What should the body of the email say?"
                 else:
                     response_text = "I couldn't get the subject. Please tell me the subject?"
-                emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid) 
+                active_conversations.set(sid, current_conversation)
+                send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'}) 
 
             elif current_conversation['step'] == 'waiting_for_body':
                 body = command.strip()
@@ -103,68 +621,95 @@ def handle_command(data):
                     current_conversation['body'] = body
                     
                     try:
-                        gmail_ops.send_email(current_conversation['to'], current_conversation['subject'], current_conversation['body'])
-                        response_text = "Email sent successfully!"
-                        del active_conversations[sid]
+                        response_text = queue_email(sid, ops, current_conversation)
                     except Exception as e:
                         response_text = f"Failed to send email: {str(e)}"
-                        del active_conversations[sid]
+                    active_conversations.delete(sid)
                 else:
                     response_text = "I couldn't get the body. What should the body of the email say?"
-                emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid) 
+                send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'}) 
             return 
         
-    nlp_result = process_command(command)
+    with metrics.span('nlp'):
+        nlp_result = offload(SOCKETIO_ASYNC_MODE, process_command, command)
+    metrics.set_intent(nlp_result["type"])
 
     response_text = ""
-    emails_data = []
     
-    num_emails_to_fetch_explicitly = None 
-    MAX_FETCH_LIMIT = 100 
+    num_emails_to_fetch_explicitly, count_notice = requested_count(command, nlp_result["type"])
+    if count_notice:
+        send_to(sid, 'agent_response', {'text': count_notice, 'type': 'info'})
 
-    match_num = re.search(r'(\d+)\s*.*?\s*(?:emails?|mails?)', command) 
-    
-    if match_num:
+    # "next 20" / "show more" continue the last listing from its cursor instead of
+    # starting over, by replaying it as the original request.
+    cursor = None
+    if nlp_result["type"] == "MORE_EMAILS":
+        cursor_state = list_cursors.get(sid)
+        cursor = EmailCursor.from_dict(cursor_state) if cursor_state is not None else None
+        if cursor is None:
+            send_to(sid, 'agent_response', {'text': "There's nothing to continue yet. Ask me for some emails first.", 'type': 'info'})
+            return
+        if cursor.exhausted:
+            send_to(sid, 'agent_response', {'text': "That's all the emails for your last request.", 'type': 'info'})
+            return
+        if num_emails_to_fetch_explicitly is None:
+            num_emails_to_fetch_explicitly = cursor.page_size
+        if cursor.category is not None:
+            nlp_result = {"type": "UNDERSTAND", "parameters": {"category": cursor.category}}
+        else:
+            nlp_result = {"type": "READ_EMAIL", "parameters": {"query": cursor.query}}
+    first_index = cursor.offset + 1 if cursor is not None else 1
+
+    if nlp_result["type"] in ("READ_EMAIL", "SEARCH_EMAIL", "UNDERSTAND") and cursor is None:
+        if nlp_result["type"] == "UNDERSTAND":
+            category = nlp_result["parameters"]["category"]
+            cursor = EmailCursor(category_query(category), num_emails_to_fetch_explicitly or CATEGORY_PAGE_SIZE, category)
+        else:
+            cursor = EmailCursor(nlp_result["parameters"]["query"], num_emails_to_fetch_explicitly or LIST_PAGE_SIZE)
+
+    if stream and nlp_result["type"] in ("READ_EMAIL", "SEARCH_EMAIL", "UNDERSTAND"):
+        fetch_kwargs = {'first_chunk_size': STREAM_FIRST_CHUNK, 'max_results': num_emails_to_fetch_explicitly or cursor.page_size, 'cursor': cursor}
         try:
-            specified_num = int(match_num.group(1))
-            
-            if specified_num == 0:
-                num_emails_to_fetch_explicitly = 5 
-                emit('agent_response', {'text': "Please specify a number greater than zero. Fetching default 5 emails for now.", 'type': 'info'}, room=sid)
-            elif specified_num > MAX_FETCH_LIMIT:
-                num_emails_to_fetch_explicitly = MAX_FETCH_LIMIT
-                emit('agent_response', {'text': f"I can only fetch up to {MAX_FETCH_LIMIT} emails for specific requests. Fetching {num_emails_to_fetch_explicitly} emails.", 'type': 'info'}, room=sid)
+            if nlp_result["type"] == "UNDERSTAND":
+                category = nlp_result["parameters"]["category"]
+                chunks = ops.iter_emails_by_category(category, **fetch_kwargs)
+                intro_message = f"Okay, here are {category} emails {first_index} onwards:" if first_index > 1 else f"Okay, here are the {category} emails I found:"
+                stream_emails(sid, chunks, intro_message, f"No {category} emails found matching your query.", first_index)
+                finish_listing(sid, ops, cursor, category)
             else:
-                num_emails_to_fetch_explicitly = specified_num 
-                
-        except ValueError:
-            pass 
+                chunks = ops.iter_emails(nlp_result["parameters"]["query"], **fetch_kwargs)
+                intro_message = f"Okay, here are emails {first_index} onwards:" if first_index > 1 else EMAILS_FOUND_TEXT
+                stream_emails(sid, chunks, intro_message, NO_EMAILS_TEXT, first_index)
+                finish_listing(sid, ops, cursor)
+        except GmailThrottledError as e:
+            send_throttled(sid, e)
+        except Exception as e:
+            response_text = f"Failed to retrieve emails: {str(e)}"
+            send_to(sid, 'agent_response', {'text': response_text, 'type': 'error'})
 
-    if nlp_result["type"] == "READ_EMAIL" or nlp_result["type"] == "SEARCH_EMAIL":
+    elif nlp_result["type"] == "READ_EMAIL" or nlp_result["type"] == "SEARCH_EMAIL":
         try:
             if num_emails_to_fetch_explicitly is not None:
-                emails = gmail_ops.list_emails(nlp_result["parameters"]["query"], max_results=num_emails_to_fetch_explicitly) 
+                emails = ops.list_emails(nlp_result["parameters"]["query"], max_results=num_emails_to_fetch_explicitly, cursor=cursor) 
             else:
-                emails = gmail_ops.list_emails(nlp_result["parameters"]["query"])
+                emails = ops.list_emails(nlp_result["parameters"]["query"], cursor=cursor)
             
             if emails:
                 intro_message = f"Okay, here are the top {len(emails)} emails I found:" if num_emails_to_fetch_explicitly else f"Okay, here are some emails I found ({len(emails)} in total):"
-                emit('agent_response', {'text': intro_message, 'type': 'speaking_intro'}, room=sid)
+                if first_index > 1:
+                    intro_message = f"Okay, here are emails {first_index} to {first_index + len(emails) - 1}:"
+                send_to(sid, 'agent_response', {'text': intro_message, 'type': 'speaking_intro'})
                 
-                for idx, email in enumerate(emails, 1):
-                    email_snippet = email.get('snippet', 'No snippet available.')
-                    email_subject = email.get('subject', 'No subject.')
-                    email_from = email.get('from', 'Unknown Sender')
-
-                    email_output = f"Email {idx} from {email_from}: {email_subject} — {email_snippet}"
-                    emails_data.append(email_output)
-                emit('email_snippets', {'snippets': emails_data}, room=sid)
+                send_snippets(sid, emails, first_index)
             else:
-                response_text = "No emails found matching your query."
-                emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid)
+                response_text = NO_EMAILS_TEXT
+                send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'})
+            finish_listing(sid, ops, cursor)
+        except GmailThrottledError as e:
+            send_throttled(sid, e)
         except Exception as e:
             response_text = f"Failed to retrieve emails: {str(e)}"
-            emit('agent_response', {'text': response_text, 'type': 'error'}, room=sid)
+            send_to(sid, 'agent_response', {'text': response_text, 'type': 'error'})
 
     
     elif nlp_result["type"] == "UNDERSTAND":
@@ -172,66 +717,64 @@ def handle_command(data):
         try:
             
             if num_emails_to_fetch_explicitly is not None:
-                emails = gmail_ops.list_emails_by_category(category, max_results=num_emails_to_fetch_explicitly)
+                emails = ops.list_emails_by_category(category, max_results=num_emails_to_fetch_explicitly, cursor=cursor)
             else:
-                emails = gmail_ops.list_emails_by_category(category)
+                emails = ops.list_emails_by_category(category, cursor=cursor)
 
             if emails:
                 intro_message = f"Okay, here are the top {len(emails)} {category} emails I found:" if num_emails_to_fetch_explicitly else f"Okay, here are some {category} emails I found ({len(emails)} in total):"
-                emit('agent_response', {'text': intro_message, 'type': 'speaking_intro'}, room=sid)
-
-                for idx, email in enumerate(emails, 1):
-                    email_snippet = email.get('snippet', 'No snippet available.')
-                    email_subject = email.get('subject', 'No subject.')
-                    email_from = email.get('from', 'Unknown Sender')
+                if first_index > 1:
+                    intro_message = f"Okay, here are {category} emails {first_index} onwards:"
+                send_to(sid, 'agent_response', {'text': intro_message, 'type': 'speaking_intro'})
 
-                    email_output = f"Email {idx} from {email_from}: {email_subject} — {email_snippet}"
-                    emails_data.append(email_output)
-                emit('email_snippets', {'snippets': emails_data}, room=sid)
+                send_snippets(sid, emails, first_index)
             else:
                 response_text = f"No {category} emails found matching your query."
-                emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid)
+                send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'})
+            finish_listing(sid, ops, cursor, category)
+        except GmailThrottledError as e:
+            send_throttled(sid, e)
         except Exception as e:
             response_text = f"Failed to retrieve {category} emails: {str(e)}"
-            emit('agent_response', {'text': response_text, 'type': 'error'}, room=sid)
+            send_to(sid, 'agent_response', {'text': response_text, 'type': 'error'})
 
 
     elif nlp_result["type"] == "SEND_EMAIL":
-        active_conversations[sid] = {
+        conversation = {
             'intent': 'SEND_EMAIL',
             'to': nlp_result["parameters"].get("to"),
             'subject': nlp_result["parameters"].get("subject"),
             'body': nlp_result["parameters"].get("body"),
-            'step': ''
+            'step': '',
+            'send_id': uuid.uuid4().hex,
         }
         
-        if not active_conversations[sid]['to']:
-            active_conversations[sid]['step'] = 'waiting_for_to'
-            response_text = "Okay, I can help send an email. Who is the recipient?"
-        elif not active_conversations[sid]['subject']:
-            active_conversations[sid]['step'] = 'waiting_for_subject'
-            response_text = f"Okay, sending to {active_conversations[sid]['to']}. What should be the subject?"
-        elif not active_conversations[sid]['body']:
-            active_conversations[sid]['step'] = 'waiting_for_body'
-            response_text = f"Okay, sending to {active_conversations[sid]['to']} with subject '{active_conversations[sid]['subject']}'. What should the body of the email say?"
+        if not conversation['to']:
+            conversation['step'] = 'waiting_for_to'
+            response_text = ASK_RECIPIENT_TEXT
+        elif not conversation['subject']:
+            conversation['step'] = 'waiting_for_subject'
+            response_text = f"Okay, sending to {conversation['to']}. What should be the subject?"
+        elif not conversation['body']:
+            conversation['step'] = 'waiting_for_body'
+            response_text = f"Okay, sending to {conversation['to']} with subject '{conversation['subject']}'. What should the body of the email say?"
         else:
             try:
-                gmail_ops.send_email(active_conversations[sid]['to'], active_conversations[sid]['subject'], active_conversations[sid]['body'])
-                response_text = "Email sent successfully!"
-                del active_conversations[sid]
+                response_text = queue_email(sid, ops, conversation)
             except Exception as e:
                 response_text = f"Failed to send email: {str(e)}"
-                del active_conversations[sid]
+        if conversation['step']:
+            active_conversations.set(sid, conversation)
         
-        emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid)
+        send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'})
 
     else:
         response_text = nlp_result.get("message", "Sorry, I did not understand that. What else can I help with?")
-        emit('agent_response', {'text': response_text, 'type': 'info'}, room=sid)
+        send_to(sid, 'agent_response', {'text': response_text, 'type': 'info'})
 
     print(f"[{sid}] Sending response to frontend: {response_text}")
 
 if __name__ == "__main__":
     print("Starting Flask-SocketIO server...")
     
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 5000)), debug=False)
\ No newline at end of file
@@ -0,0 +1,52 @@
+import hmac
+
+from app.service_pool import DEFAULT_ACCOUNT
+
+
+class AccountAccessError(Exception):
+    pass
+
+
+class AccountAccess:
+    # Decides which mailbox a client may use. With no access tokens configured the
+    # server is single-user: the default account, to whoever can reach it, and no
+    # other. Once tokens are configured every client must present one, and gets
+    # only the accounts listed for it (the first of them unless it asks for another).
+    def __init__(self, tokens=None):
+        self._tokens = {token: tuple(accounts) for token, accounts in (tokens or {}).items() if accounts}
+
+    @classmethod
+    def from_spec(cls, spec):
+        # "token1=default,work;token2=personal", as in VOICE_AGENT_ACCESS_TOKENS.
+        tokens = {}
+        for entry in (spec or '').split(';'):
+            token, _, accounts = entry.strip().partition('=')
+            if token.strip():
+                tokens[token.strip()] = [account.strip() for account in accounts.split(',') if account.strip()]
+        return cls(tokens)
+
+    @property
+    def enabled(self):
+        return bool(self._tokens)
+
+    def _accounts(self, token):
+        if not token:
+            return None
+        for candidate, accounts in self._tokens.items():
+            if hmac.compare_digest(candidate.encode(), token.encode()):
+                return accounts
+        return None
+
+    def resolve(self, token, account=None):
+        # Returns the account the client gets, or raises AccountAccessError.
+        if not self.enabled:
+            if account and account != DEFAULT_ACCOUNT:
+                raise AccountAccessError("Only the default account is served; set VOICE_AGENT_ACCESS_TOKENS to use others.")
+            return DEFAULT_ACCOUNT
+        accounts = self._accounts(token)
+        if accounts is None:
+            raise AccountAccessError("A valid access token is required.")
+        account = account or accounts[0]
+        if account not in accounts:
+            raise AccountAccessError(f"This access token cannot use the account '{account}'.")
+        return account
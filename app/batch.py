@@ -0,0 +1,81 @@
+import copy
+import threading
+
+
+# Upper bound on commands per batch request, so one request cannot tie up a worker
+# (and the account's Gmail quota) indefinitely.
+MAX_BATCH_COMMANDS = 500
+# Commands are classified this many at a time, which keeps each chunk's results in
+# the command cache until the chunk has run.
+NLP_CHUNK_SIZE = 256
+
+SCRIPT = 'script'
+REPLAY = 'replay'
+MODES = (SCRIPT, REPLAY)
+
+
+class CoalescingGmailOps:
+    # Wraps a GmailOperations for the length of one batch: identical listings (same
+    # method, arguments and starting cursor position) are fetched from Gmail once
+    # and the result shared, with the cursor advanced as if each had run. Everything
+    # else goes straight to the wrapped instance.
+    COALESCED_METHODS = ('list_emails', 'list_emails_by_category')
+
+    def __init__(self, ops):
+        self._ops = ops
+        self._results = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._ops, name)
+        if name not in self.COALESCED_METHODS:
+            return attribute
+
+        def coalesced(*args, cursor=None, **kwargs):
+            position = tuple(sorted(cursor.to_dict().items())) if cursor is not None else None
+            key = (name, args, tuple(sorted(kwargs.items())), position)
+            with self._lock:
+                hit = self._results.get(key)
+            if hit is not None:
+                result, cursor_after = hit
+                if cursor is not None:
+                    vars(cursor).update(cursor_after)
+                with self._lock:
+                    self.coalesced += 1
+                return copy.deepcopy(result)
+            result = attribute(*args, cursor=cursor, **kwargs)
+            with self._lock:
+                self._results[key] = (copy.deepcopy(result), cursor.to_dict() if cursor is not None else None)
+                self.executed += 1
+            return result
+
+        return coalesced
+
+    def stats(self):
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced}
+
+
+class BatchSession:
+    # Stands in for a connected client while batch commands run: events sent to its
+    # sid are collected instead of emitted. Emails are only queued for sending when
+    # send_mail is set; otherwise a send flow is answered as a dry run.
+    def __init__(self, sid, ops, send_mail=False):
+        self.sid = sid
+        self.ops = ops
+        self.send_mail = send_mail
+        self.events = []
+
+    def collect(self, event, payload):
+        self.events.append({'event': event, 'data': payload})
+
+    def take_events(self):
+        events, self.events = self.events, []
+        return events
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
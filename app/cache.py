@@ -0,0 +1,332 @@
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from app import category_plans
+from app.records import EmailRecord
+
+
+# Queries made only of these terms can be answered from the local store. Spam and
+# trash are never seeded, mirroring Gmail's default of leaving them out of searches.
+LOCAL_QUERY_LABELS = {
+    'in:inbox': 'INBOX',
+    'is:unread': 'UNREAD',
+    'is:starred': 'STARRED',
+    'is:important': 'IMPORTANT',
+    'in:sent': 'SENT',
+}
+EXCLUDED_LABELS = ('SPAM', 'TRASH')
+
+SEED_SIZE = 500
+MIN_SYNC_INTERVAL = 5.0
+# How long a prefetched page of ids (see store_page) stays usable by a request.
+PAGE_TTL = 120.0
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    subject TEXT,
+    sender TEXT,
+    snippet TEXT,
+    label_ids TEXT,
+    internal_date INTEGER,
+    categories TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_by_date ON messages (internal_date DESC);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS query_pages (
+    query TEXT,
+    max_results INTEGER,
+    page_token TEXT,
+    message_ids TEXT,
+    next_page_token TEXT,
+    fetched_at REAL,
+    PRIMARY KEY (query, max_results, page_token)
+);
+"""
+
+
+class MessageCache:
+    def __init__(self, path='mail_cache.sqlite3', seed_size=SEED_SIZE, min_sync_interval=MIN_SYNC_INTERVAL, page_ttl=PAGE_TTL):
+        self.path = path
+        self.seed_size = seed_size
+        self.min_sync_interval = min_sync_interval
+        self.page_ttl = page_ttl
+        self.hits = 0
+        self.misses = 0
+        self.page_hits = 0
+        self.page_misses = 0
+        self.last_sync = None
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        if 'categories' not in [column[1] for column in self._conn.execute("PRAGMA table_info(messages)")]:
+            # Caches written before messages were tagged with their categories.
+            self._conn.execute("ALTER TABLE messages ADD COLUMN categories TEXT")
+        self._retag()
+
+    def _get_state(self, key):
+        row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def history_id(self):
+        with self._lock:
+            return self._get_state('history_id')
+
+    def sync(self, ops, force=False):
+        # Gmail is called without holding _lock, so lookups keep being answered
+        # from the store meanwhile; _sync_lock keeps to one sync at a time, and the
+        # lock is taken only to apply what the sync fetched.
+        with self._sync_lock:
+            with self._lock:
+                if not force and self.last_sync is not None and time.time() - self.last_sync < self.min_sync_interval:
+                    return
+                history_id = self._get_state('history_id')
+            try:
+                if history_id is None:
+                    apply = self._seed(ops)
+                else:
+                    apply = self._apply_history(ops, history_id)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                # The stored historyId is too old for Gmail to replay, start over.
+                print(f"Message cache history {history_id} expired, reseeding.")
+                apply = self._seed(ops, reseed=True)
+            with self._lock:
+                apply()
+                self._conn.commit()
+                self.last_sync = time.time()
+
+    def _seed(self, ops, reseed=False):
+        # Fetches a seed of the newest messages and returns a function that stores it.
+        users = ops.service.users()
+        # Read the historyId before listing so nothing that changes meanwhile is missed.
+        history_id = ops.execute('getProfile', users.getProfile(userId='me'))['historyId']
+
+        message_ids = []
+        page_token = None
+        complete = False
+        while len(message_ids) < self.seed_size:
+            results = ops.execute('messages.list', users.messages().list(
+                userId='me', maxResults=min(500, self.seed_size - len(message_ids)),
+                pageToken=page_token, fields='messages(id),nextPageToken'))
+            message_ids.extend(message['id'] for message in results.get('messages', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                complete = True
+                break
+
+        fetched = ops._batch_get_messages(message_ids, **ops._get_kwargs('metadata'))
+        rows = self._rows(ops, fetched.values())
+
+        def apply():
+            if reseed:
+                self._conn.execute("DELETE FROM messages")
+            self._upsert(rows)
+            # Everything at or above the floor is known; older messages may be missing
+            # unless the whole mailbox fitted into the seed.
+            floor = self._conn.execute("SELECT MIN(internal_date) FROM messages").fetchone()[0]
+            self._set_state('window_floor', floor if floor is not None else 0)
+            self._set_state('mailbox_complete', int(complete))
+            self._set_state('history_id', history_id)
+            print(f"Message cache seeded with {len(rows)} messages at history {history_id}.")
+        return apply
+
+    def _apply_history(self, ops, history_id):
+        # Fetches the changes since history_id and returns a function that applies them.
+        added, deleted, labels = set(), set(), {}
+        page_token = None
+        latest_history_id = history_id
+        while True:
+            results = ops.execute('history.list', ops.service.users().history().list(
+                userId='me', startHistoryId=history_id, historyTypes=HISTORY_TYPES, pageToken=page_token))
+            for record in results.get('history', []):
+                for change in record.get('messagesAdded', []):
+                    added.add(change['message']['id'])
+                for change in record.get('messagesDeleted', []):
+                    deleted.add(change['message']['id'])
+                for change in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    labels[change['message']['id']] = change['message'].get('labelIds', [])
+            latest_history_id = results.get('historyId', latest_history_id)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        added -= deleted
+        rows = []
+        if added:
+            fetched = ops._batch_get_messages(sorted(added), **ops._get_kwargs('metadata'))
+            rows = self._rows(ops, fetched.values())
+
+        def apply():
+            self._upsert(rows)
+            for message_id, label_ids in labels.items():
+                if message_id not in added:
+                    self._conn.execute("UPDATE messages SET label_ids = ? WHERE id = ?", (self._encode_labels(label_ids), message_id))
+            if deleted:
+                self._conn.executemany("DELETE FROM messages WHERE id = ?", [(message_id,) for message_id in deleted])
+            if added or deleted:
+                # Prefetched pages may now be missing new mail or point at deleted messages.
+                self._conn.execute("DELETE FROM query_pages")
+            self._set_state('history_id', latest_history_id)
+        return apply
+
+    @staticmethod
+    def _encode_labels(label_ids):
+        # Padded so a label can be matched with LIKE '% LABEL %'.
+        return f" {' '.join(label_ids)} "
+
+    def store(self, ops, messages):
+        rows = self._rows(ops, messages)
+        with self._lock:
+            self._upsert(rows)
+            self._conn.commit()
+
+    def _rows(self, ops, messages):
+        matcher = category_plans.category_matcher
+        rows = []
+        for msg in messages:
+            record = ops._parse_message(msg)
+            rows.append((record.id, msg.get('threadId'), record.subject, record.sender,
+                         record.snippet, self._encode_labels(msg.get('labelIds', [])), int(msg.get('internalDate', 0)),
+                         self._encode_labels(matcher.categorize(record))))
+        return rows
+
+    def _upsert(self, rows):
+        # An upsert rather than INSERT OR REPLACE so update triggers (the search index) fire.
+        self._conn.executemany(
+            "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+            "thread_id = excluded.thread_id, subject = excluded.subject, sender = excluded.sender, "
+            "snippet = excluded.snippet, label_ids = excluded.label_ids, internal_date = excluded.internal_date, "
+            "categories = excluded.categories", rows)
+
+    def _retag(self):
+        # Messages are tagged with their categories when stored; after the category
+        # keywords change (or in a cache from before tagging) every message is tagged again.
+        matcher = category_plans.category_matcher
+        with self._lock:
+            if self._get_state('categories_signature') == matcher.signature:
+                return
+            rows = self._conn.execute("SELECT id, subject, sender, snippet FROM messages").fetchall()
+            self._conn.executemany("UPDATE messages SET categories = ? WHERE id = ?", [
+                (self._encode_labels(matcher.categorize(EmailRecord.from_row(row))), row[0]) for row in rows])
+            self._set_state('categories_signature', matcher.signature)
+            self._conn.commit()
+
+    def lookup_category(self, category, max_results, offset=0):
+        # Inbox messages tagged with category, newest first; None when the store
+        # cannot answer (see select).
+        self._retag()
+        clauses, params = self.label_clauses(['INBOX'])
+        return self.select(clauses + ["messages.categories LIKE ?"], params + [f"% {category} %"], max_results, offset=offset)
+
+    def get_many(self, message_ids):
+        if not message_ids:
+            return {}
+        with self._lock:
+            placeholders = ','.join('?' * len(message_ids))
+            rows = self._conn.execute(f"SELECT id, subject, sender, snippet FROM messages WHERE id IN ({placeholders})",
+                                      list(message_ids)).fetchall()
+        return {row[0]: EmailRecord.from_row(row) for row in rows}
+
+    def get_page(self, query, max_results, page_token=None, consume=False):
+        # Returns (message_ids, next_page_token) for a recently prefetched page, or
+        # None. Requests consume the page: Gmail is asked again the next time, so
+        # new mail shows up even for queries history sync does not cover.
+        with self._lock:
+            key = (query, max_results, page_token or '')
+            row = self._conn.execute(
+                "SELECT message_ids, next_page_token FROM query_pages WHERE query = ? AND max_results = ? AND page_token = ? "
+                "AND fetched_at >= ?", key + (time.time() - self.page_ttl,)).fetchone()
+            if row is None:
+                self.page_misses += 1
+                return None
+            self.page_hits += 1
+            if consume:
+                self._conn.execute("DELETE FROM query_pages WHERE query = ? AND max_results = ? AND page_token = ?", key)
+                self._conn.commit()
+        return row[0].split(), row[1] or None
+
+    def store_page(self, query, max_results, page_token, message_ids, next_page_token):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM query_pages WHERE fetched_at < ?", (now - self.page_ttl,))
+            self._conn.execute("INSERT OR REPLACE INTO query_pages VALUES (?, ?, ?, ?, ?, ?)",
+                               (query, max_results, page_token or '', ' '.join(message_ids), next_page_token or '', now))
+            self._conn.commit()
+
+    @staticmethod
+    def local_labels(query):
+        terms = (query or '').lower().split()
+        if any(term not in LOCAL_QUERY_LABELS for term in terms):
+            return None
+        return [LOCAL_QUERY_LABELS[term] for term in terms]
+
+    def lookup(self, query, max_results, offset=0):
+        labels = self.local_labels(query)
+        if labels is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return self.select(*self.label_clauses(labels), max_results, offset=offset)
+
+    @staticmethod
+    def label_clauses(labels):
+        return ["messages.label_ids LIKE ?" for _ in labels], [f"% {label} %" for label in labels]
+
+    def select(self, clauses, params, max_results, offset=0, source='messages', order_by='messages.internal_date DESC'):
+        # Returns None when the store cannot answer the query with certainty.
+        with self._lock:
+            if self._get_state('history_id') is None:
+                self.misses += 1
+                return None
+
+            clauses = ["messages.internal_date >= ?"] + ["messages.label_ids NOT LIKE ?" for _ in EXCLUDED_LABELS] + list(clauses)
+            params = [int(self._get_state('window_floor'))] + [f"% {label} %" for label in EXCLUDED_LABELS] + list(params)
+            rows = self._conn.execute(
+                f"SELECT messages.id, messages.subject, messages.sender, messages.snippet FROM {source} "
+                f"WHERE {' AND '.join(clauses)} ORDER BY {order_by} LIMIT ? OFFSET ?", params + [max_results, offset]).fetchall()
+
+            # A short result is only trustworthy when the whole mailbox fitted in the seed.
+            if len(rows) < max_results and self._get_state('mailbox_complete') != '1':
+                self.misses += 1
+                return None
+
+            self.hits += 1
+        return [EmailRecord.from_row(row) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            cached = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            history_id = self._get_state('history_id')
+            hits, misses = self.hits, self.misses
+            page_hits, page_misses = self.page_hits, self.page_misses
+        lookups = hits + misses
+        return {
+            'messages': cached,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'page_hits': page_hits,
+            'page_misses': page_misses,
+            'history_id': history_id,
+            'last_sync': self.last_sync,
+            'sync_lag_seconds': time.time() - self.last_sync if self.last_sync is not None else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,179 @@
+import hashlib
+import re
+import unicodedata
+from collections import deque, namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+
+from app.nlp_processor import CATEGORY_KEYWORDS
+
+
+# Everything list_emails_by_category used to rebuild from CATEGORY_KEYWORDS on each
+# call, computed once per category: the Gmail query, the FTS expression used by the
+# local search index, and the raw terms the local matcher is built from.
+CategoryPlan = namedtuple('CategoryPlan', [
+    'category', 'positive_terms', 'negative_terms', 'gmail_query', 'fts_expression',
+])
+
+
+def gmail_term(keyword):
+    if keyword.startswith('from:') or keyword.startswith('subject:'):
+        return keyword
+    if ' ' in keyword:
+        return f'"{keyword}"'
+    return keyword
+
+
+def fts_phrase(text):
+    # Quoted so punctuation in keywords ("Domino's", "full-time") is tokenized, not parsed.
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fts_term(keyword):
+    if keyword.lower().startswith('from:'):
+        return f"sender : {fts_phrase(keyword[5:])}"
+    if keyword.lower().startswith('subject:'):
+        return f"subject : {fts_phrase(keyword[8:])}"
+    return fts_phrase(keyword)
+
+
+def build_plan(category, keywords):
+    positive_terms = tuple(kw for kw in keywords if not kw.startswith('-'))
+    negative_terms = tuple(kw[1:] for kw in keywords if kw.startswith('-'))
+
+    query_parts = []
+    if positive_terms:
+        query_parts.append(f"({' OR '.join(gmail_term(kw) for kw in positive_terms)})")
+    if negative_terms:
+        query_parts.append(' '.join(f"-{gmail_term(kw)}" for kw in negative_terms))
+    gmail_query = f"{' AND '.join(query_parts)} in:inbox" if query_parts else "in:inbox"
+
+    fts_expression = None
+    if positive_terms:
+        fts_expression = f"({' OR '.join(fts_term(kw) for kw in positive_terms)})"
+        if negative_terms:
+            fts_expression += f" NOT ({' OR '.join(fts_term(kw) for kw in negative_terms)})"
+
+    return CategoryPlan(category, positive_terms, negative_terms, gmail_query, fts_expression)
+
+
+# Letters and digits, as SQLite's unicode61 tokenizer (the FTS index's) splits text.
+TOKEN = re.compile(r'[^\W_]+')
+
+_plans = {}
+CATEGORY_PLANS = MappingProxyType(_plans)
+category_matcher = None
+
+
+@lru_cache(maxsize=256)
+def category_query(category, extra_filters=''):
+    plan = CATEGORY_PLANS.get(category.lower())
+    if plan is None:
+        return None
+    return f"{plan.gmail_query} {extra_filters}".strip()
+
+
+def rebuild_plans():
+    # Recomputes the plans from CATEGORY_KEYWORDS as it is now. CATEGORY_PLANS is
+    # updated in place, so modules that imported it see the new plans; the matcher
+    # is replaced, so use it as category_plans.category_matcher.
+    global category_matcher
+    plans = {category: build_plan(category, keywords) for category, keywords in CATEGORY_KEYWORDS.items() if keywords}
+    _plans.update(plans)
+    for category in set(_plans) - set(plans):
+        del _plans[category]
+    category_query.cache_clear()
+    category_matcher = CategoryMatcher(CATEGORY_PLANS)
+
+
+def tokens(text):
+    # Lowercased, without diacritics, split like unicode61 does.
+    decomposed = unicodedata.normalize('NFKD', (text or '').lower())
+    return TOKEN.findall(''.join(char for char in decomposed if not unicodedata.combining(char)))
+
+
+class KeywordAutomaton:
+    # Aho-Corasick automaton whose symbols are tokens rather than characters, so a
+    # keyword matches a run of whole tokens, the way an FTS phrase query does.
+    def __init__(self):
+        self._goto = [{}]
+        self._values = [[]]
+        self._fail = None
+        self._output = None
+
+    def add(self, pattern, value):
+        state = 0
+        for token in pattern:
+            next_state = self._goto[state].get(token)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][token] = next_state
+                self._goto.append({})
+                self._values.append([])
+            state = next_state
+        self._values[state].append(value)
+        self._fail = None
+
+    def build(self):
+        self._fail = [0] * len(self._goto)
+        self._output = [list(values) for values in self._values]
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(token, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def find(self, text_tokens):
+        if self._fail is None:
+            self.build()
+        state = 0
+        for token in text_tokens:
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            yield from self._output[state]
+
+
+class CategoryMatcher:
+    # Assigns a message to every category whose plan it satisfies, in one pass of a
+    # single automaton over each field. It follows the plans' FTS expressions: a
+    # keyword matches anywhere in subject, sender or snippet, from: only in the
+    # sender and subject: only in the subject, and any negative term rules the
+    # category out. signature changes whenever the plans do.
+    FIELDS = (('subject', 'subject'), ('from', 'sender'), ('snippet', 'snippet'))
+
+    def __init__(self, plans):
+        self.categories = tuple(plan.category for plan in plans.values() if plan.fts_expression is not None)
+        self._automaton = KeywordAutomaton()
+        for plan in plans.values():
+            if plan.fts_expression is None:
+                continue
+            for negative, terms in ((False, plan.positive_terms), (True, plan.negative_terms)):
+                for term in terms:
+                    column = None
+                    if term.lower().startswith('from:'):
+                        column, term = 'sender', term[5:]
+                    elif term.lower().startswith('subject:'):
+                        column, term = 'subject', term[8:]
+                    pattern = tokens(term)
+                    if pattern:
+                        self._automaton.add(pattern, (plan.category, negative, column))
+        self._automaton.build()
+        described = sorted((plan.category, plan.positive_terms, plan.negative_terms) for plan in plans.values())
+        self.signature = hashlib.sha1(repr(described).encode()).hexdigest()
+
+    def categorize(self, email):
+        positive, negative = set(), set()
+        for field, column in self.FIELDS:
+            for category, is_negative, only_column in self._automaton.find(tokens(email.get(field, ''))):
+                if only_column is None or only_column == column:
+                    (negative if is_negative else positive).add(category)
+        return [category for category in self.categories if category in positive and category not in negative]
+
+
+rebuild_plans()
@@ -1,134 +1,395 @@
-import os
-import pickle
-import os.path
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from email.mime.text import MIMEText
 import base64
-from datetime import datetime, timedelta
+import time
 
 
-from app.nlp_processor import CATEGORY_KEYWORDS 
+from app.category_plans import category_query
+from app.metrics import GMAIL_CALLS, span
+from app.quota import QUOTA_UNITS, GmailThrottledError, QuotaScheduler, is_rate_limited, is_retryable
+from app.records import EmailRecord
+from app.search_index import compile_query
+from app.service_pool import DEFAULT_ACCOUNT, SCOPES, GmailServicePool
+from app.singleflight import SingleFlight
 
 
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.send']
+# Gmail accepts up to 100 calls per batch, but recommends staying at or below 50.
+BATCH_SIZE = 50
+MAX_BATCH_SIZE = 100
+MAX_BATCH_RETRIES = 3
+
+# list/search results only ever show Subject, From and the snippet, so by default
+# messages are fetched as metadata and the MIME body is only downloaded on demand.
+FETCH_METADATA = 'metadata'
+FETCH_FULL = 'full'
+METADATA_HEADERS = ['Subject', 'From']
+LIST_FIELDS = 'messages(id,threadId),nextPageToken,resultSizeEstimate'
+METADATA_FIELDS = 'id,threadId,snippet,labelIds,internalDate,payload/headers'
+# messages.list returns at most 500 ids per page.
+MAX_LIST_PAGE = 500
+
+
+class EmailCursor:
+    # Where a listing stopped. Passing it back to the list/iter methods returns the
+    # emails after the last ones returned: from Gmail's nextPageToken when the page
+    # came from Gmail, or by offset when it was answered locally.
+    def __init__(self, query, page_size, category=None):
+        self.query = query
+        self.page_size = page_size
+        self.category = category
+        self.page_token = None
+        self.offset = 0
+        self.exhausted = False
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, state):
+        cursor = cls(state['query'], state['page_size'], state.get('category'))
+        vars(cursor).update(state)
+        return cursor
+
+    def advance(self, count, page_token, exhausted):
+        self.offset += count
+        self.page_token = page_token
+        self.exhausted = exhausted
 
 class GmailOperations:
-    def __init__(self):
-        self.service = self._authenticate_gmail()
+    def __init__(self, service=None, batch_size=BATCH_SIZE, max_batch_retries=MAX_BATCH_RETRIES, cache=None, search_index=None,
+                 pool=None, account=DEFAULT_ACCOUNT, scheduler=None, single_flight=None):
+        self._service = service
+        self.pool = pool if pool is not None or service is not None else GmailServicePool()
+        self.account = account
+        if scheduler is None:
+            # Gmail's per-user quota only applies to Gmail; an injected service is not held to it.
+            scheduler = QuotaScheduler() if service is None else QuotaScheduler.unlimited()
+        self.scheduler = scheduler
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+        if service is None:
+            # Load (or authorize) credentials up front so a bad setup fails at startup.
+            self.pool.credentials(account)
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.max_batch_retries = max_batch_retries
+        self.cache = cache
+        self.search_index = search_index
         print("--- GmailOperations class initialized successfully! ---") 
 
-    def _authenticate_gmail(self):
-        creds = None
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
-                creds = pickle.load(token)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                try:
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        'credentials.json', SCOPES)
-                    creds = flow.run_local_server(port=0)
-                except Exception as e:
-                    print(f"Error loading credentials.json: {e}")
-                    print("Please ensure credentials.json is in the same directory and is correctly formatted.")
-                    print("You can download it from Google Cloud Console (APIs & Services -> Credentials -> OAuth Client ID -> Desktop app).")
-                    exit() 
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
-        return build('gmail', 'v1', credentials=creds)
-
-    def list_emails(self, query='in:inbox', max_results=50):
+    @property
+    def service(self):
+        if self._service is not None:
+            return self._service
+        return self.pool.service(self.account)
+
+    def execute(self, method, request, units=None):
+        outcome = 'error'
         try:
-            results = self.service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-            messages = results.get('messages', [])
-            
-            emails_data = []
-            if not messages:
-                return []
-            else:
-                for message in messages:
-                    msg = self.service.users().messages().get(userId='me', id=message['id'], format='full').execute()
-                    payload = msg['payload']
-                    headers = payload.get('headers', [])
-                    
-                    
-                    subject = next((header['value'] for header in headers if header['name'] == 'Subject'), 'No Subject')
-                    sender = next((header['value'] for header in headers if header['name'] == 'From'), 'Unknown Sender')
-                    
-                    snippet = msg.get('snippet', 'No snippet available.')
-                    
-                    emails_data.append({
-                        'id': message['id'],
-                        'subject': subject,
-                        'from': sender,
-                        'snippet': snippet
-                    })
-                return emails_data
+            with span(f'gmail.{method}'):
+                response = self.scheduler.execute(self.account, method, request, units)
+            outcome = 'ok'
+            return response
+        except GmailThrottledError:
+            outcome = 'throttled'
+            raise
+        finally:
+            GMAIL_CALLS.inc(method=method, outcome=outcome)
+
+    def list_emails(self, query='in:inbox', max_results=50, fetch_mode=FETCH_METADATA, cursor=None):
+        try:
+            return self._list_shared(query, max_results, fetch_mode, cursor)
+        except GmailThrottledError:
+            raise
         except Exception as e:
             print(f"An error occurred while listing emails: {e}")
             
             return [] 
 
-    def send_email(self, to, subject, body):
+    def _list_shared(self, query, max_results, fetch_mode, cursor):
+        # Identical listings (same account, query, size and cursor position) made
+        # at the same time, or within a few seconds, share one fetch; the cursor
+        # ends up where the shared fetch left it.
+        position = tuple(sorted(cursor.to_dict().items())) if cursor is not None else None
+        key = ('list', self.account, query, max_results, fetch_mode, position)
+
+        def fetch():
+            emails = [email for chunk in self.iter_emails(query, max_results, fetch_mode, cursor=cursor) for email in chunk]
+            return emails, cursor.to_dict() if cursor is not None else None
+
+        emails, cursor_after = self.single_flight.do('list', key, fetch)
+        if cursor is not None:
+            vars(cursor).update(cursor_after)
+        return emails
+
+    def iter_emails(self, query='in:inbox', max_results=50, fetch_mode=FETCH_METADATA, first_chunk_size=None, cursor=None):
+        # Yields lists of emails in result order as soon as each batch is fetched.
+        # With first_chunk_size set, the first batch is kept small so callers can
+        # show something before the rest arrives; errors are raised to the caller.
+        # With a cursor, listing resumes where it stopped and the cursor is advanced.
+        offset = cursor.offset if cursor is not None else 0
+        use_cache = self.cache is not None and fetch_mode == FETCH_METADATA
+        if use_cache:
+            if self.cache.local_labels(query) is not None:
+                cached = self._lookup_local(lambda: self.cache.lookup(query, max_results, offset))
+            elif self.search_index is not None and compile_query(query) is not None:
+                cached = self._lookup_local(lambda: self.search_index.search_query(query, max_results, offset))
+            else:
+                cached = self.cache.lookup(query, max_results, offset)
+            if cached is not None:
+                if cursor is not None:
+                    cursor.advance(len(cached), None, len(cached) < max_results)
+                if cached:
+                    yield cached
+                return
+
+        if cursor is not None and cursor.page_token is None and offset:
+            # The earlier pages were answered locally, so there is no Gmail token to resume from.
+            message_ids, next_page_token = self._list_ids(query, offset + max_results)
+            message_ids = message_ids[offset:]
+        else:
+            message_ids, next_page_token = self._list_ids(query, max_results, cursor.page_token if cursor is not None else None)
+        if cursor is not None:
+            cursor.advance(len(message_ids), next_page_token, next_page_token is None)
+        if not message_ids:
+            return
+
+        emails_by_id = self.cache.get_many(message_ids) if use_cache else {}
+        chunk_size = first_chunk_size or len(message_ids)
+        start = 0
+        while start < len(message_ids):
+            chunk_ids = message_ids[start:start + chunk_size]
+            missing_ids = [message_id for message_id in chunk_ids if message_id not in emails_by_id]
+            fetched = self._get_shared(missing_ids, fetch_mode, use_cache)
+
+            for message_id, msg in fetched.items():
+                emails_by_id[message_id] = self._parse_message(msg)
+            yield [emails_by_id[message_id] for message_id in chunk_ids if message_id in emails_by_id]
+
+            start += chunk_size
+            chunk_size = self.batch_size
+
+    def _get_shared(self, message_ids, fetch_mode, store):
+        # Identical chunks fetched at the same time share one batch (see _list_page).
+        if not message_ids:
+            return {}
+
+        def fetch():
+            fetched = self._batch_get_messages(message_ids, **self._get_kwargs(fetch_mode))
+            if store:
+                self.cache.store(self, fetched.values())
+            return fetched
+
+        key = ('messages', self.account, fetch_mode, tuple(message_ids))
+        return self.single_flight.do('messages', key, fetch)
+
+    def _list_ids(self, query, count, page_token=None):
+        # Follows nextPageToken until count ids are listed; pages the prefetcher
+        # listed are served from the page cache.
+        message_ids = []
+        while True:
+            page_ids, page_token = self._list_page(query, min(count - len(message_ids), MAX_LIST_PAGE), page_token)
+            message_ids.extend(page_ids)
+            if not page_token or len(message_ids) >= count:
+                return message_ids, page_token
+
+    def _list_page(self, query, max_results, page_token=None, warm=False):
+        # Requests use a page the prefetcher listed (once), otherwise ask Gmail.
+        # With warm set (prefetching) the listed page is kept for the next request.
+        if self.cache is not None:
+            page = self.cache.get_page(query, max_results, page_token, consume=not warm)
+            if page is not None:
+                return page
+        # Streamed listings do not go through list_emails, so concurrent identical
+        # pages are also shared here.
+        key = ('page', self.account, query, max_results, page_token)
+        return self.single_flight.do('page', key, lambda: self._fetch_page(query, max_results, page_token, warm))
+
+    def _fetch_page(self, query, max_results, page_token, warm=False):
+        results = self.execute('messages.list', self.service.users().messages().list(
+            userId='me', q=query, maxResults=max_results, pageToken=page_token, fields=LIST_FIELDS))
+        message_ids = [message['id'] for message in results.get('messages', [])]
+        next_page_token = results.get('nextPageToken')
+        if warm and self.cache is not None:
+            self.cache.store_page(query, max_results, page_token, message_ids, next_page_token)
+        return message_ids, next_page_token
+
+    def prefetch(self, query, max_results, page_token=None, should_stop=None, budget=None):
+        # Lists a page and stores its metadata so a later request for it is served
+        # locally. Each call is paid for from budget (a TokenBucket) and skipped when
+        # that, or the account's own quota, has no units to spare; the rest is
+        # abandoned once should_stop() says foreground work is waiting.
+        if self.cache is None:
+            return 0
+
+        def affordable(units):
+            if self.scheduler.bucket(self.account).wait_time(units) > 0:
+                return False
+            return budget is None or budget.reserve(units, 0) is not None
+
+        page = self.cache.get_page(query, max_results, page_token)
+        if page is None:
+            if not affordable(QUOTA_UNITS['messages.list']):
+                return 0
+            page = self._list_page(query, max_results, page_token, warm=True)
+        message_ids = page[0]
+        known = self.cache.get_many(message_ids)
+        missing_ids = [message_id for message_id in message_ids if message_id not in known]
+        if not missing_ids or (should_stop is not None and should_stop()):
+            return 0
+        if not affordable(QUOTA_UNITS['messages.get'] * len(missing_ids)):
+            return 0
+        fetched = self._batch_get_messages(missing_ids, **self._get_kwargs(FETCH_METADATA))
+        self.cache.store(self, fetched.values())
+        return len(fetched)
+
+    def _lookup_local(self, search):
         try:
-            message = MIMEText(body)
-            message['to'] = to
-            message['subject'] = subject
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-            
-            self.service.users().messages().send(userId='me', body={'raw': raw_message}).execute()
-            print(f"Email sent to {to} with subject '{subject}'")
-            return True
+            self.cache.sync(self)
+        except GmailThrottledError as e:
+            # The store is at most one sync behind, which beats waiting out the quota.
+            print(f"Message cache sync throttled, answering from the local store: {e}")
+        except Exception as e:
+            print(f"Message cache sync failed, falling back to Gmail: {e}")
+            return None
+        return search()
+
+    def _lookup_category_local(self, category, max_results, extra_filters, cursor):
+        # Category listings without extra filters are answered from the local store
+        # when there is one; None means ask Gmail.
+        if self.search_index is None or extra_filters:
+            return None
+        offset = cursor.offset if cursor is not None else 0
+        cached = self._lookup_local(lambda: self.search_index.search_category(category, max_results, offset))
+        if cached is not None and cursor is not None:
+            cursor.advance(len(cached), None, len(cached) < max_results)
+        return cached
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def get_email(self, message_id):
+        try:
+            msg = self.execute('messages.get', self.service.users().messages().get(userId='me', id=message_id, format=FETCH_FULL))
+            email_data = self._parse_message(msg).to_dict()
+            email_data['body'] = self._extract_body(msg.get('payload', {}))
+            return email_data
+        except GmailThrottledError:
+            raise
         except Exception as e:
-            print(f"An error occurred while sending email: {e}")
-            return False 
+            print(f"An error occurred while fetching email {message_id}: {e}")
+            return None
+
+    @staticmethod
+    def _get_kwargs(fetch_mode):
+        if fetch_mode == FETCH_METADATA:
+            return {'format': FETCH_METADATA, 'metadataHeaders': METADATA_HEADERS, 'fields': METADATA_FIELDS}
+        return {'format': fetch_mode}
+
+    def _parse_message(self, msg):
+        return EmailRecord.from_message(msg)
+
+    def _extract_body(self, payload):
+        if payload.get('mimeType') == 'text/plain' and payload.get('body', {}).get('data'):
+            return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='replace')
+        for part in payload.get('parts', []):
+            body = self._extract_body(part)
+            if body:
+                return body
+        return ''
+
+    def _batch_get_messages(self, message_ids, **get_kwargs):
+        # One HTTP round-trip per batch_size messages instead of one per message.
+        # Sub-requests that fail with a retryable status are re-batched with backoff.
+        fetched = {}
+        pending = list(dict.fromkeys(message_ids))
+        attempt = 0
+
+        while pending:
+            failed = []
+            rate_limited = []
+
+            def on_response(request_id, response, exception):
+                if exception is None:
+                    fetched[request_id] = response
+                elif is_retryable(exception):
+                    failed.append(request_id)
+                    if is_rate_limited(exception):
+                        rate_limited.append(request_id)
+                else:
+                    print(f"Failed to fetch message {request_id}: {exception}")
+
+            for start in range(0, len(pending), self.batch_size):
+                batch = self.service.new_batch_http_request(callback=on_response)
+                chunk = pending[start:start + self.batch_size]
+                for message_id in chunk:
+                    batch.add(self.service.users().messages().get(userId='me', id=message_id, **get_kwargs), request_id=message_id)
+                # A batch costs the sum of its calls' quota units.
+                self.execute('messages.get', batch, units=QUOTA_UNITS['messages.get'] * len(chunk))
+
+            if not failed:
+                break
+
+            attempt += 1
+            if rate_limited:
+                delay = self.scheduler.throttle(self.account, attempt)
+            else:
+                delay = self.scheduler.backoff(attempt)
+            if attempt > self.max_batch_retries:
+                if rate_limited:
+                    raise self.scheduler.give_up(self.account, delay)
+                print(f"Giving up on {len(failed)} messages after {self.max_batch_retries} retries.")
+                break
+
+            time.sleep(delay)
+            pending = failed
+
+        return fetched
+
+    def send_email(self, to, subject, body, message_id=None):
+        # Returns the id of the sent message. Failures raise (HttpError, or
+        # GmailThrottledError once retries are used up) so callers cannot mistake
+        # them for success; the outbox decides which ones are worth retrying.
+        message = MIMEText(body)
+        message['to'] = to
+        message['subject'] = subject
+        if message_id is not None:
+            message['Message-ID'] = message_id
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+        sent = self.execute('messages.send', self.service.users().messages().send(userId='me', body={'raw': raw_message}))
+        print(f"Email sent to {to} with subject '{subject}'")
+        return sent.get('id')
+
+    def find_sent(self, message_id):
+        # Looks a message up by the Message-ID header it was sent with, to tell
+        # whether a send interrupted by a crash actually reached Gmail.
+        results = self.execute('messages.list', self.service.users().messages().list(
+            userId='me', q=f"in:sent rfc822msgid:{message_id.strip('<>')}", maxResults=1, fields='messages(id)'))
+        messages = results.get('messages', [])
+        return messages[0]['id'] if messages else None
 
     
-    def list_emails_by_category(self, category, max_results=20): 
+    def list_emails_by_category(self, category, max_results=20, extra_filters='', cursor=None): 
         
-        print(f"DEBUG: list_emails_by_category received category: '{category}'") 
-        category_keywords = CATEGORY_KEYWORDS.get(category.lower(), [])
-        print(f"DEBUG: list_emails_by_category found keywords: {category_keywords}") 
+        cached = self._lookup_category_local(category, max_results, extra_filters, cursor)
+        if cached is not None:
+            return cached
 
-        if not category_keywords:
+        final_query = category_query(category, extra_filters)
+        if final_query is None:
             print(f"No keywords found for category: '{category}' in CATEGORY_KEYWORDS. Returning empty list.")
             return [] 
 
-        positive_terms = []
-        negative_terms = []
-
-        for kw in category_keywords:
-            if kw.startswith('-'):
-                
-                actual_kw = kw[1:] 
-                if actual_kw.startswith('from:') or actual_kw.startswith('subject:'):
-                    negative_terms.append(f"-{actual_kw}") 
-                elif ' ' in actual_kw: 
-                    negative_terms.append(f'-"{actual_kw}"')
-                else:
-                    negative_terms.append(f"-{actual_kw}") 
-            else:
-                
-                if kw.startswith('from:') or kw.startswith('subject:'):
-                    positive_terms.append(kw)
-                elif ' ' in kw: 
-                    positive_terms.append(f'"{kw}"')
-                else:
-                    positive_terms.append(kw)
-        
-        query_parts = []
-        if positive_terms:
-            query_parts.append(f"({' OR '.join(positive_terms)})")
-        if negative_terms:
-            query_parts.append(' '.join(negative_terms)) 
+        return self.list_emails(query=final_query, max_results=max_results, cursor=cursor)
 
-        
-        final_query = f"{' AND '.join(query_parts)} in:inbox" if query_parts else "in:inbox"
+    def iter_emails_by_category(self, category, max_results=20, extra_filters='', first_chunk_size=None, cursor=None):
+        cached = self._lookup_category_local(category, max_results, extra_filters, cursor)
+        if cached is not None:
+            if cached:
+                yield cached
+            return
 
-        print(f"Gmail Query Used for category '{category}': {final_query}")
+        final_query = category_query(category, extra_filters)
+        if final_query is None:
+            print(f"No keywords found for category: '{category}' in CATEGORY_KEYWORDS. Returning empty list.")
+            return
 
-        return self.list_emails(query=final_query, max_results=max_results)
\ No newline at end of file
+        yield from self.iter_emails(query=final_query, max_results=max_results, first_chunk_size=first_chunk_size, cursor=cursor)
@@ -0,0 +1,223 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Voice answers should start well under a second, so the buckets are finest there.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = 'voice_agent'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    # Cumulative buckets as Prometheus expects them; observe() is a bisect and a few
+    # additions under a lock, cheap enough to call for every stage of every command.
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return {'count': series[2], 'sum': series[1]} if series else {'count': 0, 'sum': 0.0}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    # Holds the metrics above plus "stats sources": the stats() dicts the caches,
+    # quota scheduler, prefetcher and outbox already keep, exported as gauges named
+    # <prefix>_<source>_<key>. Non-numeric entries are skipped.
+    def __init__(self):
+        self._metrics = []
+        self._sources = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_stats(self, source, stats_fn):
+        with self._lock:
+            self._sources = [(name, fn) for name, fn in self._sources if name != source] + [(source, stats_fn)]
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            sources = list(self._sources)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for source, stats_fn in sources:
+            try:
+                stats = stats_fn() or {}
+            except Exception as e:
+                print(f"Metrics: stats source {source} failed: {e}")
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{PREFIX}_{source}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    f'{PREFIX}_stage_seconds', 'Time spent in each stage of handling a command.', ['stage'])
+COMMAND_SECONDS = REGISTRY.histogram(
+    f'{PREFIX}_command_seconds', 'Time from receiving a command to finishing it, by intent.', ['intent'])
+FIRST_RESPONSE_SECONDS = REGISTRY.histogram(
+    f'{PREFIX}_first_response_seconds', 'Time from receiving a command to the first event sent back, by intent.', ['intent'])
+GMAIL_CALLS = REGISTRY.counter(
+    f'{PREFIX}_gmail_calls_total', 'Gmail API requests (a batch counts once), by method and outcome.', ['method', 'outcome'])
+GMAIL_BYTES = REGISTRY.counter(
+    f'{PREFIX}_gmail_bytes_total', 'Bytes exchanged with the Gmail API, by direction.', ['direction'])
+SOCKET_EMITS = REGISTRY.counter(
+    f'{PREFIX}_socket_emits_total', 'Socket.IO events sent to clients, by event.', ['event'])
+
+
+class Trace:
+    # The spans of one command, kept per thread so the stages a command passes
+    # through can be logged together once it finishes.
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.intent = 'UNKNOWN'
+        self.first_response = None
+        self.spans = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        stages = ' '.join(f"{stage}={duration * 1000:.1f}ms" for stage, duration in self.spans)
+        return f"intent={self.intent} total={self.elapsed() * 1000:.1f}ms {stages}".rstrip()
+
+
+_local = threading.local()
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace(started=None):
+    # Times one command, from started (a perf_counter() reading) if given: its total
+    # duration and time to first response go to the per-intent histograms when it
+    # ends, under whatever intent set_intent() recorded.
+    command_trace = _local.trace = Trace(started)
+    try:
+        yield command_trace
+    finally:
+        _local.trace = None
+        COMMAND_SECONDS.observe(command_trace.elapsed(), intent=command_trace.intent)
+        if command_trace.first_response is not None:
+            FIRST_RESPONSE_SECONDS.observe(command_trace.first_response, intent=command_trace.intent)
+
+
+def set_intent(intent):
+    command_trace = current_trace()
+    if command_trace is not None:
+        command_trace.intent = intent
+
+
+def record_response():
+    command_trace = current_trace()
+    if command_trace is not None and command_trace.first_response is None:
+        command_trace.first_response = command_trace.elapsed()
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=stage)
+        command_trace = current_trace()
+        if command_trace is not None:
+            command_trace.spans.append((stage, duration))
@@ -1,18 +1,13 @@
-import os, re, json
-import spacy
-from spacy.matcher import Matcher
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import os, re, json, copy, threading
 from datetime import datetime, timedelta
 
-try:
-    nlp = spacy.load('en_core_web_sm')
-except OSError:  
-    import sys, subprocess
-    subprocess.check_call([sys.executable, "-m", "spacy", "download", "en_core_web_sm"])
-    nlp = spacy.load('en_core_web_sm')
+from app.lru import TTLCache
+from app.metrics import span
 
-matcher = Matcher(nlp.vocab)
+# The matcher patterns only look at LOWER and POS, and POS comes from the tagger via
+# the attribute ruler, so commands are parsed without the parser, NER and lemmatizer.
+# Pipelines that set POS some other way (e.g. a morphologizer) run in full.
+FAST_PIPES = ('tok2vec', 'tagger', 'attribute_ruler')
 
 CATEGORY_KEYWORDS = {
     'bank': [
@@ -87,12 +82,6 @@ UNDERSTAND_PATTERNS = [
 ]
 
 
-for p in READ_PATTERNS: matcher.add("READ_EMAIL", [p])
-for p in SEARCH_PATTERNS: matcher.add("SEARCH_EMAIL", [p])
-for p in SEND_PATTERNS: matcher.add("SEND_EMAIL", [p])
-for p in UNDERSTAND_PATTERNS: matcher.add("UNDERSTAND", [p])
-
-
 INTENT_EXAMPLES = {
     "READ_EMAIL": [
         "read my latest emails", "get emails from Harsha", "fetch unread mails", "show emails about project",
@@ -115,32 +104,126 @@ INTENT_EXAMPLES = {
     ]
 }
 
-vectorizer = TfidfVectorizer(lowercase=True)
 intents, examples = [], []
 for intent, intent_examples_list in INTENT_EXAMPLES.items():
     for ex in intent_examples_list:
         intents.append(intent)
         examples.append(ex)
-vectorizer.fit(examples)
 
-def classify_intent(text):
-    doc = nlp(text)
-    matches = matcher(doc)
+SIMILARITY_THRESHOLD = 0.3
+
+# "next 20", "show more", "read the next 5 emails": continue the last listing.
+MORE_EMAILS_PATTERN = re.compile(
+    r'^(?:(?:show|read|get|give|tell|fetch|load)(?: me)? )?(?:the )?(?:next|more)(?: \d+)?(?: (?:emails?|mails?|messages?))?(?: please)?$')
+
+
+class NLPModels:
+    def __init__(self):
+        # Imported here so that importing this module stays cheap; spaCy and
+        # scikit-learn are only loaded when the models are first needed.
+        import spacy
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        try:
+            self.nlp = spacy.load('en_core_web_sm')
+        except OSError:  
+            import sys, subprocess
+            subprocess.check_call([sys.executable, "-m", "spacy", "download", "en_core_web_sm"])
+            self.nlp = spacy.load('en_core_web_sm')
+
+        self.matcher = self.build_matcher()
+
+        pipe_names = self.nlp.pipe_names
+        if 'tagger' in pipe_names and 'attribute_ruler' in pipe_names:
+            self.fast_disabled = [name for name in pipe_names if name not in FAST_PIPES]
+        else:
+            self.fast_disabled = []
+
+        self.vectorizer = TfidfVectorizer(lowercase=True)
+        self.vectorizer.fit(examples)
+        # TfidfVectorizer rows are L2-normalised, so cosine similarity against every example
+        # is one sparse product with this precomputed (features x examples) matrix.
+        self.example_matrix = self.vectorizer.transform(examples).T.tocsr()
+
+    def build_matcher(self):
+        from spacy.matcher import Matcher
+
+        matcher = Matcher(self.nlp.vocab)
+        for p in READ_PATTERNS: matcher.add("READ_EMAIL", [p])
+        for p in SEARCH_PATTERNS: matcher.add("SEARCH_EMAIL", [p])
+        for p in SEND_PATTERNS: matcher.add("SEND_EMAIL", [p])
+        for p in UNDERSTAND_PATTERNS: matcher.add("UNDERSTAND", [p])
+        return matcher
+
+
+_models = None
+_models_lock = threading.Lock()
+models_ready = threading.Event()
+
+def get_models():
+    global _models
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                _models = NLPModels()
+                models_ready.set()
+    return _models
+
+def load_models():
+    get_models()
+
+def classify_by_similarity(texts):
+    models = get_models()
+    similarities = (models.vectorizer.transform(texts) @ models.example_matrix).toarray()
+    best = similarities.argmax(axis=1)
+    scores = similarities.max(axis=1)
+    return [intents[idx] if score > SIMILARITY_THRESHOLD else "UNKNOWN" for idx, score in zip(best, scores)]
+
+def parse_command(text):
+    models = get_models()
+    with span('nlp.parse'):
+        return models.nlp(text, disable=models.fast_disabled)
+
+
+def classify_intent(text, doc=None):
+    models = get_models()
+    if doc is None:
+        doc = parse_command(text)
+    with span('nlp.matcher'):
+        matches = models.matcher(doc)
     
     
     if matches:
-        return nlp.vocab.strings[matches[0][0]]
-    
-    sim = cosine_similarity(vectorizer.transform([text]), vectorizer.transform(examples))[0]
+        return models.nlp.vocab.strings[matches[0][0]]
     
-    if max(sim) > 0.3: 
-        return intents[sim.argmax()]
-    
-    return "UNKNOWN"
+    with span('nlp.similarity'):
+        return classify_by_similarity([text])[0]
+
+
+def classify_intents(texts, docs=None):
+    # Batch version of classify_intent for replaying command logs: one nlp.pipe pass,
+    # then a single similarity product for every text the matcher did not resolve.
+    models = get_models()
+    if docs is None:
+        docs = models.nlp.pipe(texts, disable=models.fast_disabled)
+    results = []
+    unmatched = []
+    for idx, doc in enumerate(docs):
+        matches = models.matcher(doc)
+        if matches:
+            results.append(models.nlp.vocab.strings[matches[0][0]])
+        else:
+            results.append(None)
+            unmatched.append(idx)
+    if unmatched:
+        for idx, intent in zip(unmatched, classify_by_similarity([texts[idx] for idx in unmatched])):
+            results[idx] = intent
+    return results
 
 
-def extract_number_of_emails(text):
-    doc = nlp(text)
+def extract_number_of_emails(text, doc=None):
+    if doc is None:
+        doc = get_models().nlp.make_doc(text)
     for token in doc:
         if token.like_num:
             try:
@@ -202,17 +285,93 @@ def extract_labels_and_filters(text):
     return " ".join(labels + q_parts)
     
 
+# Voice users repeat a handful of phrasings, so parsed results are memoized on the
+# normalized command text. Callers get deep copies, never the cached dict itself.
+# Call invalidate_command_cache() after changing CATEGORY_KEYWORDS or the patterns;
+# it also rebuilds the category plans and the matcher.
+command_cache = TTLCache(max_entries=int(os.environ.get('VOICE_AGENT_COMMAND_CACHE_SIZE', 512)),
+                         ttl=float(os.environ.get('VOICE_AGENT_COMMAND_CACHE_TTL', 600)))
+# Interim transcripts (see app/speculation.py) are mostly half-sentences nobody
+# says again, so they are cached apart and only move to command_cache when a
+# final command turns out to be one of them.
+partial_cache = TTLCache(max_entries=int(os.environ.get('VOICE_AGENT_PARTIAL_CACHE_SIZE', 256)), ttl=60)
+
+def normalize_command(command):
+    return ' '.join(command.lower().split())
+
+def invalidate_command_cache():
+    # Category plans are built from CATEGORY_KEYWORDS and the matcher from the
+    # patterns, so both are rebuilt before cached commands are dropped.
+    from app.category_plans import rebuild_plans  # category_plans imports this module
+    rebuild_plans()
+    if _models is not None:
+        _models.matcher = _models.build_matcher()
+    command_cache.clear()
+    partial_cache.clear()
+
 def process_command(command):
+    text = normalize_command(command)
+    cached = command_cache.get(text)
+    if cached is None:
+        cached = partial_cache.pop(text)
+        if cached is None:
+            cached = _process_command(text)
+        command_cache.put(text, cached)
+    return copy.deepcopy(cached)
+
+def process_partial(command):
+    text = normalize_command(command)
+    cached = partial_cache.get(text)
+    if cached is None:
+        cached = _process_command(text)
+        partial_cache.put(text, cached)
+    return copy.deepcopy(cached)
+
+def process_commands(commands):
+    # Batch version of process_command: commands missing from the cache are parsed
+    # in one nlp.pipe pass and classified together (see classify_intents), and each
+    # distinct command is processed once however often it repeats.
+    texts = [normalize_command(command) for command in commands]
+    results = {}
+    missing = []
+    for text in texts:
+        if text in results:
+            continue
+        cached = command_cache.get(text)
+        results[text] = cached
+        if cached is None:
+            missing.append(text)
+    if missing:
+        models = get_models()
+        with span('nlp.parse'):
+            docs = list(models.nlp.pipe(missing, disable=models.fast_disabled))
+        with span('nlp.classify_batch'):
+            batch_intents = classify_intents(missing, docs)
+        for text, doc, intent in zip(missing, docs, batch_intents):
+            with span('nlp.extract'):
+                results[text] = _extract_parameters(text, text, doc, intent)
+            command_cache.put(text, results[text])
+    return [copy.deepcopy(results[text]) for text in texts]
+
+def _process_command(command):
     text = command.lower().strip()
+    doc = parse_command(text)
     
-    intent = classify_intent(text)
+    intent = classify_intent(text, doc)
     
+    with span('nlp.extract'):
+        return _extract_parameters(command, text, doc, intent)
+
+def _extract_parameters(command, text, doc, intent):
     parameters = {}
     
-    num_emails = extract_number_of_emails(text)
+    num_emails = extract_number_of_emails(text, doc)
     if num_emails:
         parameters['max_results'] = num_emails
 
+    if MORE_EMAILS_PATTERN.match(text):
+        return {"type": "MORE_EMAILS", "parameters": parameters}
+
     if intent == "UNDERSTAND":
         category = detect_category_for_understand(text)
         if category:
@@ -0,0 +1,268 @@
+import random
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from app.quota import GmailThrottledError, is_retryable
+
+
+SENDERS = 2
+MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 2.0
+MAX_RETRY_DELAY = 300.0
+# How often idle senders look for retries that have come due.
+POLL_INTERVAL = 1.0
+# A claimed email is left to its sender for this long. After that it is treated
+# as abandoned by a crashed process and claimed again. This is well past the
+# longest a send can take, including the Gmail client's own retries.
+SENDING_LEASE = 600.0
+MESSAGE_ID_DOMAIN = 'gmail-voice-agent'
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    account TEXT,
+    sid TEXT,
+    recipient TEXT,
+    subject TEXT,
+    body TEXT,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at REAL,
+    last_error TEXT,
+    gmail_id TEXT,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+COLUMNS = ('id', 'account', 'sid', 'recipient', 'subject', 'body', 'status', 'attempts', 'next_attempt_at',
+           'last_error', 'gmail_id', 'created_at', 'updated_at')
+
+
+def message_id_for(key):
+    return f"<{key}@{MESSAGE_ID_DOMAIN}>"
+
+
+class Outbox:
+    # Durable queue of outgoing mail. enqueue() only writes a row to SQLite, so the
+    # user hears "queued" straight away; sender threads then deliver it through the
+    # account's GmailOperations, retrying transient failures with backoff, and report
+    # every change of status through on_status. The id is an idempotency key:
+    # enqueueing the same id twice sends one email.
+    #
+    # Several processes may share one outbox file. A job is claimed with a
+    # conditional UPDATE, so only one sender gets it. Rows left 'sending' by a
+    # crash are claimed again once their lease (updated_at + sending_lease) runs
+    # out. Every email carries a Message-ID derived from its id, so a retry first
+    # asks Gmail whether the earlier attempt got through before sending again.
+    def __init__(self, path='outbox.sqlite3', resolve_ops=None, on_status=None, senders=SENDERS,
+                 max_attempts=MAX_ATTEMPTS, retry_base_delay=RETRY_BASE_DELAY, max_retry_delay=MAX_RETRY_DELAY,
+                 poll_interval=POLL_INTERVAL, sending_lease=SENDING_LEASE):
+        self.path = path
+        self.resolve_ops = resolve_ops
+        self.on_status = on_status
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+        self.sending_lease = sending_lease
+        self.enqueued = 0
+        self.duplicates = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._stopped = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._recover()
+        self._threads = [threading.Thread(target=self._run, name=f"outbox-sender-{index}", daemon=True)
+                         for index in range(senders)]
+        for thread in self._threads:
+            thread.start()
+
+    def _recover(self):
+        # Only rows whose lease has run out: a fresh 'sending' row may belong to
+        # another live process sharing this file.
+        now = time.time()
+        with self._lock:
+            self.recovered = self._conn.execute(
+                "UPDATE outbox SET status = ?, next_attempt_at = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, now, SENDING, now - self.sending_lease)).rowcount
+            self._conn.commit()
+        if self.recovered:
+            print(f"Outbox: re-queued {self.recovered} email(s) interrupted by a restart.")
+
+    def _row(self, key):
+        row = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM outbox WHERE id = ?", (key,)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def get(self, key):
+        with self._lock:
+            return self._row(key)
+
+    def enqueue(self, key, account, sid, to, subject, body):
+        # Returns the job's row. A key seen before returns the existing job, whose
+        # status updates now go to this sid.
+        now = time.time()
+        with self._cond:
+            created = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (id, account, sid, recipient, subject, body, status, attempts, next_attempt_at, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (key, account, sid, to, subject, body, QUEUED, now, now, now)).rowcount
+            if not created:
+                self._conn.execute("UPDATE outbox SET sid = ? WHERE id = ?", (sid, key))
+                self.duplicates += 1
+            else:
+                self.enqueued += 1
+            self._conn.commit()
+            job = self._row(key)
+            self._cond.notify()
+        return job
+
+    def _claim(self):
+        # Takes the oldest due job (or one whose sender's lease ran out), or returns
+        # the seconds until one comes due. The UPDATE only succeeds if the row is
+        # still claimable, so when another process got there first this returns no
+        # job and a zero wait, and the caller looks again.
+        now = time.time()
+        expired = now - self.sending_lease
+        row = self._conn.execute(
+            "SELECT id, next_attempt_at FROM outbox WHERE status = ? OR (status = ? AND updated_at < ?) "
+            "ORDER BY next_attempt_at LIMIT 1", (QUEUED, SENDING, expired)).fetchone()
+        if row is None:
+            return None, self.poll_interval
+        key, due = row
+        if due > now:
+            return None, min(due - now, self.poll_interval)
+        claimed = self._conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ? AND ((status = ? AND next_attempt_at <= ?) OR (status = ? AND updated_at < ?))",
+            (SENDING, now, key, QUEUED, now, SENDING, expired)).rowcount
+        self._conn.commit()
+        if claimed != 1:
+            return None, 0
+        return self._row(key), 0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    job, wait = self._claim()
+                    if job is not None:
+                        break
+                    self._cond.wait(wait)
+            self._notify(job)
+            try:
+                self._deliver(job)
+            except Exception as e:
+                # Only the outbox file itself failing gets here; the job's lease
+                # runs out and it is claimed again.
+                print(f"Outbox: could not record attempt {job['attempts']} for {job['id']}: {e}")
+
+    def _deliver(self, job):
+        message_id = message_id_for(job['id'])
+        try:
+            # Building the account's client can fail too (token refresh, cache
+            # file), which is retried like any other failed attempt.
+            ops = self.resolve_ops(job['account']) if self.resolve_ops is not None else None
+            if ops is None:
+                self._retry(job, f"Gmail is not available for account {job['account']}")
+                return
+            gmail_id = ops.find_sent(message_id) if job['attempts'] > 1 else None
+            if gmail_id is None:
+                gmail_id = ops.send_email(job['recipient'], job['subject'], job['body'], message_id=message_id)
+        except GmailThrottledError as e:
+            self._retry(job, str(e), e.retry_after)
+        except HttpError as e:
+            if is_retryable(e):
+                self._retry(job, str(e))
+            else:
+                self._finish(job, FAILED, error=str(e))
+        except Exception as e:
+            # Network errors and the like: the send may or may not have happened,
+            # which the Message-ID check sorts out on the next attempt.
+            self._retry(job, str(e))
+        else:
+            self._finish(job, SENT, gmail_id=gmail_id)
+
+    def _retry(self, job, error, retry_after=0.0):
+        if job['attempts'] >= self.max_attempts:
+            self._finish(job, FAILED, error=error)
+            return
+        delay = max(retry_after, min(self.max_retry_delay, self.retry_base_delay * (2 ** (job['attempts'] - 1))))
+        delay *= random.uniform(1.0, 1.25)
+        print(f"Outbox: attempt {job['attempts']} for {job['id']} failed ({error}), retrying in {delay:.1f}s")
+        with self._cond:
+            if not self._update_owned(job, "status = ?, next_attempt_at = ?, last_error = ?",
+                                      (QUEUED, time.time() + delay, error)):
+                return
+            self.retried += 1
+            job = self._row(job['id'])
+        self._notify(job)
+
+    def _finish(self, job, status, error=None, gmail_id=None):
+        with self._cond:
+            if not self._update_owned(job, "status = ?, last_error = ?, gmail_id = ?", (status, error, gmail_id)):
+                return
+            if status == SENT:
+                self.sent += 1
+            else:
+                self.failed += 1
+            job = self._row(job['id'])
+        self._notify(job)
+
+    def _update_owned(self, job, assignments, params):
+        # Records the outcome of this sender's attempt, unless its lease ran out and
+        # the job has since been claimed again (by attempt number) or finished.
+        updated = self._conn.execute(
+            f"UPDATE outbox SET {assignments}, updated_at = ? WHERE id = ? AND status = ? AND attempts = ?",
+            tuple(params) + (time.time(), job['id'], SENDING, job['attempts'])).rowcount
+        self._conn.commit()
+        if not updated:
+            print(f"Outbox: attempt {job['attempts']} for {job['id']} was taken over by another sender")
+        return bool(updated)
+
+    def _notify(self, job):
+        if self.on_status is None:
+            return
+        try:
+            self.on_status(job)
+        except Exception as e:
+            print(f"Outbox: status callback failed for {job['id']}: {e}")
+
+    def stats(self):
+        with self._lock:
+            by_status = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {
+            'queued': by_status.get(QUEUED, 0),
+            'sending': by_status.get(SENDING, 0),
+            'sent_total': by_status.get(SENT, 0),
+            'failed_total': by_status.get(FAILED, 0),
+            'enqueued': self.enqueued,
+            'duplicates': self.duplicates,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'recovered': self.recovered,
+        }
+
+    def close(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from app.category_plans import category_query
+from app.quota import TokenBucket
+
+
+# Prefetching may spend at most a tenth of Gmail's 250 units/s per-user quota.
+UNITS_PER_SECOND = 25
+BURST_UNITS = 300
+MAX_QUEUED = 32
+# Foreground requests often come in bursts, so wait for a short lull before starting.
+IDLE_DELAY = 0.5
+TOP_CATEGORIES = 2
+CATEGORY_PAGE_SIZE = 20
+
+
+class Prefetcher:
+    # Warms the message cache with what the user is likely to ask for next (the
+    # next page of the last listing, the most-asked-for categories) while they
+    # listen to the current answer. Work runs on a single background thread and
+    # only while no foreground command is running; a new command from a client
+    # drops that client's queued guesses, and calls that would exceed the prefetch
+    # budget are skipped rather than delayed.
+    def __init__(self, units_per_second=UNITS_PER_SECOND, burst_units=BURST_UNITS, max_queued=MAX_QUEUED,
+                 idle_delay=IDLE_DELAY, top_categories=TOP_CATEGORIES):
+        self.budget = TokenBucket(units_per_second, burst_units)
+        self.max_queued = max_queued
+        self.idle_delay = idle_delay
+        self.top_categories = top_categories
+        self.category_usage = Counter()
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.warmed_messages = 0
+        self._tasks = deque()
+        self._keys = set()
+        self._foreground = 0
+        self._last_foreground = 0.0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='prefetcher', daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def foreground(self, owner=None):
+        with self._cond:
+            self._foreground += 1
+            if owner is not None:
+                self._cancel(owner)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._last_foreground = time.monotonic()
+                self._cond.notify_all()
+
+    def interrupted(self):
+        return self._foreground > 0
+
+    def schedule(self, owner, key, fn, *args, **kwargs):
+        with self._cond:
+            if key in self._keys or len(self._tasks) >= self.max_queued:
+                self.dropped += 1
+                return False
+            self._tasks.append((owner, key, fn, args, kwargs))
+            self._keys.add(key)
+            self.scheduled += 1
+            self._cond.notify_all()
+        return True
+
+    def after_command(self, owner, ops, cursor=None, category=None):
+        # Queues the likely follow-ups to a listing that stopped at cursor (a category
+        # listing when category is set): its next page, then the most-asked-for other
+        # categories. Listings answered locally have no page token and need no help.
+        if category is not None:
+            with self._cond:
+                self.category_usage[category] += 1
+        if cursor is not None and cursor.page_token and not cursor.exhausted:
+            self.schedule(owner, (ops.account, cursor.query, cursor.page_size, cursor.page_token), ops.prefetch,
+                          cursor.query, cursor.page_size, cursor.page_token, should_stop=self.interrupted, budget=self.budget)
+        if ops.search_index is not None:
+            # Categories are already answered from the local index.
+            return
+        with self._cond:
+            top = [name for name, _ in self.category_usage.most_common(self.top_categories + 1) if name != category]
+        for name in top[:self.top_categories]:
+            top_query = category_query(name)
+            if top_query is not None:
+                self.schedule(owner, (ops.account, top_query, CATEGORY_PAGE_SIZE, None), ops.prefetch,
+                              top_query, CATEGORY_PAGE_SIZE, should_stop=self.interrupted, budget=self.budget)
+
+    def cancel(self, owner):
+        with self._cond:
+            self._cancel(owner)
+
+    def _cancel(self, owner):
+        kept = deque()
+        for task in self._tasks:
+            if task[0] == owner:
+                self._keys.discard(task[1])
+                self.cancelled += 1
+            else:
+                kept.append(task)
+        self._tasks = kept
+
+    def _next_task(self):
+        with self._cond:
+            while not self._stopped:
+                idle_for = time.monotonic() - self._last_foreground
+                if self._tasks and self._foreground == 0:
+                    if idle_for >= self.idle_delay:
+                        task = self._tasks.popleft()
+                        self._keys.discard(task[1])
+                        return task
+                    self._cond.wait(self.idle_delay - idle_for)
+                else:
+                    self._cond.wait()
+        return None
+
+    def _run(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            owner, key, fn, args, kwargs = task
+            try:
+                warmed = fn(*args, **kwargs)
+            except Exception as e:
+                print(f"[{owner}] Prefetch failed: {e}")
+                with self._cond:
+                    self.failed += 1
+                continue
+            with self._cond:
+                self.completed += 1
+                self.warmed_messages += warmed or 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._tasks),
+                'scheduled': self.scheduled,
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'warmed_messages': self.warmed_messages,
+                'top_categories': self.category_usage.most_common(self.top_categories),
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
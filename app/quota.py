@@ -0,0 +1,197 @@
+import json
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+
+# Gmail quota units per method (https://developers.google.com/gmail/api/reference/quota).
+QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.send': 100,
+    'history.list': 2,
+    'getProfile': 1,
+}
+DEFAULT_UNITS = 5
+
+# Gmail allows 250 units per user per second, averaged, so short bursts are allowed.
+UNITS_PER_SECOND = 250
+BURST_UNITS = 250
+MAX_RETRIES = 4
+RETRY_BASE_DELAY = 0.5
+MAX_RETRY_DELAY = 16.0
+# Callers queue for quota at most this long before being told they are throttled.
+MAX_WAIT = 10.0
+# Rate and burst of a scheduler that never makes callers wait (see QuotaScheduler.unlimited).
+UNLIMITED_UNITS = 1e9
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+class GmailThrottledError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_rate_limited(exception):
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status == 429:
+        return True
+    if exception.resp.status != 403:
+        return False
+    try:
+        errors = json.loads(exception.content)['error'].get('errors', [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+
+
+def is_retryable(exception):
+    if not isinstance(exception, HttpError):
+        return False
+    return exception.resp.status in RETRYABLE_STATUS_CODES or is_rate_limited(exception)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, units, max_wait):
+        # Takes the units now, letting the balance go negative, and returns how long
+        # the caller must wait for them; reservations are served in arrival order.
+        # Returns None without reserving when that wait would exceed max_wait.
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (units - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= units
+            return wait
+
+    def penalize(self, delay):
+        # Gmail said no: hold back every other caller on this account for delay seconds.
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -delay * self.rate)
+
+    def wait_time(self, units):
+        with self._lock:
+            self._refill()
+            return max(0.0, (units - self._tokens) / self.rate)
+
+
+class QuotaScheduler:
+    # All Gmail calls go through execute(), which spends quota units from the
+    # account's token bucket (waiting for them when needed) and retries rate-limit
+    # and server errors with jittered exponential backoff. A rate-limit error Gmail
+    # returns pauses the whole account, not just the call that got it. When an
+    # account stays throttled, GmailThrottledError is raised so the caller can tell
+    # the user instead of reporting an empty result.
+    def __init__(self, units_per_second=UNITS_PER_SECOND, burst_units=BURST_UNITS, max_retries=MAX_RETRIES,
+                 base_delay=RETRY_BASE_DELAY, max_delay=MAX_RETRY_DELAY, max_wait=MAX_WAIT):
+        self.units_per_second = units_per_second
+        self.burst_units = burst_units
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.calls = 0
+        self.units = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def unlimited(cls, **kwargs):
+        # Retries errors like any scheduler but spends no quota, for services that
+        # are not Gmail's (the fakes benchmarks inject).
+        return cls(units_per_second=UNLIMITED_UNITS, burst_units=UNLIMITED_UNITS, **kwargs)
+
+    def bucket(self, account):
+        with self._lock:
+            bucket = self._buckets.get(account)
+            if bucket is None:
+                bucket = self._buckets[account] = TokenBucket(self.units_per_second, self.burst_units)
+            return bucket
+
+    def acquire(self, account, units):
+        bucket = self.bucket(account)
+        wait = bucket.reserve(units, self.max_wait)
+        if wait is None:
+            retry_after = bucket.wait_time(units)
+            with self._lock:
+                self.throttled += 1
+            raise GmailThrottledError(f"Gmail quota for '{account}' is used up, retry in {retry_after:.1f}s.", retry_after)
+        with self._lock:
+            self.calls += 1
+            self.units += units
+            self.waited_seconds += wait
+        if wait:
+            time.sleep(wait)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay + random.uniform(0, delay)
+
+    def throttle(self, account, attempt):
+        # Records a rate-limit response and returns how long to back off for.
+        delay = self.backoff(attempt)
+        self.bucket(account).penalize(delay)
+        with self._lock:
+            self.rate_limited += 1
+        return delay
+
+    def give_up(self, account, retry_after):
+        with self._lock:
+            self.throttled += 1
+        return GmailThrottledError(f"Gmail is rate limiting '{account}', retry in {retry_after:.1f}s.", retry_after)
+
+    def execute(self, account, method, request, units=None):
+        units = units if units is not None else QUOTA_UNITS.get(method, DEFAULT_UNITS)
+        attempt = 0
+        while True:
+            self.acquire(account, units)
+            try:
+                return request.execute()
+            except HttpError as e:
+                if not is_retryable(e):
+                    raise
+                attempt += 1
+                rate_limited = is_rate_limited(e)
+                delay = self.throttle(account, attempt) if rate_limited else self.backoff(attempt)
+                if attempt > self.max_retries:
+                    if rate_limited:
+                        raise self.give_up(account, delay) from e
+                    raise
+                with self._lock:
+                    self.retries += 1
+                print(f"Gmail {method} failed with {e.resp.status}, retrying in {delay:.2f}s.")
+                time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'units': self.units,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'throttled': self.throttled,
+                'waited_seconds': self.waited_seconds,
+            }
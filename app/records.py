@@ -0,0 +1,157 @@
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+NO_SUBJECT = 'No Subject'
+UNKNOWN_SENDER = 'Unknown Sender'
+NO_SNIPPET = 'No snippet available.'
+
+# How email_snippets payloads are encoded, picked per client with ?payload= on
+# connect: text sends each email as one spoken sentence, columnar sends one list
+# per field (the client builds the sentences, see static/script.js) and msgpack
+# sends the columnar payload as a binary attachment, falling back to columnar
+# when the msgpack package is not installed.
+TEXT = 'text'
+COLUMNAR = 'columnar'
+MSGPACK = 'msgpack'
+PAYLOAD_FORMATS = (TEXT, COLUMNAR, MSGPACK)
+
+
+class EmailRecord:
+    # One listed email, shared by the message cache, single-flight results and the
+    # emit path. Slots instead of a dict per email, and the Subject and From
+    # headers are only looked up when first read, so records built from Gmail
+    # responses that are never spoken cost no header scans. Records are never
+    # changed after creation, so copying one returns it unchanged. get() and
+    # ['from'] keep code written for the old dicts working.
+    __slots__ = ('id', 'snippet', '_headers', '_subject', '_sender')
+
+    def __init__(self, message_id, subject, sender, snippet):
+        self.id = message_id
+        self.snippet = snippet
+        self._headers = None
+        self._subject = subject
+        self._sender = sender
+
+    @classmethod
+    def from_message(cls, msg):
+        record = cls(msg['id'], None, None, msg.get('snippet', NO_SNIPPET))
+        record._headers = msg.get('payload', {}).get('headers', [])
+        return record
+
+    @classmethod
+    def from_row(cls, row):
+        # (id, subject, sender, snippet), the column order of the message cache.
+        return cls(*row)
+
+    def _decode(self):
+        headers = self._headers
+        if headers is None:
+            return
+        self._subject = next((header['value'] for header in headers if header['name'] == 'Subject'), NO_SUBJECT)
+        self._sender = next((header['value'] for header in headers if header['name'] == 'From'), UNKNOWN_SENDER)
+        self._headers = None
+
+    @property
+    def subject(self):
+        if self._headers is not None:
+            self._decode()
+        return self._subject
+
+    @property
+    def sender(self):
+        if self._headers is not None:
+            self._decode()
+        return self._sender
+
+    def __getitem__(self, field):
+        if field == 'id':
+            return self.id
+        if field == 'from':
+            return self.sender
+        if field == 'subject':
+            return self.subject
+        if field == 'snippet':
+            return self.snippet
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {'id': self.id, 'subject': self.subject, 'from': self.sender, 'snippet': self.snippet}
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        if not isinstance(other, EmailRecord):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"EmailRecord(id={self.id!r}, from={self.sender!r}, subject={self.subject!r})"
+
+
+def format_email(idx, email):
+    email_snippet = email.get('snippet', NO_SNIPPET)
+    email_subject = email.get('subject', 'No subject.')
+    email_from = email.get('from', UNKNOWN_SENDER)
+    return f"Email {idx} from {email_from}: {email_subject} — {email_snippet}"
+
+
+def columns(emails, first_index=1):
+    # Senders repeat a lot in long listings (newsletters, notifications), so each
+    # distinct sender is sent once and 'from' holds indexes into 'senders'.
+    senders, sender_index = [], {}
+    from_column = []
+    for email in emails:
+        sender = email.get('from', UNKNOWN_SENDER)
+        position = sender_index.get(sender)
+        if position is None:
+            position = sender_index[sender] = len(senders)
+            senders.append(sender)
+        from_column.append(position)
+    return {
+        'format': COLUMNAR,
+        'first_index': first_index,
+        'senders': senders,
+        'from': from_column,
+        'subject': [email.get('subject', 'No subject.') for email in emails],
+        'snippet': [email.get('snippet', NO_SNIPPET) for email in emails],
+    }
+
+
+def snippet_payload(seq, idx, email, payload_format=TEXT):
+    # One streamed email_snippet event. Clients taking fields rather than sentences
+    # get them here too, msgpack ones as plain fields since one email is too small
+    # to be worth packing.
+    if payload_format in (COLUMNAR, MSGPACK):
+        return {
+            'seq': seq,
+            'format': COLUMNAR,
+            'index': idx,
+            'from': email.get('from', UNKNOWN_SENDER),
+            'subject': email.get('subject', 'No subject.'),
+            'snippet': email.get('snippet', NO_SNIPPET),
+        }
+    return {'seq': seq, 'snippet': format_email(idx, email)}
+
+
+def snippets_payload(emails, first_index=1, payload_format=TEXT):
+    # The email_snippets event for emails numbered from first_index.
+    if payload_format == MSGPACK and msgpack is not None:
+        return {'format': MSGPACK, 'data': msgpack.packb(columns(emails, first_index), use_bin_type=True)}
+    if payload_format in (COLUMNAR, MSGPACK):
+        return columns(emails, first_index)
+    return {'snippets': [format_email(idx, email) for idx, email in enumerate(emails, first_index)]}
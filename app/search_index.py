@@ -0,0 +1,90 @@
+import re
+
+from app.cache import LOCAL_QUERY_LABELS
+from app.category_plans import CATEGORY_PLANS, fts_term
+
+
+# External-content FTS5 table over the cached messages, kept in step by triggers,
+# so subjects, senders and snippets can be searched without calling Gmail.
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, snippet, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, sender, snippet) VALUES (new.rowid, new.subject, new.sender, new.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, snippet) VALUES ('delete', old.rowid, old.subject, old.sender, old.snippet);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF subject, sender, snippet ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, snippet) VALUES ('delete', old.rowid, old.subject, old.sender, old.snippet);
+    INSERT INTO messages_fts (rowid, subject, sender, snippet) VALUES (new.rowid, new.subject, new.sender, new.snippet);
+END;
+"""
+
+FTS_SOURCE = "messages_fts JOIN messages ON messages.rowid = messages_fts.rowid"
+ORDER_BY_DATE = 'messages.internal_date DESC'
+ORDER_BY_RANK = 'messages_fts.rank, messages.internal_date DESC'
+
+SEARCH_TOKEN = re.compile(r'(-?)(from:|subject:)?(?:"([^"]*)"|\(([^)]*)\)|(\S+))')
+
+
+def compile_query(query):
+    # Translates the subset of Gmail search syntax produced by process_command into
+    # an FTS expression plus label filters. Returns None for anything outside it.
+    positive, negative, labels = [], [], []
+    for match in SEARCH_TOKEN.finditer(query or ''):
+        negated, operator, quoted, grouped, bare = match.groups()
+        if bare is not None and bare.lower() in LOCAL_QUERY_LABELS:
+            if negated or operator:
+                return None
+            labels.append(LOCAL_QUERY_LABELS[bare.lower()])
+            continue
+        if bare is not None and ':' in bare:
+            return None
+        text = next(value for value in (quoted, grouped, bare) if value is not None).strip()
+        if not text:
+            continue
+        (negative if negated else positive).append(fts_term(f"{operator or ''}{text}"))
+
+    if negative and not positive:
+        return None
+    expression = ' AND '.join(positive) or None
+    if negative:
+        expression += f" NOT ({' OR '.join(negative)})"
+    return expression, labels
+
+
+class SearchIndex:
+    def __init__(self, cache):
+        self.cache = cache
+        with cache._lock:
+            created = cache._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is None
+            cache._conn.executescript(SCHEMA)
+            if created:
+                cache._conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            cache._conn.commit()
+
+    def _search(self, expression, labels, max_results, offset, order_by):
+        clauses, params = self.cache.label_clauses(labels)
+        if expression is None:
+            return self.cache.select(clauses, params, max_results, offset=offset)
+        return self.cache.select(["messages_fts MATCH ?"] + clauses, [expression] + params, max_results,
+                                 offset=offset, source=FTS_SOURCE, order_by=order_by)
+
+    def search_category(self, category, max_results=20, offset=0, order_by=ORDER_BY_DATE):
+        plan = CATEGORY_PLANS.get(category.lower())
+        if plan is None or plan.fts_expression is None:
+            return None
+        if order_by == ORDER_BY_DATE:
+            # Stored messages are already tagged by the plan's matcher, which agrees with
+            # the FTS expression; only ranking needs the index.
+            return self.cache.lookup_category(plan.category, max_results, offset)
+        return self._search(plan.fts_expression, ['INBOX'], max_results, offset, order_by)
+
+    def search_query(self, query, max_results=50, offset=0, order_by=ORDER_BY_DATE):
+        compiled = compile_query(query)
+        if compiled is None:
+            return None
+        expression, labels = compiled
+        return self._search(expression, labels, max_results, offset, order_by)
@@ -0,0 +1,157 @@
+import os
+import pickle
+import re
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+
+from app.metrics import GMAIL_BYTES
+
+
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.send']
+
+DEFAULT_ACCOUNT = 'default'
+TOKEN_DIR = 'tokens'
+ACCOUNT_NAME = re.compile(r'^[A-Za-z0-9._@+-]+$')
+
+HTTP_TIMEOUT = 30
+REFRESH_INTERVAL = 60
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class AccountNotAuthorizedError(Exception):
+    pass
+
+
+class MeteredHttp(httplib2.Http):
+    # Counts request and (decompressed) response body bytes for /metrics; batch
+    # requests are counted once, as the single HTTP exchange they are.
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        response, content = super().request(uri, method, body, headers, *args, **kwargs)
+        GMAIL_BYTES.inc(len(body or b''), direction='sent')
+        GMAIL_BYTES.inc(len(content or b''), direction='received')
+        return response, content
+
+
+class GmailServicePool:
+    # Hands out one authorized Gmail client per (thread, account). Each client keeps
+    # its own httplib2.Http, so connections are reused across calls on that thread
+    # without being shared between threads. Access tokens are refreshed by a
+    # background thread before they expire, keeping refreshes off the request path.
+    def __init__(self, token_dir=TOKEN_DIR, refresh_interval=REFRESH_INTERVAL, refresh_margin=REFRESH_MARGIN):
+        self.token_dir = token_dir
+        self.refresh_interval = refresh_interval
+        self.refresh_margin = refresh_margin
+        self._credentials = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def token_path(self, account):
+        if account == DEFAULT_ACCOUNT:
+            return 'token.pickle'
+        if not ACCOUNT_NAME.match(account):
+            raise AccountNotAuthorizedError(f"Invalid account name: {account!r}")
+        return os.path.join(self.token_dir, f"{account}.pickle")
+
+    def credentials(self, account=DEFAULT_ACCOUNT):
+        with self._lock:
+            creds = self._credentials.get(account)
+            if creds is None:
+                creds = self._credentials[account] = self._load_credentials(account)
+        self._start_refresher()
+        return creds
+
+    def _load_credentials(self, account):
+        path = self.token_path(account)
+        creds = None
+        if os.path.exists(path):
+            with open(path, 'rb') as token:
+                creds = pickle.load(token)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            elif account == DEFAULT_ACCOUNT:
+                try:
+                    flow = InstalledAppFlow.from_client_secrets_file(
+                        'credentials.json', SCOPES)
+                    creds = flow.run_local_server(port=0)
+                except Exception as e:
+                    print(f"Error loading credentials.json: {e}")
+                    print("Please ensure credentials.json is in the same directory and is correctly formatted.")
+                    print("You can download it from Google Cloud Console (APIs & Services -> Credentials -> OAuth Client ID -> Desktop app).")
+                    exit()
+            else:
+                raise AccountNotAuthorizedError(
+                    f"No token for account '{account}'. Run: python -m app.service_pool authorize {account}")
+            self._save_credentials(account, creds)
+        return creds
+
+    def _save_credentials(self, account, creds):
+        path = self.token_path(account)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as token:
+            pickle.dump(creds, token)
+
+    def service(self, account=DEFAULT_ACCOUNT):
+        services = getattr(self._local, 'services', None)
+        if services is None:
+            services = self._local.services = {}
+        service = services.get(account)
+        if service is None:
+            http = AuthorizedHttp(self.credentials(account), http=MeteredHttp(timeout=HTTP_TIMEOUT))
+            service = services[account] = build('gmail', 'v1', http=http, cache_discovery=False)
+        return service
+
+    def accounts(self):
+        with self._lock:
+            return list(self._credentials)
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='gmail-token-refresher', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh_expiring()
+
+    def refresh_expiring(self):
+        with self._lock:
+            accounts = list(self._credentials.items())
+        for account, creds in accounts:
+            # google-auth stores expiry as a naive UTC datetime.
+            if creds.expiry is None or creds.expiry - datetime.utcnow() > self.refresh_margin:
+                continue
+            try:
+                creds.refresh(Request())
+                self._save_credentials(account, creds)
+            except Exception as e:
+                print(f"Failed to refresh token for account '{account}': {e}")
+
+    def close(self):
+        self._stop.set()
+
+
+def authorize(account):
+    pool = GmailServicePool()
+    flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+    creds = flow.run_local_server(port=0)
+    pool._save_credentials(account, creds)
+    print(f"Saved token for account '{account}' to {pool.token_path(account)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != 'authorize':
+        print("Usage: python -m app.service_pool authorize <account>")
+        sys.exit(1)
+    authorize(sys.argv[2])
@@ -0,0 +1,90 @@
+import copy
+import threading
+
+from app.lru import TTLCache
+from app.metrics import REGISTRY
+
+
+# A morning burst of "show bank mails" arrives within a few seconds; results this
+# fresh are as good as a new Gmail call for a voice answer.
+RESULT_TTL = 5.0
+MAX_RESULTS = 256
+
+DEDUPED_CALLS = REGISTRY.counter(
+    'voice_agent_gmail_dedup_total',
+    'Gmail listings and message fetches by how they were answered: leader (ran the call), shared (waited on an identical '
+    'in-flight call) or cached (reused a recent result).', ['kind', 'outcome'])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Runs at most one call per key at a time: callers arriving while a call for
+    # their key is in flight wait for it and get its result (or its exception).
+    # Successful results are also kept for ttl seconds. Keys must include everything
+    # the result depends on, the account included, so one instance can be shared by
+    # every GmailOperations in the process. Callers get their own deep copies.
+    def __init__(self, ttl=RESULT_TTL, max_entries=MAX_RESULTS):
+        self._results = TTLCache(max_entries=max_entries, ttl=ttl) if ttl else None
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        self.cached = 0
+
+    def do(self, kind, key, fn):
+        with self._lock:
+            if self._results is not None:
+                result = self._results.get(key)
+                if result is not None:
+                    self.cached += 1
+                    DEDUPED_CALLS.inc(kind=kind, outcome='cached')
+                    return copy.deepcopy(result)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        DEDUPED_CALLS.inc(kind=kind, outcome='leader' if leader else 'shared')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            result = fn()
+            call.result = copy.deepcopy(result)
+            if self._results is not None:
+                self._results.put(key, call.result)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def clear(self):
+        if self._results is not None:
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.shared + self.cached
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'cached': self.cached,
+                'dedup_ratio': (self.shared + self.cached) / total if total else 0.0,
+            }
@@ -0,0 +1,161 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.quota import TokenBucket
+
+
+# Guesses from partial transcripts may spend a fifth of Gmail's 250 units/s
+# per-user quota; a listing guess costs 5 units plus 5 per message fetched.
+UNITS_PER_SECOND = 50
+BURST_UNITS = 600
+MAX_WORKERS = 2
+# Interim results of one or two words ("show", "read my") rarely name a query yet.
+MIN_WORDS = 2
+# How long a final command waits for a matching speculative fetch to finish; past
+# that it fetches on its own (and shares whatever is still in flight).
+CONFIRM_TIMEOUT = 5.0
+
+
+class _Utterance:
+    # Speculative work for what a client is saying right now.
+    def __init__(self):
+        self.text = None
+        self.pending = None
+        self.key = None
+        self.running = False
+        self.settled = False
+        self.cancelled = False
+        self.done = threading.Event()
+        self.done.set()
+
+
+class Speculator:
+    # Starts on a command while it is still being spoken. Each partial transcript is
+    # classified (into the partial cache, which a matching final transcript reuses)
+    # and, when plan(sid, text) names a listing, that listing is fetched into the
+    # message cache with GmailOperations.prefetch. Work for a client runs one
+    # partial at a time and only for the newest one; repeated partials and
+    # partials that plan the listing already started are skipped. settle() is called with the final
+    # transcript: a matching listing is waited for, anything else is cancelled.
+    def __init__(self, plan, units_per_second=UNITS_PER_SECOND, burst_units=BURST_UNITS, max_workers=MAX_WORKERS,
+                 min_words=MIN_WORDS, confirm_timeout=CONFIRM_TIMEOUT):
+        self._plan = plan
+        self.budget = TokenBucket(units_per_second, burst_units)
+        self.min_words = min_words
+        self.confirm_timeout = confirm_timeout
+        self.partials = 0
+        self.duplicates = 0
+        self.superseded = 0
+        self.classified = 0
+        self.started = 0
+        self.repeated = 0
+        self.confirmed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.warmed_messages = 0
+        self._utterances = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='speculation')
+
+    def partial(self, sid, text):
+        if len(text.split()) < self.min_words:
+            return False
+        with self._lock:
+            self.partials += 1
+            utterance = self._utterances.get(sid)
+            if utterance is None:
+                utterance = self._utterances[sid] = _Utterance()
+            if text in (utterance.text, utterance.pending):
+                self.duplicates += 1
+                return False
+            if utterance.pending is not None:
+                self.superseded += 1
+            utterance.pending = text
+            if utterance.running:
+                return True
+            utterance.running = True
+            utterance.done.clear()
+        self._pool.submit(self._drain, sid, utterance)
+        return True
+
+    def _drain(self, sid, utterance):
+        while True:
+            with self._lock:
+                text, utterance.pending = utterance.pending, None
+                if text is None or utterance.settled:
+                    utterance.running = False
+                    utterance.done.set()
+                    return
+                utterance.text = text
+            try:
+                self._speculate(sid, utterance, text)
+            except Exception as e:
+                print(f"[{sid}] Speculation failed: {e}")
+                with self._lock:
+                    self.failed += 1
+
+    def _speculate(self, sid, utterance, text):
+        plan = self._plan(sid, text)
+        with self._lock:
+            self.classified += 1
+            if plan is None or utterance.settled:
+                return
+            ops, query, max_results = plan
+            key = (ops.account, query, max_results)
+            if key == utterance.key:
+                self.repeated += 1
+                return
+            utterance.key = key
+            self.started += 1
+        warmed = ops.prefetch(query, max_results, should_stop=lambda: utterance.cancelled or utterance.key != key,
+                              budget=self.budget)
+        with self._lock:
+            self.warmed_messages += warmed
+
+    def settle(self, sid, command):
+        # Called with the final transcript before it runs. Returns True when the
+        # command's listing was started speculatively (and has now finished).
+        with self._lock:
+            utterance = self._utterances.pop(sid, None)
+            if utterance is None:
+                return False
+            utterance.pending = None
+            utterance.settled = True
+            started = utterance.key
+        plan = self._plan(sid, command) if started is not None else None
+        key = (plan[0].account, plan[1], plan[2]) if plan is not None else None
+        if started is not None and key == started:
+            utterance.done.wait(self.confirm_timeout)
+            with self._lock:
+                self.confirmed += 1
+            return True
+        utterance.cancelled = True
+        if started is not None:
+            with self._lock:
+                self.cancelled += 1
+        return False
+
+    def forget(self, sid):
+        with self._lock:
+            utterance = self._utterances.pop(sid, None)
+            if utterance is not None:
+                utterance.settled = utterance.cancelled = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'partials': self.partials,
+                'duplicates': self.duplicates,
+                'superseded': self.superseded,
+                'classified': self.classified,
+                'started': self.started,
+                'repeated': self.repeated,
+                'confirmed': self.confirmed,
+                'cancelled': self.cancelled,
+                'failed': self.failed,
+                'warmed_messages': self.warmed_messages,
+                'hit_rate': self.confirmed / self.started if self.started else 0.0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,83 @@
+import json
+from abc import ABC, abstractmethod
+
+from app.lru import TTLCache
+
+
+# Abandoned conversations (a send flow the user walked away from) expire after this long.
+STATE_TTL = 900
+MAX_CONVERSATIONS = 10000
+KEY_PREFIX = 'voice_agent'
+
+
+class ConversationStore(ABC):
+    # Per-client conversation state, keyed by Socket.IO sid. Values are plain
+    # JSON-serializable dicts; callers must set() a state again after changing it,
+    # since external stores hand out copies. Every set() restarts the TTL.
+    @abstractmethod
+    def get(self, sid):
+        pass
+
+    @abstractmethod
+    def set(self, sid, state):
+        pass
+
+    @abstractmethod
+    def delete(self, sid):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class InMemoryConversationStore(ConversationStore):
+    # For a single server process: bounded in entries and expired by age.
+    def __init__(self, max_entries=MAX_CONVERSATIONS, ttl=STATE_TTL):
+        self._entries = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, sid):
+        return self._entries.get(sid)
+
+    def set(self, sid, state):
+        self._entries.put(sid, state)
+
+    def delete(self, sid):
+        self._entries.pop(sid)
+
+    def stats(self):
+        return self._entries.stats()
+
+
+class RedisConversationStore(ConversationStore):
+    # Shared between server processes, so a client's state survives being served by
+    # another worker. Works with any client exposing redis-py's get/set(ex=)/delete.
+    def __init__(self, client, namespace='conversation', ttl=STATE_TTL):
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, sid):
+        return f"{KEY_PREFIX}:{self.namespace}:{sid}"
+
+    def get(self, sid):
+        value = self.client.get(self._key(sid))
+        return json.loads(value) if value is not None else None
+
+    def set(self, sid, state):
+        self.client.set(self._key(sid), json.dumps(state), ex=int(self.ttl) if self.ttl else None)
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+
+def make_store(url=None, namespace='conversation', ttl=STATE_TTL, max_entries=MAX_CONVERSATIONS):
+    if not url or url == 'memory://':
+        return InMemoryConversationStore(max_entries=max_entries, ttl=ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisConversationStore.from_url(url, namespace=namespace, ttl=ttl)
+    raise ValueError(f"Unsupported conversation store URL: {url}")
@@ -0,0 +1,148 @@
+import os
+import queue
+import tempfile
+import threading
+
+from app.lru import TTLCache
+from app.metrics import span
+
+
+# Rendered responses are kept per phrase, since fixed prompts and common intros are
+# asked for again and again. Snippets rarely repeat and are never cached: at a few
+# hundred kilobytes of WAV each they would only push the prompts out.
+AUDIO_CACHE_ENTRIES = 256
+MAX_PENDING = 512
+
+RESPONSE = 'response'
+SNIPPET = 'snippet'
+
+
+class Pyttsx3Synthesizer:
+    # pyttsx3 drives the platform's speech engine (eSpeak, SAPI5, NSSpeechSynthesizer)
+    # and must only be used from the thread that created it.
+    mime = 'audio/wav'
+
+    def __init__(self, rate=None, voice=None):
+        import pyttsx3
+        self._engine = pyttsx3.init()
+        if rate:
+            self._engine.setProperty('rate', rate)
+        if voice:
+            self._engine.setProperty('voice', voice)
+
+    def synthesize(self, text):
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            self._engine.save_to_file(text, path)
+            self._engine.runAndWait()
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+
+class SpeechRenderer:
+    # Renders text to audio on one background thread, which owns the synthesizer,
+    # and hands each result to on_audio(sid, payload) in the order it was asked for.
+    # Responses are cached by text, so repeated prompts are sent without rendering.
+    # cancel(sid) drops that client's queued phrases, e.g. when it sends a new
+    # command and the old answer would only be talked over.
+    def __init__(self, make_synthesizer, on_audio, max_entries=AUDIO_CACHE_ENTRIES, max_pending=MAX_PENDING):
+        self._make_synthesizer = make_synthesizer
+        self._on_audio = on_audio
+        self._cache = TTLCache(max_entries=max_entries)
+        self._queue = queue.Queue()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self.available = True
+        self.rendered = 0
+        self.dropped = 0
+        self.failed = 0
+        self._worker = threading.Thread(target=self._run, name='tts-renderer', daemon=True)
+        self._worker.start()
+
+    def submit(self, sid, text, kind=RESPONSE):
+        text = (text or '').strip()
+        if not text or not self.available:
+            return False
+        with self._lock:
+            if self._queue.qsize() >= self.max_pending:
+                self.dropped += 1
+                return False
+            generation = self._generations.setdefault(sid, 0)
+        self._queue.put((sid, generation, text, kind))
+        return True
+
+    def prewarm(self, texts):
+        for text in texts:
+            self._queue.put((None, None, text, None))
+
+    def cancel(self, sid):
+        with self._lock:
+            if sid in self._generations:
+                self._generations[sid] += 1
+
+    def forget(self, sid):
+        with self._lock:
+            self._generations.pop(sid, None)
+
+    def _current(self, sid, generation):
+        with self._lock:
+            return self._generations.get(sid) == generation
+
+    def _run(self):
+        try:
+            synthesizer = self._make_synthesizer()
+        except Exception as e:
+            print(f"Server-side speech is unavailable: {e}")
+            self.available = False
+            return
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            sid, generation, text, kind = job
+            if sid is not None and not self._current(sid, generation):
+                with self._lock:
+                    self.dropped += 1
+                continue
+            cacheable = kind != SNIPPET
+            audio = self._cache.get(text) if cacheable else None
+            cached = audio is not None
+            if not cached:
+                try:
+                    with span('tts.render'):
+                        audio = synthesizer.synthesize(text)
+                except Exception as e:
+                    print(f"Failed to render speech for {text!r}: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    continue
+                if cacheable:
+                    self._cache.put(text, audio)
+                with self._lock:
+                    self.rendered += 1
+            if sid is None or not self._current(sid, generation):
+                continue
+            try:
+                self._on_audio(sid, {'kind': kind, 'text': text, 'audio': audio, 'mime': synthesizer.mime, 'cached': cached})
+            except Exception as e:
+                print(f"[{sid}] Failed to send speech: {e}")
+
+    def close(self):
+        self._queue.put(None)
+
+    def stats(self):
+        cache = self._cache.stats()
+        with self._lock:
+            return {
+                'available': self.available,
+                'pending': self._queue.qsize(),
+                'rendered': self.rendered,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'cached_phrases': cache['entries'],
+                'cache_hit_rate': cache['hit_rate'],
+            }
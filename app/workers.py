@@ -0,0 +1,74 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+MAX_WORKERS = 8
+MAX_PENDING = 256
+MAX_QUEUED_PER_CLIENT = 4
+
+
+class CommandExecutor:
+    # Runs command work (NLP + Gmail calls) on a bounded thread pool so a slow
+    # mailbox never blocks the Socket.IO event handlers. Each client's commands run
+    # one at a time and in order, since conversation steps depend on each other.
+    # submit() returns False instead of queueing when the client or the server is
+    # over its limit, so callers can push back on the client.
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING, max_queued_per_client=MAX_QUEUED_PER_CLIENT):
+        self.max_pending = max_pending
+        self.max_queued_per_client = max_queued_per_client
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='command-worker')
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._pending = 0
+
+    def submit(self, client_id, fn, *args, **kwargs):
+        with self._lock:
+            queue = self._queues.get(client_id)
+            if self._pending >= self.max_pending or (queue is not None and len(queue) >= self.max_queued_per_client):
+                self.rejected += 1
+                return False
+            if queue is None:
+                queue = self._queues[client_id] = deque()
+            queue.append((fn, args, kwargs))
+            self._pending += 1
+            start_drain = len(queue) == 1
+        if start_drain:
+            self._pool.submit(self._drain, client_id)
+        return True
+
+    def _drain(self, client_id):
+        while True:
+            with self._lock:
+                fn, args, kwargs = self._queues[client_id][0]
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"[{client_id}] Command failed in worker: {e}")
+            with self._lock:
+                queue = self._queues[client_id]
+                queue.popleft()
+                self._pending -= 1
+                if not queue:
+                    del self._queues[client_id]
+                    return
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self._pending, 'clients': len(self._queues), 'rejected': self.rejected}
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def offload(async_mode, fn, *args, **kwargs):
+    # Runs CPU-bound work (spaCy parsing, model loading) on a native thread when the
+    # server uses green threads, which would otherwise stall every other client.
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if async_mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
@@ -0,0 +1,67 @@
+"""
+Load test of the Socket.IO command handler with many simulated clients against
+a stubbed Gmail backend, comparing inline execution with the worker pool.
+
+    python -m benchmarks.bench_async_load --clients 1 8 32 --commands 4 --latency 0.05
+"""
+import argparse
+import time
+
+from benchmarks.server import load_server
+
+COMMAND = 'search emails from alex'
+
+
+def run(module, clients, commands, timeout=120):
+    test_clients = [module.socketio.test_client(module.app) for _ in range(clients)]
+    for client in test_clients:
+        client.get_received()
+
+    expected = clients * commands
+    started = time.perf_counter()
+    for _ in range(commands):
+        for client in test_clients:
+            client.emit('process_command_event', {'command': COMMAND})
+
+    done, busy = 0, 0
+    while done + busy < expected and time.perf_counter() - started < timeout:
+        for client in test_clients:
+            for packet in client.get_received():
+                if packet['name'] == 'email_snippets':
+                    done += 1
+                elif packet['name'] == 'agent_response' and packet['args'][0].get('type') == 'busy':
+                    busy += 1
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    for client in test_clients:
+        client.disconnect()
+    return done, busy, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--commands', type=int, default=4, help="commands sent by each client")
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    modes = (
+        ('inline', {'VOICE_AGENT_ASYNC': '0'}),
+        ('worker pool', {'VOICE_AGENT_ASYNC': '1', 'VOICE_AGENT_WORKERS': str(args.workers)}),
+    )
+    for label, env in modes:
+        # Every command goes to Gmail rather than reusing a recent identical result.
+        env = dict(env, VOICE_AGENT_RESULT_TTL='0')
+        module, _ = load_server(name=f"voice_agent_{label.replace(' ', '_')}", env=env, latency=args.latency)
+        for clients in args.clients:
+            done, busy, elapsed = run(module, clients, args.commands)
+            print(f"{label:12} clients={clients:3} completed={done:4} rejected={busy:3} "
+                  f"elapsed={elapsed:6.2f} s throughput={done / elapsed:7.1f} commands/s")
+        if module.command_executor is not None:
+            module.command_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
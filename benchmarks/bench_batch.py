@@ -0,0 +1,67 @@
+"""
+Replay a command log through the server two ways: one process_command_event
+per command (as a client would send them), and a single POST /api/commands
+batch in replay mode, which classifies commands in batches and fetches each
+distinct Gmail listing once.
+
+    python -m benchmarks.bench_batch --commands 200 --distinct 20 --latency 0.05
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.nlp_processor import command_cache
+from benchmarks.bench_pipeline import build_corpus
+from benchmarks.server import load_server
+
+
+def replay_log(args):
+    # A log where a few phrasings make up most of the traffic, as with voice users.
+    corpus = [text for intent, text in build_corpus(args.distinct, args.seed) if intent != 'SEND_EMAIL']
+    rng = random.Random(args.seed)
+    return [rng.choice(corpus) for _ in range(args.commands)]
+
+
+def per_event(module, log):
+    client = module.socketio.test_client(module.app)
+    started = time.perf_counter()
+    for command in log:
+        client.emit('process_command_event', {'command': command})
+        client.get_received()
+    elapsed = time.perf_counter() - started
+    client.disconnect()
+    return elapsed
+
+
+def batched(module, log):
+    started = time.perf_counter()
+    response = module.app.test_client().post('/api/commands', json={'mode': 'replay', 'commands': log})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.get_json()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--distinct', type=int, default=20, help="distinct commands in the log")
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    log = replay_log(args)
+    env = {'VOICE_AGENT_ASYNC': '0', 'VOICE_AGENT_PREFETCH': '0', 'VOICE_AGENT_QUOTA_UNITS_PER_SECOND': '1e9'}
+    for label, run in (("per event", per_event), ("batch", batched)):
+        # A fresh message cache per run, so neither starts with the other's mail.
+        env['VOICE_AGENT_CACHE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench_batch.sqlite3')
+        module, service = load_server(name=f"voice_agent_bench_batch_{label.replace(' ', '_')}", env=env, latency=args.latency)
+        command_cache.clear()
+        elapsed = run(module, log)
+        print(f"{label:9} commands={len(log):4} elapsed={elapsed:7.2f} s throughput={len(log) / elapsed:7.1f} commands/s "
+              f"gmail_round_trips={service.round_trips:5}")
+
+
+if __name__ == "__main__":
+    main()
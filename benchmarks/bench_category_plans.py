@@ -0,0 +1,88 @@
+"""
+Compare assigning messages to categories with one pass of the plans' token
+automaton against a substring check per keyword, check the automaton against
+the plans' FTS expressions, and compare building category queries per call
+against the precompiled plans.
+
+    python -m benchmarks.bench_category_plans --messages 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from app import category_plans
+from app.cache import MessageCache
+from app.category_plans import CATEGORY_PLANS, category_query, gmail_term
+from app.gmail import GmailOperations
+from app.search_index import FTS_SOURCE, SearchIndex
+from benchmarks.bench_search_index import synthetic_mailbox
+from benchmarks.fake_gmail import FakeGmailService
+
+
+def categorize_per_keyword(email):
+    text = f"{email['subject']}\n{email['from']}\n{email['snippet']}".lower()
+    sender = email['from'].lower()
+    categories = []
+    for plan in CATEGORY_PLANS.values():
+        def hit(term):
+            if term.startswith('from:'):
+                return term[5:].lower() in sender
+            return term.split(':', 1)[-1].lower() in text
+        if any(hit(term) for term in plan.positive_terms) and not any(hit(term) for term in plan.negative_terms):
+            categories.append(plan.category)
+    return categories
+
+
+def build_query_per_call(plan):
+    positive = ' OR '.join(gmail_term(kw) for kw in plan.positive_terms)
+    negative = ' '.join(f"-{gmail_term(kw)}" for kw in plan.negative_terms)
+    return f"({positive}) AND {negative} in:inbox"
+
+
+def fts_disagreements(ops, messages, emails):
+    # Messages the automaton and the FTS expression put in different categories.
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MessageCache(os.path.join(tmp, 'bench.sqlite3'))
+        SearchIndex(cache)
+        cache.store(ops, messages)
+        differing = 0
+        for category, plan in CATEGORY_PLANS.items():
+            if plan.fts_expression is None:
+                continue
+            fts = {row[0] for row in cache._conn.execute(
+                f"SELECT messages.id FROM {FTS_SOURCE} WHERE messages_fts MATCH ?", (plan.fts_expression,))}
+            tagged = {email.id for email in emails if category in category_plans.category_matcher.categorize(email)}
+            differing += len(fts ^ tagged)
+        cache.close()
+    return differing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=10000)
+    args = parser.parse_args()
+
+    ops = GmailOperations(service=FakeGmailService(message_count=0))
+    messages = synthetic_mailbox(args.messages)
+    emails = [ops._parse_message(msg) for msg in messages]
+
+    for label, categorize in (("per-keyword", categorize_per_keyword), ("automaton", category_plans.category_matcher.categorize)):
+        started = time.perf_counter()
+        assigned = sum(1 for email in emails if categorize(email))
+        elapsed = time.perf_counter() - started
+        print(f"{label:12} messages={len(emails)} categorized={assigned} {elapsed / len(emails) * 1e6:7.2f} us/message")
+    print(f"{'':12} automaton vs FTS plans: {fts_disagreements(ops, messages, emails)} differing (message, category) pairs")
+
+    for label, build in (("per-call", lambda c: build_query_per_call(CATEGORY_PLANS[c])), ("plan", category_query)):
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for category in CATEGORY_PLANS:
+                build(category)
+        elapsed = time.perf_counter() - started
+        print(f"{label:12} {elapsed / (args.rounds * len(CATEGORY_PLANS)) * 1e6:7.2f} us/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Compare HTTP round-trips, response bytes and wall time of
+GmailOperations.list_emails with per-message fetching (batch_size=1) against
+batched fetching, and full-payload against metadata-only fetching.
+
+    python -m benchmarks.bench_list_emails --emails 50 --latency 0.05
+"""
+import argparse
+import time
+
+from app.gmail import GmailOperations, FETCH_FULL, FETCH_METADATA
+from benchmarks.fake_gmail import FakeGmailService
+
+
+def run(batch_size, fetch_mode, emails, latency):
+    service = FakeGmailService(message_count=emails, latency=latency)
+    ops = GmailOperations(service=service, batch_size=batch_size)
+    started = time.perf_counter()
+    results = ops.list_emails('in:inbox', max_results=emails, fetch_mode=fetch_mode)
+    elapsed = time.perf_counter() - started
+    return len(results), service.round_trips, service.response_bytes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per HTTP round-trip")
+    args = parser.parse_args()
+
+    runs = (
+        ("per-message full", 1, FETCH_FULL),
+        ("batched full", 50, FETCH_FULL),
+        ("batched metadata", 50, FETCH_METADATA),
+    )
+    for label, batch_size, fetch_mode in runs:
+        count, round_trips, response_bytes, elapsed = run(batch_size, fetch_mode, args.emails, args.latency)
+        print(f"{label:18} emails={count:4} round_trips={round_trips:4} bytes={response_bytes:9} elapsed={elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
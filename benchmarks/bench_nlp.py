@@ -0,0 +1,74 @@
+"""
+Latency percentiles of the NLP stage: the previous two full-pipeline parses per
+command against one reduced-pipeline parse shared by all extractors, the TF-IDF
+fallback with and without the precomputed example matrix, the batch classifier,
+and end-to-end process_command latency with and without the command cache.
+
+    python -m benchmarks.bench_nlp --rounds 20
+"""
+import argparse
+import statistics
+import time
+
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.nlp_processor import (INTENT_EXAMPLES, _process_command, classify_by_similarity, classify_intent, classify_intents,
+                               examples, get_models, parse_command, process_command)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return statistics.median(samples) * 1000, p99 * 1000
+
+
+def timed(fn, corpus, rounds):
+    samples = []
+    for _ in range(rounds):
+        for text in corpus:
+            started = time.perf_counter()
+            fn(text)
+            samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def full_parse_twice(text):
+    nlp = get_models().nlp
+    nlp(text)
+    nlp(text)
+
+
+def similarity_per_call(text):
+    vectorizer = get_models().vectorizer
+    cosine_similarity(vectorizer.transform([text]), vectorizer.transform(examples))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    corpus = [example for examples in INTENT_EXAMPLES.values() for example in examples]
+    print(f"pipeline: {get_models().nlp.pipe_names}")
+    runs = (
+        ("full parse x2", full_parse_twice),
+        ("fast parse x1", parse_command),
+        ("tfidf per call", similarity_per_call),
+        ("tfidf matrix", lambda text: classify_by_similarity([text])),
+        ("process uncached", _process_command),
+        ("process cached", process_command),
+    )
+    for label, fn in runs:
+        p50, p99 = timed(fn, corpus, args.rounds)
+        print(f"{label:16} p50={p50:7.3f} ms p99={p99:7.3f} ms")
+
+    replay = corpus * args.rounds
+    for label, fn in (("classify loop", lambda: [classify_intent(text) for text in replay]), ("classify batch", lambda: classify_intents(replay))):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        print(f"{label:16} {len(replay) / elapsed:9.0f} commands/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare how long the user waits for "sent" when the Gmail send happens inside
+the command handler with how long it takes to queue the email in the outbox,
+then check recovery: emails queued by a process that "crashes" mid-send (one
+send reaches Gmail but is never marked sent) are delivered exactly once by
+the next one.
+
+    python -m benchmarks.bench_outbox --emails 50 --latency 0.3
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from app.gmail import GmailOperations
+from app.outbox import Outbox, message_id_for
+from benchmarks.fake_gmail import FakeGmailService
+
+# Seconds a claimed email is left to its sender in the crash test.
+CRASH_LEASE = 1.0
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def inline(args):
+    ops = GmailOperations(service=FakeGmailService(message_count=0, latency=args.latency))
+    samples = []
+    for index in range(args.emails):
+        started = time.perf_counter()
+        ops.send_email('alex@example.com', f"Report {index}", 'Numbers attached.')
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def queued(args):
+    service = FakeGmailService(message_count=0, latency=args.latency)
+    ops = GmailOperations(service=service)
+    outbox = Outbox(os.path.join(tempfile.mkdtemp(), 'bench_outbox.sqlite3'), resolve_ops=lambda account: ops)
+    samples = []
+    for index in range(args.emails):
+        started = time.perf_counter()
+        outbox.enqueue(f"bench-{index}", 'default', 'sid', 'alex@example.com', f"Report {index}", 'Numbers attached.')
+        samples.append(time.perf_counter() - started)
+    delivered = wait_for(lambda: outbox.stats()['sent_total'] == args.emails, args.timeout)
+    outbox.close()
+    return samples, delivered, len(service.sent)
+
+
+def recovery(args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench_outbox.sqlite3')
+    service = FakeGmailService(message_count=0, latency=args.latency)
+    ops = GmailOperations(service=service)
+
+    first = Outbox(path, resolve_ops=lambda account: None, senders=0)
+    for index in range(args.emails):
+        first.enqueue(f"crash-{index}", 'default', 'sid', 'alex@example.com', f"Report {index}", 'Numbers attached.')
+    # The crash: one email reaches Gmail, then the process dies before recording it,
+    # leaving its row 'sending'.
+    with first._lock:
+        job, _ = first._claim()
+    ops.send_email(job['recipient'], job['subject'], job['body'], message_id=message_id_for(job['id']))
+    first.close()
+
+    # The restarted process starts after the crashed one's lease has run out.
+    time.sleep(CRASH_LEASE * 1.1)
+    second = Outbox(path, resolve_ops=lambda account: ops, sending_lease=CRASH_LEASE)
+    delivered = wait_for(lambda: second.stats()['sent_total'] == args.emails, args.timeout)
+    stats = second.stats()
+    second.close()
+    return delivered, len(service.sent), stats['recovered']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.3, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    samples = inline(args)
+    print(f"inline send   median={statistics.median(samples) * 1000:8.2f} ms max={max(samples) * 1000:8.2f} ms")
+    samples, delivered, sent = queued(args)
+    print(f"outbox queue  median={statistics.median(samples) * 1000:8.2f} ms max={max(samples) * 1000:8.2f} ms "
+          f"delivered={'all' if delivered else 'NOT all'} gmail_sends={sent}")
+    delivered, sent, recovered = recovery(args)
+    print(f"after crash   recovered={recovered} delivered={'all' if delivered else 'NOT all'} "
+          f"gmail_sends={sent} (expected {args.emails})")
+
+
+if __name__ == "__main__":
+    main()
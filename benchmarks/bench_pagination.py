@@ -0,0 +1,47 @@
+"""
+Page through a search result with an EmailCursor ("next 20" after "next 20")
+and compare it with re-listing from the top with a growing max_results, the
+only way to reach deeper results before cursors existed.
+
+    python -m benchmarks.bench_pagination --pages 10 --page-size 20 --latency 0.05
+"""
+import argparse
+import time
+
+from app.gmail import EmailCursor, GmailOperations
+from benchmarks.fake_gmail import FakeGmailService
+
+QUERY = 'subject:(invoice)'
+
+
+def run(use_cursor, args):
+    service = FakeGmailService(message_count=args.pages * args.page_size + 50, latency=args.latency, attachment_size=0)
+    ops = GmailOperations(service=service)
+    cursor = EmailCursor(QUERY, args.page_size)
+    seen = []
+    started = time.perf_counter()
+    for page in range(args.pages):
+        if use_cursor:
+            emails = ops.list_emails(QUERY, max_results=args.page_size, cursor=cursor)
+        else:
+            emails = ops.list_emails(QUERY, max_results=(page + 1) * args.page_size)[page * args.page_size:]
+        seen.extend(email['id'] for email in emails)
+    elapsed = time.perf_counter() - started
+    assert len(seen) == len(set(seen)) == args.pages * args.page_size
+    return service.round_trips, service.calls['messages.get'], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per HTTP round-trip")
+    args = parser.parse_args()
+
+    for label, use_cursor in (("re-list from top", False), ("cursor", True)):
+        round_trips, gets, elapsed = run(use_cursor, args)
+        print(f"{label:17} pages={args.pages:3} round_trips={round_trips:4} message_gets={gets:5} elapsed={elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
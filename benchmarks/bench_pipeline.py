@@ -0,0 +1,230 @@
+"""
+Offline benchmark of the command pipeline over a synthetic corpus of command
+variations built from INTENT_EXAMPLES: intent classification, the parameter
+extractors, process_command with and without the command cache, and the
+Socket.IO handler end to end (test client, fake Gmail with no latency).
+Reports throughput, latency percentiles and peak traced memory per stage.
+
+    python -m benchmarks.bench_pipeline --size 2000 --save-baseline
+    python -m benchmarks.bench_pipeline --size 2000          # compares with the saved baseline
+
+Results are compared with --baseline (benchmarks/baseline_pipeline.json by
+default) when it exists; a stage whose p95 latency or per-command time is more
+than --tolerance (and --min-delta-ms) worse is reported as a regression and the
+exit status is 1.
+Baselines are machine-specific, so save one on the machine you compare on.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from app.nlp_processor import (INTENT_EXAMPLES, _process_command, classify_intent, command_cache, detect_category_for_understand,
+                               extract_content, extract_labels_and_filters, extract_number_of_emails, extract_sender,
+                               extract_subject, get_models, process_command)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_pipeline.json')
+PREFIXES = ['', '', 'please ', 'can you ', 'hey ', 'could you ']
+SUFFIXES = ['', '', ' please', ' now', ' for me', ' today']
+SENDERS = ['Alex', 'Harsha', 'Priya', 'John', 'Sarah', 'Maria', 'Chen', 'Omar']
+TOPICS = ['project', 'deadline', 'sales', 'invoice', 'meeting', 'budget', 'launch', 'review']
+CATEGORIES = ['bank', 'shopping', 'food', 'travel', 'finance', 'work', 'personal']
+TERMINAL_EVENTS = ('email_snippets', 'email_snippets_done', 'agent_response')
+MEMORY_SAMPLE = 300
+
+
+def vary(text, rng):
+    words = []
+    for word in text.split():
+        if word.isdigit():
+            word = str(rng.randint(1, 20))
+        elif word in SENDERS:
+            word = rng.choice(SENDERS)
+        elif word in TOPICS:
+            word = rng.choice(TOPICS)
+        elif word in CATEGORIES:
+            word = rng.choice(CATEGORIES)
+        words.append(word)
+    return f"{rng.choice(PREFIXES)}{' '.join(words)}{rng.choice(SUFFIXES)}"
+
+
+def build_corpus(size, seed=0):
+    # Distinct lowercase commands, so the uncached stages never see a repeat.
+    rng = random.Random(seed)
+    seeds = [(intent, example) for intent, examples in INTENT_EXAMPLES.items() for example in examples]
+    corpus, seen = [], set()
+    attempts = 0
+    while len(corpus) < size and attempts < size * 50:
+        attempts += 1
+        intent, example = rng.choice(seeds)
+        text = vary(example, rng).lower()
+        if text not in seen:
+            seen.add(text)
+            corpus.append((intent, text))
+    return corpus
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def measure(fn, items, repeat=1, before_pass=None):
+    # Keeps the fastest of repeat passes, like timeit, to damp scheduling noise.
+    # before_pass resets state (e.g. caches) so every pass does the same work.
+    best = None
+    for _ in range(repeat):
+        if before_pass is not None:
+            before_pass()
+        samples = []
+        started = time.perf_counter()
+        for item in items:
+            call_started = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best[1]:
+            best = (samples, elapsed)
+    samples, elapsed = best
+
+    # Memory is traced in a separate, smaller pass, since tracing slows every allocation.
+    if before_pass is not None:
+        before_pass()
+    tracemalloc.start()
+    for item in items[:MEMORY_SAMPLE]:
+        fn(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        'count': len(samples),
+        'throughput': len(samples) / elapsed,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_extractors(text):
+    extract_number_of_emails(text)
+    extract_sender(text)
+    extract_subject(text)
+    extract_content(text)
+    extract_labels_and_filters(text)
+    detect_category_for_understand(text)
+
+
+def handler_stage(texts, repeat):
+    from benchmarks.server import load_server
+
+    # No Gmail latency and no quota limit, so only the server's own work is timed.
+    env = {'VOICE_AGENT_ASYNC': '0', 'VOICE_AGENT_PREFETCH': '0', 'VOICE_AGENT_QUOTA_UNITS_PER_SECOND': '1e9'}
+    module, _ = load_server(name='voice_agent_bench_pipeline', env=env, latency=0.0)
+    client = module.socketio.test_client(module.app)
+    client.get_received()
+
+    def handle(text):
+        # Without the worker pool the handler runs inside emit(), so it has
+        # finished (and queued its replies) when emit returns.
+        client.emit('process_command_event', {'command': text})
+        if not any(packet['name'] in TERMINAL_EVENTS for packet in client.get_received()):
+            raise RuntimeError(f"no reply to {text!r}")
+
+    try:
+        return measure(handle, texts, repeat, before_pass=command_cache.clear)
+    finally:
+        client.disconnect()
+
+
+def slower(before_ms, after_ms, tolerance, min_delta_ms):
+    # Microsecond stages jitter by large ratios, so a slowdown must also be
+    # min_delta_ms in absolute terms to count.
+    return after_ms > before_ms * (1 + tolerance) and after_ms - before_ms > min_delta_ms
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    regressions = []
+    for stage, result in results.items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None:
+            continue
+        if slower(previous['p95_ms'], result['p95_ms'], tolerance, min_delta_ms):
+            regressions.append(f"{stage}: p95 {previous['p95_ms']:.3f} -> {result['p95_ms']:.3f} ms")
+        if slower(1000 / previous['throughput'], 1000 / result['throughput'], tolerance, min_delta_ms):
+            regressions.append(f"{stage}: throughput {previous['throughput']:.0f} -> {result['throughput']:.0f} /s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=2000, help="distinct commands in the corpus")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--handler-commands', type=int, default=300, help="commands sent through the Socket.IO handler")
+    parser.add_argument('--repeat', type=int, default=3, help="passes per stage; the fastest is reported")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed slowdown before flagging a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="ignore slowdowns smaller than this per command")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size, args.seed)
+    texts = [text for _, text in corpus]
+    get_models()
+    print(f"corpus: {len(texts)} commands, pipeline: {get_models().nlp.pipe_names}")
+
+    results = {
+        'classify_intent': measure(classify_intent, texts, args.repeat),
+        'extractors': measure(run_extractors, texts, args.repeat),
+        'process_uncached': measure(_process_command, texts, args.repeat),
+    }
+    # Warm the cache with as many commands as it holds, then time cache hits only.
+    hot = texts[:command_cache.max_entries]
+    for text in hot:
+        process_command(text)
+    results['process_cached'] = measure(process_command, (hot * (len(texts) // len(hot) + 1))[:len(texts)], args.repeat)
+
+    # Send flows would leave a conversation waiting for a recipient, so the handler
+    # stage replays the other intents.
+    handler_texts = [text for intent, text in corpus if intent != 'SEND_EMAIL'][:args.handler_commands]
+    results['handle_command'] = handler_stage(handler_texts, args.repeat)
+
+    for stage, result in results.items():
+        print(f"{stage:17} n={result['count']:5} {result['throughput']:9.0f} /s p50={result['p50_ms']:7.3f} "
+              f"p95={result['p95_ms']:7.3f} p99={result['p99_ms']:7.3f} ms peak={result['peak_kib']:8.1f} KiB")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'corpus_size': len(texts),
+                'seed': args.seed,
+                'repeat': args.repeat,
+                'stages': results,
+            }, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('corpus_size') != len(texts) or baseline.get('seed') != args.seed:
+        print("Warning: baseline was recorded with a different corpus size or seed.")
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("Regressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"No regressions against baseline (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
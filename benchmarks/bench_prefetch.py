@@ -0,0 +1,83 @@
+"""
+Replay a conversation of category requests, with a pause after each answer
+standing in for the time the user spends listening to it, and compare the
+foreground latency with and without the speculative prefetcher.
+
+    python -m benchmarks.bench_prefetch --latency 0.1 --think 0.8 --page-ttl 5 --budget 25
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from app.cache import MessageCache
+from app import category_plans
+from app.category_plans import CATEGORY_PLANS, category_query
+from app.gmail import EmailCursor, GmailOperations
+from app.prefetch import Prefetcher
+from app.singleflight import SingleFlight
+from benchmarks.bench_search_index import synthetic_mailbox
+from benchmarks.fake_gmail import FakeGmailService
+
+CONVERSATION = ['bank', 'finance', 'bank', 'shopping', 'finance', 'bank', 'travel', 'finance', 'bank', 'finance']
+QUERY_CATEGORIES = {plan.gmail_query: category for category, plan in CATEGORY_PLANS.items()}
+
+
+def matches_category(query, message):
+    # Stands in for Gmail's search: a category query matches what the local matcher puts in that category.
+    category = QUERY_CATEGORIES.get(query)
+    if category is None:
+        return True
+    headers = {header['name']: header['value'] for header in message['payload']['headers']}
+    email = {'subject': headers.get('Subject', ''), 'from': headers.get('From', ''), 'snippet': message['snippet']}
+    return category in category_plans.category_matcher.categorize(email)
+
+
+def run(prefetch, args):
+    service = FakeGmailService(message_count=0, latency=args.latency, query_filter=matches_category)
+    service.messages = synthetic_mailbox(args.messages)
+    service.by_id = {message['id']: message for message in service.messages}
+    cache = MessageCache(os.path.join(tempfile.mkdtemp(), 'bench_prefetch.sqlite3'), page_ttl=args.page_ttl)
+    # No result reuse, so only the prefetcher makes repeated requests faster.
+    ops = GmailOperations(service=service, cache=cache, single_flight=SingleFlight(ttl=0))
+    prefetcher = Prefetcher(units_per_second=args.budget, idle_delay=0.05) if prefetch else None
+
+    samples = []
+    for category in CONVERSATION:
+        cursor = EmailCursor(category_query(category), 20, category)
+        started = time.perf_counter()
+        if prefetcher is None:
+            ops.list_emails_by_category(category, cursor=cursor)
+        else:
+            with prefetcher.foreground('bench'):
+                ops.list_emails_by_category(category, cursor=cursor)
+        samples.append(time.perf_counter() - started)
+        if prefetcher is not None:
+            prefetcher.after_command('bench', ops, cursor, category)
+        time.sleep(args.think)
+
+    stats = prefetcher.stats() if prefetcher is not None else {}
+    if prefetcher is not None:
+        prefetcher.shutdown()
+    return samples, service.calls, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.1, help="simulated seconds per HTTP round-trip")
+    parser.add_argument('--think', type=float, default=0.8, help="seconds the user spends listening to each answer")
+    parser.add_argument('--page-ttl', type=float, default=5.0, help="seconds a listed page may be reused")
+    parser.add_argument('--budget', type=float, default=25, help="prefetch quota units per second")
+    args = parser.parse_args()
+
+    for label, prefetch in (("no prefetch", False), ("prefetch", True)):
+        samples, calls, stats = run(prefetch, args)
+        print(f"{label:12} median={statistics.median(samples) * 1000:7.1f} ms mean={statistics.mean(samples) * 1000:7.1f} ms "
+              f"list_calls={calls['messages.list']:3} get_calls={calls['messages.get']:4}"
+              + (f" prefetched={stats['completed']} dropped={stats['dropped']}" if stats else ""))
+
+
+if __name__ == "__main__":
+    main()
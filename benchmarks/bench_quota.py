@@ -0,0 +1,70 @@
+"""
+Drive concurrent list_emails calls against a fake Gmail that answers with 429s,
+either at random or once a per-second quota is exceeded, and compare an
+unthrottled client (retries only) against the token-bucket scheduler.
+
+    python -m benchmarks.bench_quota --threads 8 --calls 4 --quota 500
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.gmail import GmailOperations
+from app.quota import GmailThrottledError, QuotaScheduler
+from app.singleflight import SingleFlight
+from benchmarks.fake_gmail import FakeGmailService
+
+
+def run(scheduler, threads, calls, emails, **fake_kwargs):
+    # Every call lists its own slice of the mailbox, so neither single-flight nor
+    # the shared message fetches merge calls, and every one is paid for in quota.
+    service = FakeGmailService(message_count=threads * calls * emails, attachment_size=0, **fake_kwargs)
+    slices = {message['id']: position // emails for position, message in enumerate(service.messages)}
+    service.query_filter = lambda q, message: slices[message['id']] == int(q.rsplit('-', 1)[1])
+    ops = GmailOperations(service=service, scheduler=scheduler, single_flight=SingleFlight(ttl=0))
+
+    def worker(thread):
+        outcomes = []
+        for call in range(calls):
+            query = f"in:inbox -label:bench-{thread * calls + call}"
+            try:
+                outcomes.append('ok' if len(ops.list_emails(query, max_results=emails)) == emails else 'partial')
+            except GmailThrottledError:
+                outcomes.append('throttled')
+        return outcomes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        outcomes = [outcome for result in pool.map(worker, range(threads)) for outcome in result]
+    elapsed = time.perf_counter() - started
+    return outcomes, service.rate_limited, scheduler.stats(), elapsed
+
+
+def report(label, outcomes, rate_limited, stats, elapsed):
+    print(f"{label:28} ok={outcomes.count('ok'):3} partial={outcomes.count('partial'):3} "
+          f"throttled={outcomes.count('throttled'):3} 429s={rate_limited:5} retries={stats['retries']:4} "
+          f"waited={stats['waited_seconds']:6.2f} s elapsed={elapsed:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=4)
+    parser.add_argument('--emails', type=int, default=20)
+    parser.add_argument('--quota', type=float, default=500, help="fake Gmail quota units per second")
+    parser.add_argument('--throttle-rate', type=float, default=0.1, help="fraction of calls answered with a random 429")
+    args = parser.parse_args()
+
+    scenarios = (
+        ("random 429s", {'throttle_rate': args.throttle_rate}, QuotaScheduler(units_per_second=1e9, burst_units=1e9, base_delay=0.05)),
+        ("quota, retries only", {'quota_per_second': args.quota}, QuotaScheduler(units_per_second=1e9, burst_units=1e9, base_delay=0.05)),
+        # The fake counts units over a sliding second, so burst plus one second of refill must fit in it.
+        ("quota, token bucket", {'quota_per_second': args.quota},
+         QuotaScheduler(units_per_second=args.quota * 0.8, burst_units=args.quota * 0.2, base_delay=0.05)),
+    )
+    for label, fake_kwargs, scheduler in scenarios:
+        report(label, *run(scheduler, args.threads, args.calls, args.emails, **fake_kwargs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare the memory of cached messages held as dicts and as EmailRecords, the
+cost of building them from Gmail responses, and the size of the email_snippets
+payload in each format, for large result sets.
+
+    python -m benchmarks.bench_records --messages 20000 --sizes 100 1000 10000
+
+Memory is traced around reading every row of a message cache, so it includes
+the strings SQLite hands back, as the server would hold them. Payload sizes are
+the JSON Socket.IO sends (msgpack's binary when the package is installed).
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app.cache import MessageCache
+from app.gmail import GmailOperations
+from app.records import COLUMNAR, MSGPACK, TEXT, EmailRecord, msgpack, snippets_payload
+from benchmarks.bench_search_index import synthetic_mailbox
+from benchmarks.fake_gmail import FakeGmailService
+
+SELECT_ROWS = "SELECT id, subject, sender, snippet FROM messages"
+
+
+def as_dict(row):
+    # How the cache returned messages before EmailRecord.
+    return {'id': row[0], 'subject': row[1], 'from': row[2], 'snippet': row[3]}
+
+
+def parse_eager(msg):
+    headers = msg.get('payload', {}).get('headers', [])
+    return {
+        'id': msg['id'],
+        'subject': next((header['value'] for header in headers if header['name'] == 'Subject'), 'No Subject'),
+        'from': next((header['value'] for header in headers if header['name'] == 'From'), 'Unknown Sender'),
+        'snippet': msg.get('snippet', 'No snippet available.'),
+    }
+
+
+def traced_rows(cache, build):
+    tracemalloc.start()
+    held = [build(row) for row in cache._conn.execute(SELECT_ROWS)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held, current
+
+
+def timed(fn, items, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items) * 1e6
+
+
+def payload_bytes(payload):
+    if payload.get('format') == MSGPACK:
+        return len(payload['data'])
+    # python-socketio's encoding of event arguments.
+    return len(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000, help="messages in the cache")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help="emails per payload")
+    args = parser.parse_args()
+
+    messages = synthetic_mailbox(args.messages)
+    ops = GmailOperations(service=FakeGmailService(message_count=0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MessageCache(os.path.join(tmp, 'bench.sqlite3'))
+        cache.store(ops, messages)
+
+        print(f"memory, {args.messages} cached messages:")
+        for label, build in (("dict", as_dict), ("record", EmailRecord.from_row)):
+            held, size = traced_rows(cache, build)
+            print(f"  {label:8} {size / len(held):7.1f} B/message ({size / 2 ** 20:.1f} MiB)")
+            del held
+        cache.close()
+
+    print("building from Gmail responses:")
+    for label, build in (("dict", parse_eager), ("record", EmailRecord.from_message),
+                         ("record+read", lambda msg: EmailRecord.from_message(msg).subject)):
+        print(f"  {label:12} {timed(build, messages):6.2f} us/message")
+
+    records = [EmailRecord.from_message(msg) for msg in messages]
+    formats = [TEXT, COLUMNAR] + ([MSGPACK] if msgpack is not None else [])
+    if msgpack is None:
+        print("msgpack is not installed; the msgpack format falls back to columnar.")
+    print("email_snippets payload:")
+    for size in args.sizes:
+        emails = (records * (size // len(records) + 1))[:size]
+        text_bytes = None
+        for payload_format in formats:
+            started = time.perf_counter()
+            payload = snippets_payload(emails, 1, payload_format)
+            encoded = payload_bytes(payload)
+            elapsed = time.perf_counter() - started
+            text_bytes = text_bytes or encoded
+            print(f"  {size:6} emails {payload_format:9} {encoded / 1024:9.1f} KiB "
+                  f"({encoded / text_bytes:4.0%} of text) {elapsed * 1000:7.2f} ms to encode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Start 1, 2, 4... stub server processes on consecutive ports and spread many
+Socket.IO clients across them round-robin, as a sticky load balancer would,
+then report how many clients connected and how many commands per second the
+fleet completed. Clients run in their own processes so the load generator is
+not what saturates.
+
+    python -m benchmarks.bench_scaleout --workers 1 2 4 --clients 64 --commands 4
+
+Server processes inherit the environment, so SOCKETIO_ASYNC_MODE,
+SOCKETIO_MESSAGE_QUEUE and VOICE_AGENT_STATE_URL can be set to measure those
+configurations too.
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import requests
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A search, so every command lists from the (fake) Gmail service and pays --latency;
+# "read 5 emails" is answered from the local message cache.
+COMMAND = 'search 5 emails from alex'
+# Commands go to Gmail each time instead of reusing a recent identical result, and
+# are not held to one account's quota, so the fleet's own capacity is measured.
+SERVER_ENV = {'VOICE_AGENT_ASYNC': '1', 'VOICE_AGENT_RESULT_TTL': '0', 'VOICE_AGENT_QUOTA_UNITS_PER_SECOND': '1e9'}
+
+
+def start_servers(workers, base_port, args):
+    processes = []
+    for index in range(workers):
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.run_stub_server', '--port', str(base_port + index),
+             '--latency', str(args.latency)],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env={**SERVER_ENV, **os.environ},
+        ))
+    deadline = time.monotonic() + args.startup_timeout
+    for index in range(workers):
+        url = f"http://127.0.0.1:{base_port + index}/ready"
+        while True:
+            try:
+                if requests.get(url, timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                stop_servers(processes)
+                raise RuntimeError(f"server on port {base_port + index} did not start")
+            time.sleep(0.2)
+    return processes
+
+
+def stop_servers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def client_process(urls, commands, timeout, start, results):
+    # One OS process holding several clients, each sending its commands one after another.
+    clients = []
+    pending = {}
+    for url in urls:
+        client = socketio.Client(reconnection=False)
+
+        def on_snippets(data, client=client):
+            pending[client] -= 1
+
+        client.on('email_snippets', on_snippets)
+        try:
+            client.connect(url, transports=['polling'], wait_timeout=timeout)
+        except Exception:
+            continue
+        clients.append(client)
+    start.wait()
+
+    started = time.perf_counter()
+    for _ in range(commands):
+        for client in clients:
+            pending[client] = pending.get(client, 0) + 1
+            client.emit('process_command_event', {'command': COMMAND})
+        deadline = time.perf_counter() + timeout
+        while any(pending.get(client, 0) > 0 for client in clients) and time.perf_counter() < deadline:
+            time.sleep(0.005)
+    completed = sum(commands - pending.get(client, 0) for client in clients)
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.disconnect()
+    results.put((len(clients), completed, elapsed))
+
+
+def run(workers, args):
+    processes = start_servers(workers, args.base_port, args)
+    try:
+        urls = [f"http://127.0.0.1:{args.base_port + index % workers}" for index in range(args.clients)]
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        groups = [urls[index::args.client_processes] for index in range(args.client_processes)]
+        loaders = [multiprocessing.Process(target=client_process, args=(group, args.commands, args.timeout, start, results))
+                   for group in groups if group]
+        for loader in loaders:
+            loader.start()
+        # Let every client connect before the clock starts.
+        time.sleep(args.connect_wait)
+        started = time.perf_counter()
+        start.set()
+        outcomes = [results.get() for _ in loaders]
+        elapsed = time.perf_counter() - started
+        for loader in loaders:
+            loader.join()
+    finally:
+        stop_servers(processes)
+    connected = sum(outcome[0] for outcome in outcomes)
+    completed = sum(outcome[1] for outcome in outcomes)
+    return connected, completed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="server processes per run")
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--commands', type=int, default=4, help="commands sent by each client")
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--client-processes', type=int, default=8)
+    parser.add_argument('--base-port', type=int, default=5101)
+    parser.add_argument('--connect-wait', type=float, default=3.0)
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        connected, completed, elapsed = run(workers, args)
+        print(f"workers={workers:2} clients={connected:4}/{args.clients:<4} completed={completed:5}/{args.clients * args.commands:<5} "
+              f"elapsed={elapsed:6.2f} s throughput={completed / elapsed:7.1f} commands/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare local evaluation of category and keyword queries against the SQLite
+FTS5 index with the remote Gmail path, on a synthetic mailbox.
+
+    python -m benchmarks.bench_search_index --messages 100000 --latency 0.15
+
+The remote path runs against the fake service, so its cost is the simulated
+round-trip latency plus client-side overhead; the local path is real.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from app.cache import MessageCache
+from app.gmail import GmailOperations
+from app.nlp_processor import CATEGORY_KEYWORDS
+from app.search_index import SearchIndex
+from app.singleflight import SingleFlight
+from benchmarks.fake_gmail import FakeGmailService, make_message
+
+FILLER = ['weekly', 'update', 'meeting', 'notes', 'newsletter', 'reminder', 'invitation', 'report', 'team', 'offer']
+
+
+def synthetic_mailbox(count, seed=7):
+    rng = random.Random(seed)
+    keywords = [kw for keywords in CATEGORY_KEYWORDS.values() for kw in keywords if not kw.startswith(('-', 'from:'))]
+    domains = ['example.com', 'hdfcbank.com', 'amazon.in', 'zomato.com', 'makemytrip.com', 'lensa.com']
+    messages = []
+    for index in range(count):
+        message = make_message(index, attachment_size=0)
+        words = rng.sample(FILLER, 3)
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        if rng.random() < 0.05:
+            words.append(rng.choice(['job', 'hiring', 'interview']))
+        message['payload']['headers'][0]['value'] = ' '.join(words).capitalize()
+        message['payload']['headers'][1]['value'] = f"Sender {index % 97} <noreply@{rng.choice(domains)}>"
+        message['snippet'] = ' '.join(rng.sample(FILLER, 5))
+        messages.append(message)
+    return messages
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return result, statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--latency', type=float, default=0.15, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    service = FakeGmailService(message_count=0)
+    service.messages = synthetic_mailbox(args.messages)
+    service.by_id = {m['id']: m for m in service.messages}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MessageCache(os.path.join(tmp, 'bench.sqlite3'), seed_size=args.messages)
+        index = SearchIndex(cache)
+        local_ops = GmailOperations(service=service, cache=cache, search_index=index)
+
+        started = time.perf_counter()
+        cache.sync(local_ops, force=True)
+        print(f"seeded {args.messages} messages in {time.perf_counter() - started:.1f} s")
+
+        for category in CATEGORY_KEYWORDS:
+            results, elapsed = timed(lambda: index.search_category(category, max_results=20), args.repeat)
+            print(f"local  category={category:9} results={len(results or []):3} median={elapsed:8.2f} ms")
+        for query in ['from:"sender 12"', 'subject:(weekly) is:unread', 'invoice for purchase -job']:
+            results, elapsed = timed(lambda: index.search_query(query, max_results=20), args.repeat)
+            print(f"local  query={query!r:32} results={len(results or []):3} median={elapsed:8.2f} ms")
+
+        remote_service = FakeGmailService(message_count=20, latency=args.latency, attachment_size=0)
+        remote_ops = GmailOperations(service=remote_service, single_flight=SingleFlight(ttl=0))
+        results, elapsed = timed(lambda: remote_ops.list_emails_by_category('shopping', max_results=20), 3)
+        print(f"remote category=shopping  results={len(results):3} median={elapsed:8.2f} ms "
+              f"({remote_service.round_trips // 3} round-trips per query at {args.latency * 1000:.0f} ms)")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Many clients ask for the same category at once ("show bank mails" after a
+morning notification). Compare the Gmail traffic and latency when every
+client's listing runs on its own with the single-flight layer, where
+concurrent identical listings share one fetch and recent results are reused.
+
+    python -m benchmarks.bench_single_flight --clients 50 --latency 0.1 --waves 3
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from app.gmail import GmailOperations
+from app.quota import QuotaScheduler
+from app.singleflight import SingleFlight
+from benchmarks.fake_gmail import FakeGmailService
+
+CATEGORY = 'bank'
+
+
+class NoSharing:
+    # The old behaviour: every listing is its own Gmail call.
+    def do(self, kind, key, fn):
+        return fn()
+
+    def stats(self):
+        return {}
+
+
+def run(single_flight, args):
+    service = FakeGmailService(message_count=200, latency=args.latency, attachment_size=0)
+    # Quota is left unlimited so latency reflects the fetches alone; units shows
+    # what each approach would have spent.
+    scheduler = QuotaScheduler(units_per_second=1e9, burst_units=1e9)
+    ops = GmailOperations(service=service, single_flight=single_flight, scheduler=scheduler)
+    samples = []
+    lock = threading.Lock()
+
+    def client(start):
+        start.wait()
+        started = time.perf_counter()
+        ops.list_emails_by_category(CATEGORY, max_results=20)
+        with lock:
+            samples.append(time.perf_counter() - started)
+
+    for _ in range(args.waves):
+        start = threading.Event()
+        threads = [threading.Thread(target=client, args=(start,)) for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        time.sleep(args.gap)
+    return samples, service.round_trips, scheduler.stats()['units'], single_flight.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50, help="clients asking at the same moment")
+    parser.add_argument('--waves', type=int, default=3)
+    parser.add_argument('--gap', type=float, default=1.0, help="seconds between waves")
+    parser.add_argument('--latency', type=float, default=0.1, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--ttl', type=float, default=5.0, help="seconds a result may be reused")
+    args = parser.parse_args()
+
+    for label, single_flight in (("no sharing", NoSharing()), ("single-flight", SingleFlight(ttl=args.ttl))):
+        samples, round_trips, units, stats = run(single_flight, args)
+        print(f"{label:13} listings={len(samples):4} round_trips={round_trips:5} quota_units={units:6} median={statistics.median(samples) * 1000:8.1f} ms "
+              f"max={max(samples) * 1000:8.1f} ms" + (f" dedup_ratio={stats['dedup_ratio']:.2f}" if stats else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Time from the final transcript to the first email of the answer, with and
+without partial transcripts sent while the command is "spoken" one word every
+--word-interval seconds. Each utterance names a different sender, so nothing is
+answered from an earlier round's results. Gmail is the fake service, and each
+query matches different messages, mostly beyond what the message cache seeds,
+so listed messages must be fetched.
+
+    python -m benchmarks.bench_speculation --rounds 8 --latency 0.1 --word-interval 0.15
+"""
+import argparse
+import statistics
+import time
+import zlib
+
+from benchmarks.server import load_server
+
+NAMES = ['alex', 'priya', 'john', 'sarah', 'maria', 'chen', 'omar', 'harsha', 'lena', 'ravi', 'tom', 'nina']
+# A command as the recognizer hears it, one interim result per word.
+TEMPLATES = ['find mails from {name}', 'read 10 emails from {name}', 'search emails from {name}']
+
+
+def first_email(client, started, timeout=30):
+    # Returns when the first email arrived, after the whole answer has.
+    first = None
+    while time.perf_counter() - started < timeout:
+        for packet in client.get_received():
+            now = time.perf_counter() - started
+            if packet['name'] in ('email_snippet', 'email_snippets') and first is None:
+                first = now
+            if packet['name'] in ('email_snippets_done', 'email_snippets'):
+                return first
+            if packet['name'] == 'agent_response' and packet['args'][0].get('type') in ('error', 'throttled'):
+                return None
+        time.sleep(0.0005)
+    return first
+
+
+def query_subset(q, message):
+    # Each query matches its own eighth of the mailbox, most of it beyond what the
+    # message cache seeds.
+    return zlib.crc32(f"{q}|{message['id']}".encode()) % 8 == 0
+
+
+def speak(client, command, partials, word_interval):
+    words = command.split()
+    for count in range(1, len(words) + 1):
+        if partials:
+            client.emit('partial_command_event', {'command': ' '.join(words[:count])})
+        time.sleep(word_interval)
+    started = time.perf_counter()
+    client.emit('process_command_event', {'command': command, 'stream': True})
+    return first_email(client, started)
+
+
+def run(module, label, partials, commands, args):
+    client = module.socketio.test_client(module.app)
+    client.get_received()
+    samples = [speak(client, command, partials, args.word_interval) for command in commands]
+    client.disconnect()
+    samples = [sample for sample in samples if sample is not None]
+    print(f"{label:18} n={len(samples):3} median={statistics.median(samples) * 1000:7.1f} ms "
+          f"p90={sorted(samples)[int(len(samples) * 0.9)] * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=8, help="utterances per configuration")
+    parser.add_argument('--latency', type=float, default=0.1, help="simulated seconds per Gmail round-trip")
+    parser.add_argument('--per-item-latency', type=float, default=0.002)
+    parser.add_argument('--word-interval', type=float, default=0.15, help="seconds between interim results")
+    parser.add_argument('--messages', type=int, default=2000, help="messages in the fake mailbox")
+    args = parser.parse_args()
+
+    env = {'VOICE_AGENT_ASYNC': '1', 'VOICE_AGENT_SPECULATE': '1', 'VOICE_AGENT_PREFETCH': '0', 'VOICE_AGENT_RESULT_TTL': '0'}
+    module, service = load_server(env=env, message_count=args.messages, latency=args.latency,
+                                  per_item_latency=args.per_item_latency)
+    module.backend_ready.wait(60)
+    service.query_filter = query_subset
+
+    utterances = [template.format(name=name) for name in NAMES for template in TEMPLATES]
+    speculator = module.speculator
+    for label, partials, offset in (("final only", False, 0), ("with partials", True, args.rounds)):
+        module.speculator = speculator if partials else None
+        calls = dict(service.calls)
+        run(module, label, partials, utterances[offset:offset + args.rounds], args)
+        made = {method: count - calls.get(method, 0) for method, count in service.calls.items()}
+        print(f"{'':18} gmail_calls={made}")
+    print(f"speculation: {speculator.stats()}")
+    module.command_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Cold-start time of app.py with eager loading against VOICE_AGENT_LAZY_START=1,
+measured in fresh interpreters: time until the module is imported (the server
+can accept connections) and time until the backend reports ready.
+
+    python -m benchmarks.bench_startup --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = """
+import json, time
+started = time.perf_counter()
+from benchmarks.server import load_server
+module, _ = load_server(latency=0.0)
+imported = time.perf_counter() - started
+module.backend_ready.wait()
+ready = time.perf_counter() - started
+print(json.dumps({'imported': imported, 'ready': ready}))
+"""
+
+
+def run(lazy):
+    env = dict(os.environ, VOICE_AGENT_LAZY_START='1' if lazy else '0')
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = total
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for lazy in (False, True):
+        samples = [run(lazy) for _ in range(args.repeat)]
+        imported = statistics.median(s['imported'] for s in samples)
+        ready = statistics.median(s['ready'] for s in samples)
+        process = statistics.median(s['process'] for s in samples)
+        print(f"{'lazy' if lazy else 'eager':5} accepting_connections={imported:6.2f} s ready={ready:6.2f} s process={process:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Simulate clients that start a send-email flow and walk away, then compare how
+many conversation states each store still holds, and what a get/set round
+costs. The Redis store runs against the in-process FakeRedis, so its traced
+memory is the fake's own (lazily expired) data, which real Redis keeps out of
+the server process.
+
+    python -m benchmarks.bench_state --clients 20000 --ttl 1 --max-entries 5000
+"""
+import argparse
+import time
+import tracemalloc
+
+from app.state import InMemoryConversationStore, RedisConversationStore
+from benchmarks.fake_redis import FakeRedis
+
+
+class DictStore:
+    # The old behaviour: a plain dict that only shrinks on disconnect, cancel or send.
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, sid):
+        return self._entries.get(sid)
+
+    def set(self, sid, state):
+        self._entries[sid] = state
+
+    def delete(self, sid):
+        self._entries.pop(sid, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def abandoned_flow(sid):
+    return {'intent': 'SEND_EMAIL', 'to': f"user{sid}@example.com", 'subject': None, 'body': None, 'step': 'waiting_for_subject'}
+
+
+def run(label, store, size, args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for index in range(args.clients):
+        sid = f"sid-{index}"
+        store.set(sid, abandoned_flow(index))
+        state = store.get(sid)
+        state['subject'] = 'hello'
+        store.set(sid, state)
+    elapsed = time.perf_counter() - started
+    time.sleep(args.ttl)
+    live = size(store)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:10} clients={args.clients:6} live_after_ttl={live:6} traced={current / 1024:9.1f} KiB "
+          f"per_command={elapsed / (args.clients * 3) * 1e6:6.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=20000)
+    parser.add_argument('--ttl', type=float, default=1.0)
+    parser.add_argument('--max-entries', type=int, default=5000)
+    args = parser.parse_args()
+
+    def live_entries(store):
+        # TTLCache drops expired entries lazily, on access.
+        return sum(store.get(f"sid-{index}") is not None for index in range(args.clients))
+
+    redis = FakeRedis()
+    run("dict", DictStore(), len, args)
+    run("memory", InMemoryConversationStore(max_entries=args.max_entries, ttl=args.ttl), live_entries, args)
+    run("redis", RedisConversationStore(redis, ttl=max(1, args.ttl)), lambda store: redis.dbsize(), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Time-to-first-result and time-to-last-result of a search command, with and
+without streaming, through the Socket.IO test client and a stubbed Gmail
+backend whose batch cost grows with the number of messages in it.
+
+    python -m benchmarks.bench_streaming --emails 50 --latency 0.1 --per-item-latency 0.004
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.server import load_server
+
+
+def measure(module, command, stream, timeout=60):
+    client = module.socketio.test_client(module.app)
+    client.get_received()
+    started = time.perf_counter()
+    client.emit('process_command_event', {'command': command, 'stream': stream})
+    first = last = None
+    while last is None and time.perf_counter() - started < timeout:
+        for packet in client.get_received():
+            now = time.perf_counter() - started
+            if packet['name'] in ('email_snippet', 'email_snippets') and first is None:
+                first = now
+            if packet['name'] in ('email_snippets_done', 'email_snippets'):
+                last = now
+        time.sleep(0.0005)
+    client.disconnect()
+    return first, last
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emails', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--per-item-latency', type=float, default=0.004)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # Async mode, so the test client sees events as they are emitted rather than
+    # all at once when the handler returns. Repeats are fetched again rather than
+    # reused from the single-flight result cache.
+    env = {'VOICE_AGENT_ASYNC': '1', 'VOICE_AGENT_RESULT_TTL': '0'}
+    module, _ = load_server(env=env, latency=args.latency, per_item_latency=args.per_item_latency)
+    # Measure the fetch path itself rather than repeat hits on the message cache.
+    module.gmail_ops.cache = None
+    command = f"search {args.emails} emails from alex"
+    for stream in (False, True):
+        samples = [measure(module, command, stream) for _ in range(args.repeat)]
+        first = statistics.median(s[0] for s in samples) * 1000
+        last = statistics.median(s[1] for s in samples) * 1000
+        print(f"stream={str(stream):5} first_result={first:8.1f} ms last_result={last:8.1f} ms")
+    module.command_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Time from command to first text response and to its first audio, for a client
+connected with ?tts=1, with server-side speech off, on with a cold audio cache,
+and on with the fixed prompts prewarmed. The synthesizer is a stand-in that
+takes --seconds-per-char to render, so pyttsx3 is not needed; Gmail is the fake
+service.
+
+    python -m benchmarks.bench_tts --rounds 5 --seconds-per-char 0.002
+"""
+import argparse
+import statistics
+import time
+
+from app.tts import SpeechRenderer
+from benchmarks.server import load_server
+
+# A send flow that is abandoned and a short listing: every answer but the
+# snippets is one of the prompts rendered at startup.
+SCRIPT = ['send an email', 'cancel', 'show my latest 3 emails']
+# Roughly what a 16 kHz, 16-bit mono WAV of speech at 15 characters per second takes.
+BYTES_PER_CHAR = 16000 * 2 // 15
+
+
+class FakeSynthesizer:
+    mime = 'audio/wav'
+
+    def __init__(self, seconds_per_char):
+        self.seconds_per_char = seconds_per_char
+        self.calls = 0
+
+    def synthesize(self, text):
+        self.calls += 1
+        time.sleep(len(text) * self.seconds_per_char)
+        return b'\0' * (len(text) * BYTES_PER_CHAR)
+
+
+def measure(client, command, want_audio, timeout=30):
+    started = time.perf_counter()
+    client.emit('process_command_event', {'command': command, 'stream': True})
+    first_text = first_audio = None
+    while time.perf_counter() - started < timeout:
+        for packet in client.get_received():
+            now = time.perf_counter() - started
+            if packet['name'] == 'agent_response' and first_text is None:
+                first_text = now
+            if packet['name'] == 'agent_audio' and first_audio is None:
+                first_audio = now
+        if first_text is not None and (first_audio is not None or not want_audio):
+            break
+        time.sleep(0.0005)
+    return first_text, first_audio
+
+
+def run(module, label, args, renderer=None, prewarm=False):
+    synthesizer = FakeSynthesizer(args.seconds_per_char)
+    if renderer:
+        module.speech_renderer = SpeechRenderer(lambda: synthesizer, on_audio=module.send_audio)
+        if prewarm:
+            module.speech_renderer.prewarm(module.SPOKEN_PROMPTS)
+            while module.speech_renderer.stats()['pending']:
+                time.sleep(0.01)
+    else:
+        module.speech_renderer = None
+    warm_calls = synthesizer.calls
+
+    client = module.socketio.test_client(module.app, query_string='tts=1')
+    client.get_received()
+    text_samples, audio_samples = [], []
+    for _ in range(args.rounds):
+        for command in SCRIPT:
+            first_text, first_audio = measure(client, command, renderer)
+            text_samples.append(first_text)
+            if first_audio is not None:
+                audio_samples.append(first_audio)
+    client.disconnect()
+
+    line = f"{label:16} first_text={statistics.median(text_samples) * 1000:7.1f} ms"
+    if renderer:
+        stats = module.speech_renderer.stats()
+        line += (f" first_audio={statistics.median(audio_samples) * 1000:7.1f} ms "
+                 f"(max {max(audio_samples) * 1000:7.1f}) renders={synthesizer.calls - warm_calls:3} "
+                 f"dropped={stats['dropped']:3} cache_hit_rate={stats['cache_hit_rate']:.2f}")
+        module.speech_renderer.close()
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seconds-per-char', type=float, default=0.002, help="stand-in synthesizer speed")
+    parser.add_argument('--latency', type=float, default=0.02, help="simulated seconds per Gmail round-trip")
+    args = parser.parse_args()
+
+    module, _ = load_server(env={'VOICE_AGENT_ASYNC': '1', 'VOICE_AGENT_PREFETCH': '0'}, latency=args.latency)
+    run(module, "tts off", args)
+    run(module, "tts cold cache", args, renderer=True)
+    run(module, "tts prewarmed", args, renderer=True, prewarm=True)
+    module.command_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+In-process stand-in for the Gmail discovery service, used by the benchmarks.
+Counts every HTTP round-trip so batched and unbatched paths can be compared,
+and can answer with 429s, at random or past a per-second quota, like Gmail does.
+Sent messages are kept, and can be found again with an rfc822msgid: query.
+"""
+import base64
+import copy
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from app.quota import DEFAULT_UNITS, QUOTA_UNITS
+
+ATTACHMENT_SIZE = 20000
+
+
+def rate_limit_error():
+    content = json.dumps({'error': {'code': 429, 'message': 'Rate Limit Exceeded',
+                                    'errors': [{'reason': 'rateLimitExceeded', 'domain': 'usageLimits'}]}})
+    return HttpError(httplib2.Response({'status': 429}), content.encode())
+
+
+def make_message(index, attachment_size=ATTACHMENT_SIZE):
+    message_id = f"{index:016x}"
+    return {
+        'id': message_id,
+        'threadId': message_id,
+        'snippet': f"Snippet for synthetic message number {index}",
+        'labelIds': ['INBOX'] if index % 3 else ['INBOX', 'UNREAD'],
+        'internalDate': str(1700000000000 - index * 60000),
+        'payload': {
+            'mimeType': 'multipart/mixed',
+            'headers': [
+                {'name': 'Subject', 'value': f"Synthetic subject {index}"},
+                {'name': 'From', 'value': f"Sender {index % 50} <sender{index % 50}@example.com>"},
+                {'name': 'To', 'value': 'me@example.com'},
+            ],
+            'parts': [
+                {'mimeType': 'text/plain', 'body': {'size': 64, 'data': 'SGVsbG8gZnJvbSB0aGUgZmFrZSBHbWFpbCBzZXJ2aWNlLg=='}},
+                {'mimeType': 'application/pdf', 'filename': 'statement.pdf', 'body': {'size': attachment_size, 'data': 'A' * attachment_size}},
+            ],
+        },
+    }
+
+
+class FakeRequest:
+    def __init__(self, service, method, handler):
+        self.service = service
+        self.method = method
+        self.handler = handler
+
+    def execute(self):
+        self.service._round_trip()
+        return self.service._call(self)
+
+
+class FakeBatch:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests))))
+
+    def execute(self):
+        self.service._round_trip(len(self.requests))
+        for request, callback, request_id in self.requests:
+            try:
+                response, exception = self.service._call(request), None
+            except Exception as e:
+                response, exception = None, e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Messages:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', q=None, maxResults=100, pageToken=None, **kwargs):
+        def handler():
+            if q and 'rfc822msgid:' in q:
+                message_id = q.split('rfc822msgid:')[1].split()[0]
+                return {'messages': [{'id': f"sent-{index + 1}"} for index, body in enumerate(self.service.sent)
+                                     if message_id in base64.urlsafe_b64decode(body['raw']).decode()][:1]}
+            matches = self.service.messages
+            if self.service.query_filter is not None and q:
+                matches = [m for m in matches if self.service.query_filter(q, m)]
+            start = int(pageToken or 0)
+            end = min(start + maxResults, len(matches))
+            page = [{'id': m['id'], 'threadId': m['threadId']} for m in matches[start:end]]
+            result = {'messages': page, 'resultSizeEstimate': len(page)}
+            if end < len(matches):
+                result['nextPageToken'] = str(end)
+            return result
+        return FakeRequest(self.service, 'messages.list', handler)
+
+    def get(self, userId='me', id=None, format='full', metadataHeaders=None, **kwargs):
+        def handler():
+            message = self.service.by_id[id]
+            if format != 'metadata':
+                return message
+            # Metadata responses carry only the requested headers and no MIME parts.
+            projected = {key: value for key, value in message.items() if key != 'payload'}
+            headers = [h for h in message['payload']['headers'] if not metadataHeaders or h['name'] in metadataHeaders]
+            projected['payload'] = {'headers': copy.deepcopy(headers)}
+            return projected
+        return FakeRequest(self.service, 'messages.get', handler)
+
+    def send(self, userId='me', body=None):
+        def handler():
+            self.service.sent.append(body)
+            return {'id': f"sent-{len(self.service.sent)}"}
+        return FakeRequest(self.service, 'messages.send', handler)
+
+
+class _History:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', startHistoryId=None, pageToken=None, **kwargs):
+        def handler():
+            start = int(startHistoryId)
+            records = [record for record in self.service.history if int(record['id']) > start]
+            return {'history': records, 'historyId': str(self.service.history_id)}
+        return FakeRequest(self.service, 'history.list', handler)
+
+
+class _Users:
+    def __init__(self, service):
+        self.service = service
+
+    def messages(self):
+        return _Messages(self.service)
+
+    def history(self):
+        return _History(self.service)
+
+    def getProfile(self, userId='me'):
+        def handler():
+            return {'emailAddress': 'me@example.com', 'historyId': str(self.service.history_id)}
+        return FakeRequest(self.service, 'getProfile', handler)
+
+
+class FakeGmailService:
+    def __init__(self, message_count=100, latency=0.0, attachment_size=ATTACHMENT_SIZE, per_item_latency=0.0,
+                 throttle_rate=0.0, quota_per_second=None, seed=0, query_filter=None):
+        self.messages = [make_message(i, attachment_size) for i in range(message_count)]
+        self.by_id = {m['id']: m for m in self.messages}
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.round_trips = 0
+        self.response_bytes = 0
+        self.calls = Counter()
+        self.sent = []
+        self.history_id = 1000
+        self.history = []
+        self.query_filter = query_filter
+        self.throttle_rate = throttle_rate
+        self.quota_per_second = quota_per_second
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._spent = deque()
+        self._quota_lock = threading.Lock()
+
+    def deliver(self, count=1):
+        # Simulates new mail arriving: newest messages go to the front of the mailbox.
+        for _ in range(count):
+            message = make_message(len(self.messages))
+            message['internalDate'] = str(int(self.messages[0]['internalDate']) + 60000 if self.messages else 1700000000000)
+            self.messages.insert(0, message)
+            self.by_id[message['id']] = message
+            self.history_id += 1
+            self.history.append({'id': str(self.history_id), 'messagesAdded': [{'message': {'id': message['id'], 'labelIds': message['labelIds']}}]})
+
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def _round_trip(self, items=1):
+        self.round_trips += 1
+        delay = self.latency + self.per_item_latency * items
+        if delay:
+            time.sleep(delay)
+
+    def _check_quota(self, method):
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS)
+        with self._quota_lock:
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+            if not throttled and self.quota_per_second is not None:
+                now = time.monotonic()
+                while self._spent and self._spent[0][0] <= now - 1.0:
+                    self._spent.popleft()
+                throttled = sum(spent for _, spent in self._spent) + units > self.quota_per_second
+                if not throttled:
+                    self._spent.append((now, units))
+            if throttled:
+                self.rate_limited += 1
+                raise rate_limit_error()
+
+    def _call(self, request):
+        self._check_quota(request.method)
+        self.calls[request.method] += 1
+        response = request.handler()
+        self.response_bytes += len(json.dumps(response))
+        return response
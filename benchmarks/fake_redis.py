@@ -0,0 +1,50 @@
+"""
+In-process stand-in for a Redis client, covering the get/set(ex=)/delete
+subset used by RedisConversationStore. Values are stored as bytes, like
+redis-py returns them, and keys expire after ex seconds.
+"""
+import threading
+import time
+
+
+class FakeRedis:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.commands = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _command(self):
+        self.commands += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get(self, key):
+        self._command()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        self._command()
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        self._command()
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def dbsize(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for _, expires_at in self._data.values() if expires_at is None or expires_at > now)
@@ -0,0 +1,28 @@
+"""
+Runs the real Socket.IO server on a port, with Gmail replaced by the fake
+service, as one worker process for bench_scaleout (or for poking at by hand).
+
+    python -m benchmarks.run_stub_server --port 5001 --latency 0.05
+"""
+import argparse
+
+from benchmarks.server import load_server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per Gmail round-trip")
+    args = parser.parse_args()
+
+    module, _ = load_server(message_count=args.messages, latency=args.latency)
+    # threading mode serves through werkzeug, which Flask-SocketIO only allows
+    # outside a terminal when asked to; eventlet and gevent ignore the flag.
+    module.socketio.run(module.app, host=args.host, port=args.port, debug=False, allow_unsafe_werkzeug=True,
+                        log_output=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Loads app.py as a module with GmailOperations backed by the fake service, so
+benchmarks can drive the real Socket.IO handlers without Google credentials.
+"""
+import importlib.util
+import os
+import tempfile
+
+from app.gmail import GmailOperations
+from benchmarks.fake_gmail import FakeGmailService
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def load_server(name='voice_agent_server', env=None, message_count=200, latency=0.05, per_item_latency=0.0):
+    os.environ.update(env or {})
+    os.environ.setdefault('VOICE_AGENT_CACHE_PATH', os.path.join(tempfile.mkdtemp(), 'bench_cache.sqlite3'))
+    os.environ.setdefault('VOICE_AGENT_OUTBOX_PATH', os.path.join(tempfile.mkdtemp(), 'bench_outbox.sqlite3'))
+
+    service = FakeGmailService(message_count=message_count, latency=latency, attachment_size=0, per_item_latency=per_item_latency)
+    original_init = GmailOperations.__init__
+
+    def fake_init(self, service_=None, *args, **kwargs):
+        original_init(self, service, *args, **kwargs)
+
+    GmailOperations.__init__ = fake_init
+    try:
+        spec = importlib.util.spec_from_file_location(name, APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        GmailOperations.__init__ = original_init
+    return module, service
@@ -4,7 +4,19 @@ const queryInput = document.getElementById('queryInput');
 const resultsPanel = document.getElementById('resultsPanel');
 const resultsList = document.getElementById('resultsList'); 
 
-const socket = io('http://127.0.0.1:5000'); 
+// Listings, and each streamed email, arrive as fields (see app/records.py), which
+// are smaller than the spoken sentences; formatSnippet rebuilds them.
+// Browsers without speech synthesis ask the server for audio (agent_audio events)
+// and play it instead; that needs the server started with VOICE_AGENT_TTS=1.
+const serverSpeech = !('speechSynthesis' in window);
+// A server with VOICE_AGENT_ACCESS_TOKENS set needs the page opened with
+// ?token=<access token> (and ?account=<name> for another of its accounts).
+const pageParams = new URLSearchParams(window.location.search);
+const socketQuery = { payload: 'columnar', tts: serverSpeech ? '1' : '0' };
+if (pageParams.get('account')) {
+    socketQuery.account = pageParams.get('account');
+}
+const socket = io('http://127.0.0.1:5000', { query: socketQuery, auth: { token: pageParams.get('token') || '' } }); 
 
 socket.on('connect', () => {
     console.log('Connected to backend WebSocket!');
@@ -12,7 +24,11 @@ socket.on('connect', () => {
 });
 
 socket.on('status', (data) => {
-    console.log('Backend Status:', data.message);
+    console.log('Backend Status:', data.message, 'ready:', data.ready);
+});
+
+socket.on('backend_ready', (data) => {
+    console.log('Backend ready:', data.ready);
 });
 
 socket.on('agent_response', (data) => {
@@ -25,14 +41,101 @@ socket.on('agent_response', (data) => {
     speakText(data.text);
 });
 
+socket.on('email_snippet', (data) => {
+    const snippet = data.format === 'columnar' ? formatSnippet(data.index, data.from, data.subject, data.snippet) : data.snippet;
+    console.log('Email Snippet received:', data.seq, snippet);
+
+    if (data.seq === 1) {
+        resultsList.innerHTML = '';
+    }
+
+    const li = document.createElement('li');
+    li.textContent = snippet;
+    resultsList.appendChild(li);
+
+    queueSpeech(snippet);
+
+    resultsPanel.style.display = 'block';
+    resultsList.scrollTop = resultsList.scrollHeight;
+});
+
+socket.on('email_snippets_done', (data) => {
+    console.log('All email snippets received:', data.count);
+});
+
+// Server-rendered audio is played in the order it arrives; a new command drops
+// whatever of the last answer has not been played yet.
+const audioQueue = [];
+let playingAudio = null;
+
+function playNextAudio() {
+    if (playingAudio || audioQueue.length === 0) {
+        return;
+    }
+    const url = URL.createObjectURL(audioQueue.shift());
+    playingAudio = new Audio(url);
+    micBtn.classList.add('speaking');
+    playingAudio.onended = playingAudio.onerror = () => {
+        URL.revokeObjectURL(url);
+        playingAudio = null;
+        if (audioQueue.length === 0) {
+            micBtn.classList.remove('speaking');
+        }
+        playNextAudio();
+    };
+    playingAudio.play().catch((error) => console.error('Audio playback error:', error));
+}
+
+function stopAudio() {
+    audioQueue.length = 0;
+    if (playingAudio) {
+        playingAudio.pause();
+        playingAudio.onended();
+    }
+}
+
+socket.on('agent_audio', (data) => {
+    console.log('Agent audio received:', data.kind, data.cached, data.text);
+    audioQueue.push(new Blob([data.audio], { type: data.mime }));
+    playNextAudio();
+});
+
+socket.on('email_status', (data) => {
+    console.log('Email status:', data.id, data.status, data.attempts);
+
+    let text = null;
+    if (data.status === 'sent') {
+        text = `Your email to ${data.to} has been sent.`;
+    } else if (data.status === 'failed') {
+        text = `Sorry, I couldn't send your email to ${data.to}.`;
+    }
+    if (text) {
+        updateResultsPanelWithText(text, 'agent');
+        queueSpeech(text);
+    }
+});
+
+function formatSnippet(index, sender, subject, snippet) {
+    return `Email ${index} from ${sender}: ${subject} — ${snippet}`;
+}
+
+function snippetsFromPayload(data) {
+    if (data.format !== 'columnar') {
+        return data.snippets;
+    }
+    return data.subject.map((subject, i) =>
+        formatSnippet(data.first_index + i, data.senders[data.from[i]], subject, data.snippet[i]));
+}
+
 socket.on('email_snippets', (data) => {
-    console.log('Email Snippets received:', data.snippets);
+    const snippets = snippetsFromPayload(data);
+    console.log('Email Snippets received:', snippets);
     
     resultsList.innerHTML = ''; 
 
     let fullTextToSpeak = "";
 
-    data.snippets.forEach((snippet, index) => {
+    snippets.forEach((snippet, index) => {
         const li = document.createElement('li');
         li.textContent = snippet;
         resultsList.appendChild(li);
@@ -78,6 +181,25 @@ function speakText(text) {
 }
 
 
+// Unlike speakText, does not interrupt what is already being spoken, so streamed
+// snippets are read out one after another as they arrive.
+function queueSpeech(text) {
+    if (!('speechSynthesis' in window)) {
+        console.warn('Web Speech API (SpeechSynthesis) not supported in this browser.');
+        return;
+    }
+    const utterance = new SpeechSynthesisUtterance(text);
+    utterance.lang = 'en-US';
+    utterance.onstart = () => micBtn.classList.add('speaking');
+    utterance.onend = () => {
+        if (!window.speechSynthesis.pending) {
+            micBtn.classList.remove('speaking');
+        }
+    };
+    window.speechSynthesis.speak(utterance);
+}
+
+
 function updateResultsPanelWithText(text, sender) {
     const li = document.createElement('li');
     li.textContent = `${sender === 'user' ? 'You' : 'Agent'}: ${text}`; 
@@ -91,7 +213,8 @@ function sendCommand() {
     if (command) {
         console.log('Sending text command:', command);
         updateResultsPanelWithText(command, 'user'); 
-        socket.emit('process_command_event', { command: command }); 
+        stopAudio();
+        socket.emit('process_command_event', { command: command, stream: true }); 
         queryInput.value = ''; 
     }
 }
@@ -116,20 +239,33 @@ micBtn.addEventListener('click', () => {
     const recognition = new SpeechRecognition();
 
     recognition.lang = 'en-US';
-    recognition.interimResults = false;
+    // Interim results go to the server as partial_command_event, so it can start
+    // on the command before the final transcript arrives.
+    recognition.interimResults = true;
     recognition.maxAlternatives = 1;
+    let lastPartial = '';
 
     recognition.start();
     micBtn.classList.add('listening'); 
     console.log('Listening for command...');
 
     recognition.onresult = (event) => {
-        const transcript = event.results[0][0].transcript;
+        const result = event.results[0];
+        const transcript = result[0].transcript;
         queryInput.value = transcript;
+
+        if (!result.isFinal) {
+            if (transcript !== lastPartial) {
+                lastPartial = transcript;
+                socket.emit('partial_command_event', { command: transcript });
+            }
+            return;
+        }
         console.log('Recognized speech:', transcript);
 
         updateResultsPanelWithText(transcript, 'user'); 
-        socket.emit('process_command_event', { command: transcript });
+        stopAudio();
+        socket.emit('process_command_event', { command: transcript, stream: true });
 
         micBtn.classList.remove('listening'); 
     };
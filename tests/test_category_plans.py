@@ -0,0 +1,89 @@
+"""
+The category matcher that tags cached messages must agree with the FTS
+expressions of the same plans, and tags must follow changes to the keywords.
+
+    python -m unittest tests.test_category_plans
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app import category_plans, nlp_processor
+from app.cache import MessageCache
+from app.category_plans import CATEGORY_PLANS
+from app.gmail import GmailOperations
+from app.search_index import ORDER_BY_RANK, SearchIndex
+from app.singleflight import SingleFlight
+from benchmarks.bench_search_index import synthetic_mailbox
+from benchmarks.fake_gmail import FakeGmailService
+
+MESSAGES = 3000
+
+
+class CategoryTagsTest(unittest.TestCase):
+    def setUp(self):
+        self.service = FakeGmailService(message_count=0)
+        self.service.messages = synthetic_mailbox(MESSAGES)
+        self.service.by_id = {message['id']: message for message in self.service.messages}
+        self.path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite3')
+        self.cache = MessageCache(self.path, seed_size=MESSAGES)
+        self.addCleanup(self.cache.close)
+        self.index = SearchIndex(self.cache)
+        self.ops = GmailOperations(service=self.service, cache=self.cache, search_index=self.index,
+                                   single_flight=SingleFlight(ttl=0))
+        self.cache.sync(self.ops)
+
+    def ids(self, emails):
+        return {email.id for email in emails}
+
+    def test_tags_agree_with_fts_plans(self):
+        for category, plan in CATEGORY_PLANS.items():
+            if plan.fts_expression is None:
+                continue
+            with self.subTest(category=category):
+                tagged = self.cache.lookup_category(category, MESSAGES)
+                ranked = self.index.search_category(category, MESSAGES, order_by=ORDER_BY_RANK)
+                self.assertTrue(tagged)
+                self.assertEqual(self.ids(tagged), self.ids(ranked))
+
+    def test_category_listing_is_answered_from_tags(self):
+        listed = self.service.calls['messages.list']
+        emails = self.ops.list_emails_by_category('bank', max_results=10)
+
+        self.assertEqual(len(emails), 10)
+        self.assertEqual(self.service.calls['messages.list'], listed)
+        for email in emails:
+            self.assertIn('bank', category_plans.category_matcher.categorize(email))
+
+    def test_keyword_changes_retag_the_cache(self):
+        original = nlp_processor.CATEGORY_KEYWORDS['finance']
+        self.addCleanup(nlp_processor.invalidate_command_cache)
+        self.addCleanup(nlp_processor.CATEGORY_KEYWORDS.__setitem__, 'finance', original)
+
+        nlp_processor.CATEGORY_KEYWORDS['finance'] = ['from:hdfcbank.com']
+        nlp_processor.invalidate_command_cache()
+
+        tagged = self.cache.lookup_category('finance', MESSAGES)
+        self.assertTrue(tagged)
+        self.assertTrue(all('hdfcbank.com' in email.sender for email in tagged))
+        self.assertEqual(self.ids(tagged), self.ids(self.index.search_category('finance', MESSAGES, order_by=ORDER_BY_RANK)))
+
+    def test_caches_from_before_tagging_are_tagged_on_open(self):
+        self.cache.close()
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE old AS SELECT id, thread_id, subject, sender, snippet, label_ids, internal_date FROM messages")
+        conn.execute("DROP TABLE messages")
+        conn.execute("ALTER TABLE old RENAME TO messages")
+        conn.execute("DELETE FROM sync_state WHERE key = 'categories_signature'")
+        conn.commit()
+        conn.close()
+
+        self.cache = MessageCache(self.path, seed_size=MESSAGES)
+        self.assertEqual(len(self.cache.lookup_category('travel', MESSAGES)),
+                         sum('travel' in category_plans.category_matcher.categorize(self.ops._parse_message(message))
+                             and 'INBOX' in message['labelIds'] for message in self.service.messages))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+QuotaScheduler against the fake Gmail service answering with 429s: rate limits
+are retried with growing backoff, GmailThrottledError surfaces once retries run
+out, and the token bucket makes callers wait for quota.
+
+    python -m unittest tests.test_quota
+"""
+import time
+import unittest
+from unittest import mock
+
+from app.gmail import GmailOperations
+from app.quota import GmailThrottledError, QuotaScheduler, TokenBucket
+from app.singleflight import SingleFlight
+from benchmarks.fake_gmail import FakeGmailService, rate_limit_error
+
+BASE_DELAY = 0.01
+real_sleep = time.sleep
+
+
+class FlakyRequest:
+    # Fails with a 429 the first `failures` times it is executed.
+    def __init__(self, failures):
+        self.failures = failures
+        self.executions = 0
+
+    def execute(self):
+        self.executions += 1
+        if self.executions <= self.failures:
+            raise rate_limit_error()
+        return {'ok': True}
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        # Sleeps really happen (the penalty a 429 puts on the bucket has to run out),
+        # but are recorded.
+        self.sleeps = []
+
+        def sleep(delay):
+            self.sleeps.append(delay)
+            real_sleep(delay)
+
+        patcher = mock.patch('app.quota.time.sleep', side_effect=sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate_limits_are_retried_with_backoff(self):
+        scheduler = QuotaScheduler.unlimited(base_delay=BASE_DELAY, max_retries=4)
+        request = FlakyRequest(failures=3)
+
+        self.assertEqual(scheduler.execute('me', 'messages.list', request), {'ok': True})
+
+        self.assertEqual(request.executions, 4)
+        self.assertEqual(scheduler.stats()['retries'], 3)
+        self.assertEqual(scheduler.stats()['rate_limited'], 3)
+        # Each delay is the exponential step plus up to as much jitter again; shorter
+        # sleeps are the scheduler waiting out what is left of its own penalty.
+        backoffs = [delay for delay in self.sleeps if delay >= BASE_DELAY]
+        self.assertEqual(len(backoffs), 3)
+        for attempt, delay in enumerate(backoffs, 1):
+            step = BASE_DELAY * 2 ** (attempt - 1)
+            self.assertGreaterEqual(delay, step)
+            self.assertLessEqual(delay, 2 * step)
+
+    def test_rate_limit_pauses_the_whole_account(self):
+        scheduler = QuotaScheduler.unlimited(base_delay=BASE_DELAY)
+        scheduler.execute('me', 'messages.list', FlakyRequest(failures=1))
+
+        self.assertEqual(scheduler.bucket('me').wait_time(0), 0.0)
+        scheduler.throttle('me', attempt=5)
+        self.assertGreater(scheduler.bucket('me').wait_time(0), 0.0)
+        self.assertEqual(scheduler.bucket('other').wait_time(0), 0.0)
+
+    def test_throttled_error_once_retries_run_out(self):
+        scheduler = QuotaScheduler.unlimited(base_delay=BASE_DELAY, max_retries=2)
+        request = FlakyRequest(failures=10)
+
+        with self.assertRaises(GmailThrottledError) as raised:
+            scheduler.execute('me', 'messages.list', request)
+
+        self.assertEqual(request.executions, 3)
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertEqual(scheduler.stats()['throttled'], 1)
+
+    def test_list_emails_against_a_throttling_fake(self):
+        service = FakeGmailService(message_count=20, attachment_size=0, throttle_rate=0.3, seed=1)
+        scheduler = QuotaScheduler.unlimited(base_delay=BASE_DELAY, max_retries=20)
+        ops = GmailOperations(service=service, scheduler=scheduler, max_batch_retries=20, single_flight=SingleFlight(ttl=0))
+
+        emails = ops.list_emails('in:inbox', max_results=20)
+
+        self.assertEqual(len(emails), 20)
+        self.assertGreater(service.rate_limited, 0)
+        self.assertEqual(scheduler.stats()['throttled'], 0)
+
+    def test_list_emails_raises_when_gmail_keeps_refusing(self):
+        service = FakeGmailService(message_count=20, attachment_size=0, throttle_rate=1.0)
+        ops = GmailOperations(service=service, scheduler=QuotaScheduler.unlimited(base_delay=BASE_DELAY, max_retries=2),
+                              single_flight=SingleFlight(ttl=0))
+
+        with self.assertRaises(GmailThrottledError):
+            ops.list_emails('in:inbox', max_results=20)
+        self.assertEqual(service.rate_limited, 3)
+
+
+class BucketTest(unittest.TestCase):
+    def test_reservations_wait_for_refill(self):
+        bucket = TokenBucket(rate=100, capacity=10)
+
+        self.assertEqual(bucket.reserve(10, max_wait=1), 0.0)
+        self.assertAlmostEqual(bucket.reserve(5, max_wait=1), 0.05, delta=0.01)
+        # Queued behind the first reservation, so twice as long.
+        self.assertAlmostEqual(bucket.reserve(5, max_wait=1), 0.10, delta=0.01)
+        self.assertIsNone(bucket.reserve(500, max_wait=1))
+
+    def test_scheduler_delays_callers_past_the_burst(self):
+        scheduler = QuotaScheduler(units_per_second=100, burst_units=5)
+        request = FlakyRequest(failures=0)
+
+        started = time.monotonic()
+        for _ in range(4):
+            scheduler.execute('me', 'messages.list', request)
+        elapsed = time.monotonic() - started
+
+        # The burst covers the first call; the other three wait 5 units / 100 per second each.
+        self.assertGreaterEqual(elapsed, 0.14)
+        self.assertAlmostEqual(scheduler.stats()['waited_seconds'], 0.15, delta=0.02)
+
+    def test_scheduler_refuses_waits_past_max_wait(self):
+        scheduler = QuotaScheduler(units_per_second=1, burst_units=5, max_wait=0.5)
+        scheduler.execute('me', 'messages.list', FlakyRequest(failures=0))
+
+        with self.assertRaises(GmailThrottledError) as raised:
+            scheduler.execute('me', 'messages.list', FlakyRequest(failures=0))
+        self.assertGreater(raised.exception.retry_after, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()